@@ -0,0 +1,154 @@
+#
+# Benchmark of sound payload codecs.
+#
+"""
+Benchmark of sound payload codecs.
+
+Reports, for each available codec, the bytes sent on the wire (after
+base64 encoding for transport) and the time taken to encode and decode
+each sound in a corpus.  The corpus is the sound files given on the
+command line, or a set of synthetic sounds if none are given.
+
+Usage:
+    python -m g2client.bench.codec_bench [options] [file ...]
+"""
+import sys
+import os
+import io
+import math
+import time
+import wave
+import base64
+import random
+import struct
+from argparse import ArgumentParser
+
+from g2client.util import sndcodec
+
+
+def make_wav(duration=1.0, rate=16000, channels=1, noise=0.0, freq=880.0):
+    """Return a 16-bit WAV file holding a tone, with optional noise."""
+    rnd = random.Random(0)
+    nframes = int(duration * rate)
+    samples = []
+    for i in range(nframes):
+        val = 0.5 * math.sin(2 * math.pi * freq * i / rate)
+        val += noise * (rnd.random() - 0.5)
+        samples.extend([int(val * 32767 * 0.9)] * channels)
+    buf = io.BytesIO()
+    out_f = wave.open(buf, 'wb')
+    out_f.setnchannels(channels)
+    out_f.setsampwidth(2)
+    out_f.setframerate(rate)
+    out_f.writeframes(struct.pack('<%dh' % len(samples), *samples))
+    out_f.close()
+    return buf.getvalue()
+
+
+def make_au(duration=1.0, rate=8000, freq=440.0):
+    """Return an 8-bit mu-law AU file holding a tone."""
+    nframes = int(duration * rate)
+    data = bytearray(nframes)
+    for i in range(nframes):
+        val = math.sin(2 * math.pi * freq * i / rate)
+        # crude mu-law style companding; fine for benchmarking purposes
+        mag = int(127 * math.log(1 + 255 * abs(val)) / math.log(256))
+        data[i] = (0x7f - mag) | (0x80 if val >= 0 else 0)
+    header = struct.pack('>6I', 0x2e736e64, 24, nframes, 1, rate, 1)
+    return header + bytes(data)
+
+
+def get_corpus(paths):
+    """Return a list of (name, format, data) for the benchmark."""
+    corpus = []
+    if len(paths) == 0:
+        corpus.append(('beep.wav', 'wav', make_wav(duration=0.3)))
+        corpus.append(('tone.wav', 'wav', make_wav(duration=3.0)))
+        corpus.append(('noisy.wav', 'wav', make_wav(duration=3.0, noise=0.3)))
+        corpus.append(('stereo.wav', 'wav', make_wav(duration=2.0,
+                                                       rate=44100,
+                                                       channels=2)))
+        corpus.append(('alarm.au', 'au', make_au(duration=2.0)))
+        return corpus
+
+    for path in paths:
+        name = os.path.basename(path)
+        format = os.path.splitext(name)[1][1:].lower()
+        with open(path, 'rb') as in_f:
+            corpus.append((name, format, in_f.read()))
+    return corpus
+
+
+def run_codec(name, data, format, repeat):
+    """Encode and decode `data` with codec `name` `repeat` times.
+    Returns a dict of results, or None if the codec does not apply.
+    """
+    try:
+        time_start = time.perf_counter()
+        for i in range(repeat):
+            buf = sndcodec.encode(name, data, format=format)
+        time_enc = (time.perf_counter() - time_start) / repeat
+
+    except sndcodec.CodecError:
+        return None
+
+    time_start = time.perf_counter()
+    for i in range(repeat):
+        res = sndcodec.decode(name, buf)
+    time_dec = (time.perf_counter() - time_start) / repeat
+
+    if bytes(res) != bytes(data):
+        raise sndcodec.CodecError("codec %s failed round trip" % (name))
+
+    return dict(codec=name, size=len(data), encoded=len(buf),
+                wire=len(base64.b64encode(buf)),
+                encode_ms=time_enc * 1000.0, decode_ms=time_dec * 1000.0)
+
+
+def main(options, args):
+    corpus = get_corpus(args)
+    codecs = options.codecs.split(',') if options.codecs else \
+        sndcodec.get_codec_names()
+
+    totals = {}
+    fmt = "%-14s %-9s %9s %9s %7s %10s %10s"
+    print(fmt % ('sound', 'codec', 'bytes', 'wire', 'ratio',
+                 'enc(ms)', 'dec(ms)'))
+    for sndname, format, data in corpus:
+        for name in codecs:
+            res = run_codec(name, data, format, options.repeat)
+            if res is None:
+                print(fmt % (sndname, name, len(data), '-', '-', '-', '-'))
+                continue
+            print("%-14s %-9s %9d %9d %7.3f %10.3f %10.3f" % (
+                sndname, name, res['size'], res['wire'],
+                res['encoded'] / float(res['size']),
+                res['encode_ms'], res['decode_ms']))
+            total = totals.setdefault(name, dict(size=0, encoded=0, wire=0,
+                                                 encode_ms=0.0,
+                                                 decode_ms=0.0))
+            for key in total.keys():
+                total[key] += res[key]
+
+    print("")
+    print("totals (sounds each codec applies to):")
+    for name, total in sorted(totals.items()):
+        print("%-14s %-9s %9d %9d %7.3f %10.3f %10.3f" % (
+            '', name, total['size'], total['wire'],
+            total['encoded'] / float(total['size']),
+            total['encode_ms'], total['decode_ms']))
+
+
+if __name__ == '__main__':
+
+    argprs = ArgumentParser(description="Benchmark sound payload codecs")
+    argprs.add_argument("--codecs", dest="codecs", default=None,
+                        metavar="LIST",
+                        help="Benchmark the comma-separated LIST of codecs")
+    argprs.add_argument("-n", "--repeat", dest="repeat", type=int,
+                        default=10, metavar="NUM",
+                        help="Average times over NUM repetitions")
+
+    (options, args) = argprs.parse_known_args(sys.argv[1:])
+
+    main(options, args)
@@ -0,0 +1,330 @@
+#
+# Benchmark of the sound pipeline, from SoundSource to SoundSink.
+#
+"""
+Benchmark of the sound pipeline, from SoundSource to SoundSink.
+
+Runs a source and a sink in one process, connected by an in-memory
+stand-in for the Gen2 monitor, with a null audio backend in place of the
+sound device.  Measures:
+
+  throughput   messages/sec through the whole pipeline
+  contention   latency from sending to playing, per priority, for a
+               burst of sounds that play in real time
+  memory       memory held per sound waiting in the play queue
+  costs        encode/compress and decode costs across payload sizes
+
+Results can be written as JSON, and compared with the results of an
+earlier run.
+
+Usage:
+    python -m g2client.bench.pipeline_bench [options]
+"""
+import sys
+import time
+import json
+import random
+import struct
+import logging
+import platform
+import threading
+import tracemalloc
+from argparse import ArgumentParser
+
+from g2client import soundsink
+from g2client.util import audio, sndcodec
+from g2client.bench import standins
+from g2client.bench.codec_bench import make_wav
+
+tests = ('throughput', 'contention', 'memory', 'costs')
+
+
+def get_version():
+    try:
+        from g2client.version import version
+        return version
+    except ImportError:
+        return 'unknown'
+
+
+def variant(data, i):
+    """Return a copy of sound `data` differing in its last sample, so
+    that it is not found in the sink's cache.
+    """
+    return data[:-2] + struct.pack('<H', i & 0xffff)
+
+
+class Pipeline(object):
+    """A source and a sink connected through a LocalMonitor."""
+
+    def __init__(self, logger, backend=None, **kwdargs):
+        self.monitor = standins.LocalMonitor('bench.mon', logger)
+        self.monitor.start()
+        self.ev_quit = threading.Event()
+        self.sink = soundsink.SoundSink(monitor=self.monitor, logger=logger,
+                                        ev_quit=self.ev_quit, name='bench')
+        if backend is None:
+            backend = audio.NullBackend(logger)
+        self.sink.audio = self.sink.audio_fallback = backend
+        self.monitor.subscribe_cb(self.sink.anon_arr,
+                                  self.sink.get_channels(['sound']))
+        # our sink is the only one, and it advertises
+        kwdargs.setdefault('legacy_sinks', False)
+        self.source = soundsink.SoundSource(monitor=self.monitor,
+                                            logger=logger,
+                                            ev_quit=self.ev_quit,
+                                            channels=['sound'], **kwdargs)
+        standins.advertise_to(self.sink, self.source)
+        self.sink.start()
+
+    def wait_played(self, count, timeout=60.0):
+        time_end = time.time() + timeout
+        while time.time() < time_end:
+            if self.sink.getQueueStats()['played'] >= count:
+                return True
+            time.sleep(0.001)
+        return False
+
+    def stop(self):
+        self.sink.stop()
+        self.monitor.stop()
+
+
+def bench_throughput(logger, options):
+    data = make_wav(duration=0.1)
+    pipe = Pipeline(logger)
+    pipe.sink.scheduler.waitval = 0.0
+    try:
+        num = options.num
+        time_start = time.perf_counter()
+        for i in range(num):
+            pipe.source._playSound(variant(data, i), format='wav',
+                                   priority=20)
+        time_sent = time.perf_counter()
+        if not pipe.wait_played(num):
+            logger.warning("throughput: not all sounds were played")
+        time_done = time.perf_counter()
+    finally:
+        pipe.stop()
+
+    return dict(messages=num, payload_bytes=len(data),
+                send_per_sec=num / (time_sent - time_start),
+                msgs_per_sec=num / (time_done - time_start))
+
+
+def percentiles(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return dict(count=0)
+
+    def pct(p):
+        return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+    return dict(count=len(values), p50=pct(50), p95=pct(95),
+                max=values[-1])
+
+
+def bench_contention(logger, options):
+    # short sounds that take their real time to play
+    data = make_wav(duration=0.02)
+    backend = audio.CaptureBackend(logger, realtime=True)
+    pipe = Pipeline(logger, backend=backend)
+    rnd = random.Random(0)
+    priorities = [1, 10, 20, 50]
+    sent = {}
+    try:
+        num = min(options.num, 200)
+        for i in range(num):
+            priority = rnd.choice(priorities)
+            filename = 'p%d-%d.wav' % (priority, i)
+            sent[filename] = (priority, time.time())
+            pipe.source._playSound(variant(data, i), format='wav',
+                                   filename=filename, priority=priority)
+        if not pipe.wait_played(num):
+            logger.warning("contention: not all sounds were played")
+    finally:
+        pipe.stop()
+
+    latencies = dict([(priority, []) for priority in priorities])
+    for rec in backend.get_played():
+        priority, time_sent = sent[rec.filename]
+        latencies[priority].append(rec.time_start - time_sent)
+    return dict(messages=num,
+                latency=dict([(str(priority), percentiles(values))
+                              for priority, values in latencies.items()]))
+
+
+def bench_memory(logger, options):
+    data = make_wav(duration=0.5)
+    ev_gate = threading.Event()
+    backend = audio.NullBackend(logger)
+    play = backend.play
+
+    def gated_play(sound, ev_cancel=None):
+        # hold up the player, so that sounds pile up in the queue
+        ev_gate.wait()
+        return play(sound, ev_cancel=ev_cancel)
+
+    backend.play = gated_play
+    pipe = Pipeline(logger, backend=backend)
+    num = min(options.num, 500)
+    try:
+        tracemalloc.start()
+        snap_start = tracemalloc.take_snapshot()
+        for i in range(num):
+            pipe.source._playSound(variant(data, i), format='wav',
+                                   priority=20)
+        time_end = time.time() + 60.0
+        while time.time() < time_end:
+            stats = pipe.sink.getQueueStats()
+            if stats['queue_depth'] + int(stats['playing'] is not None) >= num:
+                break
+            time.sleep(0.01)
+        snap_end = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    finally:
+        ev_gate.set()
+        pipe.stop()
+
+    diff = sum([stat.size_diff
+                for stat in snap_end.compare_to(snap_start, 'filename')])
+    return dict(queued=num, payload_bytes=len(data),
+                bytes_per_sound=diff / float(num),
+                overhead_per_sound=diff / float(num) - len(data))
+
+
+def bench_costs(logger, options):
+    pipe = Pipeline(logger)
+    source, sink = pipe.source, pipe.sink
+    results = []
+    try:
+        for duration in (0.05, 0.5, 5.0, 30.0):
+            data = make_wav(duration=duration)
+            modes = [('plain', None, False), ('compress', None, True)]
+            modes.extend([(name, name, False)
+                          for name in sndcodec.get_codec_names()])
+            for mode, codec, compress in modes:
+                source.codec = codec
+                repeat = max(1, options.repeat * 100000 // len(data))
+                try:
+                    time_start = time.perf_counter()
+                    for i in range(repeat):
+                        buf, fields = source._encode_buf(
+                            data, format='wav', compress=compress)
+                    time_enc = (time.perf_counter() - time_start) / repeat
+
+                except sndcodec.CodecError:
+                    continue
+
+                time_start = time.perf_counter()
+                for i in range(repeat):
+                    sink._decode(buf, format='wav',
+                                 decompress=fields['compressed'],
+                                 codec=fields.get('codec', None))
+                time_dec = (time.perf_counter() - time_start) / repeat
+                results.append(dict(mode=mode, size=len(data),
+                                    wire=len(buf),
+                                    encode_ms=time_enc * 1000.0,
+                                    decode_ms=time_dec * 1000.0))
+    finally:
+        pipe.stop()
+    return results
+
+
+def flatten(results, prefix=''):
+    """Flatten nested results into a dict of dotted name -> number."""
+    flat = {}
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        items = []
+        for res in results:
+            # name list entries by their non-numeric values
+            name = '/'.join([str(res[key]) for key in sorted(res.keys())
+                             if isinstance(res[key], str)] +
+                            ['%s=%s' % (key, res[key])
+                             for key in ('size',) if key in res])
+            items.append((name, dict([(key, val)
+                                      for key, val in res.items()
+                                      if key != 'size'])))
+    else:
+        return {prefix: results}
+
+    for key, val in items:
+        name = '%s.%s' % (prefix, key) if prefix else str(key)
+        if isinstance(val, (int, float)) and not isinstance(val, bool):
+            flat[name] = val
+        elif isinstance(val, (dict, list)):
+            flat.update(flatten(val, prefix=name))
+    return flat
+
+
+def compare(old, new):
+    """Print the change in each result from `old` to `new`."""
+    flat_old = flatten(old['results'])
+    flat_new = flatten(new['results'])
+    print("%-60s %12s %12s %8s" % ('result', old['meta']['version'],
+                                   new['meta']['version'], 'change'))
+    for name in sorted(flat_new.keys()):
+        val_new = flat_new[name]
+        val_old = flat_old.get(name, None)
+        if val_old is None:
+            print("%-60s %12s %12.4g" % (name, '-', val_new))
+            continue
+        change = ''
+        if val_old != 0:
+            change = '%+.1f%%' % ((val_new - val_old) * 100.0 / val_old)
+        print("%-60s %12.4g %12.4g %8s" % (name, val_old, val_new, change))
+
+
+def main(options, args):
+    logger = logging.getLogger('pipeline_bench')
+    logging.basicConfig(level=logging.WARNING)
+
+    names = options.tests.split(',') if options.tests else tests
+    results = {}
+    for name in names:
+        fn = globals()['bench_%s' % name]
+        print("running %s..." % (name))
+        results[name] = fn(logger, options)
+
+    report = dict(meta=dict(version=get_version(), time=time.time(),
+                            python=platform.python_version(),
+                            platform=platform.platform(),
+                            num=options.num, repeat=options.repeat),
+                  results=results)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as out_f:
+            out_f.write(text)
+    else:
+        print(text)
+
+    if options.compare:
+        with open(options.compare, 'r') as in_f:
+            old = json.load(in_f)
+        compare(old, report)
+
+
+if __name__ == '__main__':
+
+    argprs = ArgumentParser(description="Benchmark the sound pipeline")
+    argprs.add_argument("--compare", dest="compare", default=None,
+                        metavar="FILE",
+                        help="Compare results with those saved in FILE")
+    argprs.add_argument("-n", "--num", dest="num", type=int, default=1000,
+                        metavar="NUM",
+                        help="Send NUM sounds in each test")
+    argprs.add_argument("-o", "--output", dest="output", default=None,
+                        metavar="FILE",
+                        help="Write results as JSON to FILE")
+    argprs.add_argument("--repeat", dest="repeat", type=int, default=10,
+                        metavar="NUM",
+                        help="Scale repetitions of timed operations by NUM")
+    argprs.add_argument("--tests", dest="tests", default=None,
+                        metavar="LIST",
+                        help="Run the comma-separated LIST of tests (%s)" % (
+                            ','.join(tests)))
+
+    (options, args) = argprs.parse_known_args(sys.argv[1:])
+
+    main(options, args)
@@ -0,0 +1,84 @@
+#
+# In-memory stand-ins for Gen2 services, for benchmarking.
+#
+"""
+In-memory stand-ins for Gen2 services, for benchmarking.
+
+`LocalMonitor` takes the place of a `Monitor.Monitor` connected to the
+Gen2 monitor hub: values set on a channel are delivered straight to the
+callbacks subscribed to it in this process.  A sound sink can fetch
+sounds published by reference from a source in the same process with
+`connect_proxy()`, in place of a remote object proxy.
+"""
+import time
+import threading
+
+from g2base import Task
+
+
+class LocalMonitor(object):
+
+    def __init__(self, name, logger, numthreads=20, ev_quit=None):
+        self.name = name
+        self.logger = logger
+        if ev_quit is None:
+            ev_quit = threading.Event()
+        self.ev_quit = ev_quit
+        self.threadPool = Task.ThreadPool(numthreads=numthreads,
+                                          logger=logger, ev_quit=ev_quit)
+        self.lock = threading.RLock()
+        # channel -> list of callbacks
+        self.subscribers = {}
+        self.num_msgs = 0
+
+    def get_threadPool(self):
+        return self.threadPool
+
+    def start(self, wait=True):
+        self.threadPool.startall(wait=wait)
+
+    def stop(self, wait=True):
+        self.threadPool.stopall(wait=wait)
+
+    def start_server(self, wait=True, port=None):
+        pass
+
+    def stop_server(self, wait=True):
+        pass
+
+    def publish_to(self, monitor, channels, options):
+        pass
+
+    def subscribe_remote(self, monitor, channels, options):
+        pass
+
+    def subscribe_cb(self, fn, channels):
+        with self.lock:
+            for channel in channels:
+                self.subscribers.setdefault(channel, []).append(fn)
+
+    def setvals(self, channels, path, **vals):
+        # NOTE: like the real monitor, a callback subscribed to several
+        # of `channels` is called once for each
+        payload = dict(name=path, time=time.time(), value=vals)
+        with self.lock:
+            self.num_msgs += 1
+            calls = [(fn, channel) for channel in channels
+                     for fn in self.subscribers.get(channel, [])]
+        for fn, channel in calls:
+            fn(payload, [path], [channel])
+
+
+def connect_proxy(sink, source):
+    """Let `sink` fetch sounds published by reference from `source`
+    directly, instead of through a remote object proxy.
+    """
+    with sink.lock_sound:
+        sink.proxies[source.svcname] = source
+
+
+def advertise_to(sink, source):
+    """Tell `source` about `sink`, as the sink's advertisements would."""
+    info = dict(sink.get_capabilities(), time_seen=time.time())
+    with source.lock:
+        source.sinks[info['name']] = info
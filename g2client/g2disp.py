@@ -7,12 +7,17 @@ Gen2 observation workstation client -- command line version
 import sys, time, os
 import threading
 import binascii
+import tempfile
+import functools
+import concurrent.futures
+from collections import OrderedDict, deque
 
-from g2base import ssdlog, myproc
+from g2base import ssdlog, myproc, Bunch
 from g2base.remoteObjects import remoteObjects as ro
 from g2base.remoteObjects import Monitor
 
 from g2client import soundsink
+from g2client.util import audio, supervisor, vncprobe, startup, health
 
 # Default ports
 default_svc_port = 19051
@@ -29,12 +34,170 @@ def error(msg, exitcode=0):
         sys.exit(exitcode)
 
 
+class SystemProxy(object):
+    """A proxy for service `svcname` of the Gen2 system with name servers
+    `rohosts`.  Unlike ro.remoteObjectProxy, it looks the service up on
+    those name servers itself rather than through the process-wide
+    remote objects state, so it keeps talking to its own system whatever
+    that state is pointed at.
+    """
+
+    def __init__(self, svcname, rohosts):
+        self.svcname = svcname
+        self.rohosts = list(rohosts)
+        self.lock = threading.Lock()
+        self.client = None
+
+    def _lookup(self):
+        errors = []
+        for host in self.rohosts:
+            try:
+                ns = ro.remoteObjectClient(host, ro.nameServicePort)
+                hosts = ns.getHosts(self.svcname)
+
+            except Exception as e:
+                errors.append("%s: %s" % (host, str(e)))
+                continue
+
+            if len(hosts) > 0:
+                svchost, svcport = hosts[0]
+                return ro.remoteObjectClient(svchost, svcport)
+            errors.append("%s: not registered" % (host))
+
+        raise ro.remoteObjectError("cannot find service '%s' (%s)" % (
+            self.svcname, '; '.join(errors)))
+
+    def _call(self, method, *args):
+        with self.lock:
+            if self.client is None:
+                self.client = self._lookup()
+            client = self.client
+        try:
+            return getattr(client, method)(*args)
+
+        except Exception:
+            # the service may have moved; look it up again next time
+            with self.lock:
+                if self.client is client:
+                    self.client = None
+            raise
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return functools.partial(self._call, method)
+
+
+class Gen2Connection(object):
+    """A connection to the Gen2 system with name servers `rohosts`: a
+    monitor of our own, subscribed to the sound feeds of the system's
+    central monitor hub and publishing to it.  Whatever arrives is
+    passed to `route_fn`, along with the connection.
+    """
+
+    def __init__(self, name, rohosts, logger, options, port, ev_quit,
+                 route_fn):
+        self.rohosts = rohosts
+        self.key = ','.join(rohosts)
+        self.logger = logger
+        self.options = options
+        self.port = port
+        self.route_fn = route_fn
+        self.monitor = Monitor.Monitor(name, logger,
+                                       numthreads=options.numthreads,
+                                       ev_quit=ev_quit)
+        self.server_started = False
+        self.time_connect = None
+        # (time, payload, names, channels) of what arrived in the last
+        # moments while this was a standby, to pass on if we switch to it
+        self.recent = deque()
+
+    def anon_arr(self, payload, names, channels):
+        self.route_fn(self, payload, names, channels)
+
+    def start(self, channels):
+        # NOTE: the remote objects subsystem must be initialized for our
+        # system when this is called, to find its monitor hub
+        self.monitor.subscribe_cb(self.anon_arr, channels)
+
+        # Startup monitor threadpool
+        with startup.timer.phase('monitor start [%s]' % (self.key)):
+            self.monitor.start(wait=True)
+            self.monitor.start_server(wait=True, port=self.port)
+            self.server_started = True
+
+        with startup.timer.phase('subscribe [%s]' % (self.key)):
+            # subscribe our monitor to the central monitor hub
+            self.monitor.subscribe_remote(self.options.monitor, channels,
+                                          ())
+
+            # publish to central monitor hub
+            self.monitor.publish_to(self.options.monitor,
+                                    ['sound', soundsink.sink_channel], {})
+        self.time_connect = time.time()
+
+    def stop_server(self):
+        if self.server_started:
+            self.logger.info("stopping monitor server for %s..." % (
+                self.key))
+            self.monitor.stop_server(wait=True)
+            self.server_started = False
+
+    def stop(self):
+        self.stop_server()
+        self.monitor.stop(wait=True)
+
+
 class g2Disp(object):
 
     def __init__(self, **kwdargs):
         self.__dict__.update(kwdargs)
         self.lock = threading.RLock()
-        self.procs = {}
+        # Our VNC viewers, restarted if they die
+        self.supervisor = supervisor.ViewerSupervisor(
+            self.logger, self._spawn_viewer,
+            interval=kwdargs.get('viewer_interval', 2.0),
+            max_backoff=kwdargs.get('viewer_backoff', 60.0))
+        # Time (sec) to wait for viewers started together to connect
+        self.viewer_timeout = kwdargs.get('viewer_timeout', 10.0)
+        # viewer key -> file holding its VNC password
+        self.passwd_files = {}
+        # viewer key -> how the viewer was asked for
+        self.viewer_specs = {}
+
+        # Viewer settings are chosen from profiles according to the
+        # link to the VNC server, which is probed again now and then,
+        # unless a profile is named here
+        self.vnc_profile = kwdargs.get('vnc_profile', 'auto')
+        self.prober = vncprobe.LinkProber(self.logger)
+        self.probe_interval = kwdargs.get('probe_interval', 60.0)
+        self.ev_probe = threading.Event()
+        self.probe_thread = None
+
+        # Gen2 systems we are connected to, by name servers; sounds are
+        # played only from the active one (and, for `switch_grace` sec
+        # after a switch, from the one before it, so that sounds already
+        # on their way are not lost)
+        self.connections = OrderedDict()
+        self.active = None
+        self.prev_active = None
+        self.time_grace = 0.0
+        self.switch_grace = kwdargs.get('switch_grace', 0.5)
+        self.lock_switch = threading.Lock()
+        # set once start_server has connected us to our first system; the
+        # systems can't be added to or switched before then
+        self.ev_started = threading.Event()
+        self.start_timeout = kwdargs.get('start_timeout', 30.0)
+        self.route_stats = dict(routed=0, standby=0, switches=0,
+                                last_cutover=None)
+
+        # Round trip times to the hosts of the active system, probed in
+        # the background
+        self.health = health.HealthProbe(
+            self.logger,
+            interval=kwdargs.get('health_interval', 5.0),
+            warn_rtt=kwdargs.get('health_warn', health.default_warn_rtt),
+            bad_rtt=kwdargs.get('health_bad', health.default_bad_rtt))
 
         # Needed for starting our own tasks
         self.tag = 'g2disp'
@@ -46,7 +209,9 @@ class g2Disp(object):
     def start_server(self, rohosts, options):
         # Initialize remoteObjects subsystem
         try:
-            ro.init(rohosts)
+            with startup.timer.phase('ro.init'):
+                with self.lock:
+                    ro.init(rohosts)
 
         except ro.remoteObjectError as e:
             self.logger.error("Error initializing remote objects subsystem: %s" % \
@@ -56,45 +221,57 @@ class g2Disp(object):
         # channels we are interested in
         channels = ['sound']
 
+        self.options = options
         self.ev_quit = threading.Event()
         self.server_exited = threading.Event()
 
-        # Create a local pub sub instance
+        # Create a local pub sub instance, connected to the system we
+        # start with
         # mymon = PubSub.PubSub('%s.mon' % self.basename, self.logger,
         #                       numthreads=30)
-        monname = '%s.mon' % self.basename
-        mymon = Monitor.Monitor(monname, self.logger,
-                                numthreads=options.numthreads,
-                                ev_quit=self.ev_quit)
+        self.connections = OrderedDict()
+        conn = self._make_connection(rohosts)
+        mymon = conn.monitor
         self.monitor = mymon
 
-        self.soundsink = soundsink.SoundSink(monitor=mymon,
-                                             logger=self.logger,
-                                             ev_quit=self.ev_quit)
+        time_start = time.time()
+        self.soundsink = soundsink.SoundSink(
+            monitor=mymon, logger=self.logger, ev_quit=self.ev_quit,
+            backend=options.audio_backend,
+            cache_size=options.cache_size * 1024 * 1024,
+            cache_dir=options.cache_dir,
+            preempt_priority=options.preempt_priority,
+            stream_prebuffer=options.stream_prebuffer * 1024,
+            mix=options.mix, duck_gain=options.duck_gain,
+            suppress_window=options.suppress_window,
+            rate_limit=(options.rate_limit / 60.0
+                        if options.rate_limit else None),
+            rate_burst=options.rate_burst,
+            metrics_file=options.metrics_file,
+            metrics_interval=options.metrics_interval,
+            make_proxy=self._make_proxy,
+            name=self.basename)
         self.soundsource = soundsink.SoundSource(monitor=mymon,
                                                  logger=self.logger,
                                                  channels=['sound'])
+        # sounds for our destinations may come on their own sub-channels
+        self.channels = self.soundsink.get_channels(channels)
+        startup.timer.add('sound sink/source', time_start, time.time())
 
-        # Subscribe our callback functions to the local monitor
-        mymon.subscribe_cb(self.soundsink.anon_arr, channels)
-
-        self.mon_server_started = False
         self.ro_server_started = False
 
-        # Startup monitor threadpool
-        mymon.start(wait=True)
-        mymon.start_server(wait=True, port=options.monport)
-        self.mon_server_started = True
+        # Subscribe our callback functions to the local monitor, and
+        # connect it to the central monitor hub
+        conn.start(self.channels)
+        with self.lock:
+            self.active = conn
+            self.prev_active = None
 
         self.threadPool = self.monitor.get_threadPool()
 
-        # subscribe our monitor to the central monitor hub
-        mymon.subscribe_remote(options.monitor, channels, ())
-
-        # publish to central monitor hub
-        #mymon.subscribe(options.monitor, channels, ())
-        mymon.publish_to(options.monitor, ['sound'], {})
+        self.soundsink.start()
 
+        time_start = time.time()
         self.svc = ro.remoteObjectServer(svcname=self.basename,
                                          obj=self, logger=self.logger,
                                          port=options.port,
@@ -104,72 +281,482 @@ class g2Disp(object):
                                          usethread=True)
         self.svc.ro_start(wait=True)
         self.ro_server_started = True
+        startup.timer.add('ro server start', time_start, time.time())
+
+        self._set_health_targets(conn)
+        if self.health.interval:
+            self.health.start()
+
+        self.supervisor.start()
+        if self.vnc_profile == 'auto' and self.probe_interval:
+            self.ev_probe.clear()
+            self.probe_thread = threading.Thread(target=self.probe_loop,
+                                                 name='g2disp-probe')
+            self.probe_thread.daemon = True
+            self.probe_thread.start()
+        self.ev_started.set()
+
+        # Connect to the systems we may switch to, so that we can do so
+        # at once
+        for _rohosts in (getattr(options, 'standby', None) or []):
+            try:
+                self.addSystem(_rohosts)
+            except Exception as e:
+                self.logger.error("error connecting to %s: %s" % (
+                    _rohosts, str(e)))
+
+    def _make_connection(self, rohosts):
+        # Returns a new connection to the system with name servers
+        # `rohosts`, and adds it to ours
+        with self.lock:
+            index = len(self.connections)
+            conn = Gen2Connection('%s.mon' % self.basename, rohosts,
+                                  self.logger, self.options,
+                                  self.options.monport + index,
+                                  self.ev_quit, self._route)
+            self.connections[conn.key] = conn
+            return conn
+
+    def _set_health_targets(self, conn):
+        # Probe the links to system `conn`: a remote objects echo to the
+        # name server on each of its hosts, and to its monitor hub
+        targets = []
+        for host in conn.rohosts:
+            client = ro.remoteObjectClient(host, ro.nameServicePort)
+            targets.append(('ro:%s' % (host), 'ro', host,
+                            functools.partial(client.ro_echo, 0)))
+        proxy = SystemProxy(self.options.monitor, conn.rohosts)
+        targets.append(('monitor', 'monitor', conn.key,
+                        functools.partial(proxy.ro_echo, 0)))
+        self.health.set_targets(targets)
+
+    def _make_proxy(self, svcname):
+        # Proxies for the sound sink to fetch sounds from sources of the
+        # active system
+        with self.lock:
+            return SystemProxy(svcname, self.active.rohosts)
+
+    def _route(self, conn, payload, names, channels):
+        # Pass on what arrives from the active system
+        time_now = time.time()
+        with self.lock:
+            if not (conn is self.active or
+                    (conn is self.prev_active and
+                     time_now < self.time_grace)):
+                # keep it for a moment, in case we are switching to this
+                # system right now
+                conn.recent.append((time_now, payload, names, channels))
+                while conn.recent[0][0] < time_now - self.switch_grace:
+                    conn.recent.popleft()
+                self.route_stats['standby'] += 1
+                return
+            self.route_stats['routed'] += 1
+        self.soundsink.anon_arr(payload, names, channels)
+
+    def _wait_started(self):
+        # Wait for start_server to connect us to our first system
+        if not self.ev_started.wait(self.start_timeout):
+            raise ro.remoteObjectError("not connected to a system yet")
+
+    def addSystem(self, rohosts):
+        """Connect to the Gen2 system with name servers `rohosts` (a
+        comma-separated string or a list), ready to switch to it.
+        """
+        if isinstance(rohosts, str):
+            rohosts = rohosts.split(',')
+        self._wait_started()
+        with self.lock_switch:
+            conn = self.connections.get(','.join(rohosts), None)
+            if conn is not None:
+                return 0
+            conn = self._make_connection(rohosts)
+            self.logger.info("connecting to standby system %s" % (conn.key))
+            try:
+                # NOTE: the monitor finds the hub to subscribe to, and
+                # registers itself, through the process-wide remote
+                # objects state, so that is pointed at the standby system
+                # while it starts.  Nothing else of ours depends on that
+                # state: our proxies (SystemProxy) name their systems.
+                with self.lock:
+                    ro.init(rohosts)
+                conn.start(self.channels)
+
+            except Exception:
+                with self.lock:
+                    del self.connections[conn.key]
+                conn.stop()
+                raise
+
+            finally:
+                # keep remote objects pointed at the active system
+                with self.lock:
+                    ro.init(self.active.rohosts)
+        return 0
+
+    def switchSystem(self, rohosts):
+        """Make the Gen2 system with name servers `rohosts` (a
+        comma-separated string or a list) the active one, connecting to
+        it first if need be.  Returns the time (sec) taken to switch.
+        """
+        if isinstance(rohosts, str):
+            rohosts = rohosts.split(',')
+        key = ','.join(rohosts)
+        self._wait_started()
+        if key not in self.connections:
+            self.addSystem(rohosts)
+
+        time_start = time.time()
+        with self.lock_switch:
+            conn = self.connections[key]
+            if conn is self.active:
+                return 0.0
+            with self.lock:
+                self.prev_active = self.active
+                self.active = conn
+                time_now = time.time()
+                self.time_grace = time_now + self.switch_grace
+                # pass on what the system sent just before the switch
+                recent = [msg[1:] for msg in conn.recent
+                          if msg[0] >= time_now - self.switch_grace]
+                conn.recent.clear()
+                # sounds we publish go to the active system
+                self.monitor = conn.monitor
+                self.soundsink.monitor = conn.monitor
+                self.soundsource.monitor = conn.monitor
+            time_cutover = time.time() - time_start
+            self.route_stats['switches'] += 1
+            self.route_stats['last_cutover'] = time_cutover
+            for payload, names, channels in recent:
+                self.soundsink.anon_arr(payload, names, channels)
+            # sounds are fetched from sources of the new system
+            self.soundsink.clear_proxies()
+            with self.lock:
+                ro.init(rohosts)
+            self._set_health_targets(conn)
+
+        self.logger.info("switched to system %s in %.1f ms" % (
+            key, time_cutover * 1000.0))
+        # let the system's sources know about us
+        self.soundsink.advertise()
+        return time_cutover
+
+    def getSystems(self):
+        """Return the Gen2 systems we are connected to, and which one is
+        active.
+        """
+        with self.lock:
+            systems = [dict(rohosts=conn.key,
+                            active=(conn is self.active),
+                            time_connect=conn.time_connect)
+                       for conn in self.connections.values()]
+            return dict(systems=systems, **self.route_stats)
 
     def stop_server(self):
         self.logger.info("%s exiting..." % self.basename)
-        if self.mon_server_started:
-            self.logger.info("stopping monitor server...")
-            self.monitor.stop_server(wait=True)
+        self.ev_started.clear()
+        self.health.stop()
+        if self.probe_thread is not None:
+            self.ev_probe.set()
+            self.probe_thread.join()
+            self.probe_thread = None
+        self.supervisor.stop()
+        self.logger.info("stopping monitor servers...")
+        for conn in list(self.connections.values()):
+            conn.stop_server()
         if self.ro_server_started:
             self.logger.info("stopping remote object server...")
             self.svc.ro_stop(wait=True)
-        self.logger.info("stopping monitor client...")
-        self.monitor.stop(wait=True)
-
-
-    def viewerOn(self, localdisp, localgeom, remotedisp, passwd, viewonly):
-        self.muteOff()
+        self.logger.info("stopping monitor clients...")
+        for conn in list(self.connections.values()):
+            conn.monitor.stop(wait=True)
+        self.connections = OrderedDict()
+        self.soundsink.stop()
+        self.soundsource.stop()
+
+    def _spawn_viewer(self, cmdstr):
+        return myproc.myproc(cmdstr, usepg=True)
+
+    def _write_passwd(self, key, passwd):
+        # Write the (base64 encoded) VNC password for the viewer under
+        # `key` to a file of its own, so that viewers started at the same
+        # time don't share one.  Returns the path of the file.
         passwd = binascii.a2b_base64(passwd.encode())
-
-        passwd_file = '/tmp/v__%d' % os.getpid()
+        with self.lock:
+            passwd_file = self.passwd_files.get(key, None)
+            if passwd_file is None:
+                # created readable only by us
+                fd, passwd_file = tempfile.mkstemp(prefix='v__%d_' % (
+                    os.getpid()))
+                os.close(fd)
+                self.passwd_files[key] = passwd_file
         with open(passwd_file, 'wb') as out_f:
             out_f.write(passwd)
-
+        return passwd_file
+
+    def _remove_passwd(self, key):
+        with self.lock:
+            passwd_file = self.passwd_files.pop(key, None)
+        if passwd_file is not None and os.path.exists(passwd_file):
+            os.remove(passwd_file)
+
+    def set_vnc_profiles(self, profiles):
+        """Choose viewer settings from `profiles` (see
+        g2client.util.vncprobe).
+        """
+        self.prober.set_profiles(profiles)
+
+    def _choose_profile(self, remotedisp):
+        # Returns a tuple of the profile to use for a viewer of
+        # `remotedisp` and the result of probing the link to it (None if
+        # probed).  Probing takes a while, so the last result for the
+        # link is used, however old, as the probe loop keeps it fresh;
+        # if it was never probed the default profile is used to start
+        # with.
+        if self.vnc_profile != 'auto':
+            return self.prober.get_profile(self.vnc_profile), None
+        res = self.prober.get_last_result(remotedisp)
+        return self.prober.select(res), res
+
+    def _launch(self, key, spec):
+        # Start (or restart) the viewer for `spec` under `key`
         # VNC window
         cmdstr = "vncviewer -display %s -geometry=%s %s -passwd %s RemoteResize=0" % (
-            localdisp, localgeom, remotedisp, passwd_file)
-        if viewonly:
+            spec.localdisp, spec.localgeom, spec.remotedisp, spec.passwd_file)
+        if spec.viewonly:
             cmdstr += " -viewonly"
-        self.logger.info("viewer ON (-display %s -geometry=%s %s)" % (
-                localdisp, localgeom, remotedisp))
-
+        cmdstr += " " + vncprobe.get_options(spec.profile)
+        self.logger.info("viewer ON (-display %s -geometry=%s %s, %s)" % (
+                spec.localdisp, spec.localgeom, spec.remotedisp,
+                spec.profile['name']))
+
+        # NOTE: the password file is kept, as the viewer is restarted
+        # with it if it dies
+        self.supervisor.add(key, cmdstr,
+                            info=dict(display=spec.localdisp,
+                                      geometry=spec.localgeom,
+                                      remote=spec.remotedisp,
+                                      viewonly=bool(spec.viewonly),
+                                      profile=spec.profile['name'],
+                                      rtt=spec.rtt, jitter=spec.jitter))
+
+    def _viewerOn(self, localdisp, localgeom, remotedisp, passwd, viewonly):
+        # Start a viewer, returning its key
         key = localdisp + localgeom
+        passwd_file = self._write_passwd(key, passwd)
+        profile, res = self._choose_profile(remotedisp)
+        spec = Bunch.Bunch(localdisp=localdisp, localgeom=localgeom,
+                           remotedisp=remotedisp, passwd_file=passwd_file,
+                           viewonly=viewonly, profile=profile,
+                           rtt=(res.rtt if res is not None else None),
+                           jitter=(res.jitter if res is not None else None),
+                           pending=None)
+        with self.lock:
+            self.viewer_specs[key] = spec
+        self._launch(key, spec)
+        if self.vnc_profile == 'auto' and res is None:
+            # tune the viewer to the link once it has been probed
+            tune_thread = threading.Thread(target=self._tune,
+                                           args=[key, spec],
+                                           name='g2disp-tune')
+            tune_thread.daemon = True
+            tune_thread.start()
+        return key
+
+    def _viewerOff(self, localdisp, localgeom):
+        self.logger.info("viewer OFF (%s)" % (localdisp))
+        key = localdisp + localgeom
+        with self.lock:
+            self.viewer_specs.pop(key, None)
+        try:
+            self.supervisor.remove(key)
+        finally:
+            self._remove_passwd(key)
+
+    def _reprobe(self, key, spec, confirm=True):
+        # Probe the link of a viewer again, and restart it on another
+        # profile if that is called for (twice running, if `confirm`)
+        profile, res = self.prober.choose(spec.remotedisp)
+        if res is None:
+            # can't tell; leave it be
+            return
+        spec.rtt, spec.jitter = res.rtt, res.jitter
+        if profile['name'] == spec.profile['name']:
+            spec.pending = None
+            return
+        if confirm and spec.pending != profile['name']:
+            spec.pending = profile['name']
+            return
+
+        self.logger.info("link to %s changed (rtt %.1f ms); switching "
+                         "viewer %s from %s to %s" % (
+                             spec.remotedisp, res.rtt * 1000.0, key,
+                             spec.profile['name'], profile['name']))
+        spec.profile = profile
+        spec.pending = None
+        with self.lock:
+            if self.viewer_specs.get(key, None) is not spec:
+                # turned off in the meantime
+                return
+        self._launch(key, spec)
+
+    def _tune(self, key, spec):
+        # Probe the link of a viewer just started on the default profile
         try:
-            self.procs[key].killpg()
+            self._reprobe(key, spec, confirm=False)
+
         except Exception as e:
-            pass
+            self.logger.error("error probing viewer %s: %s" % (
+                key, str(e)), exc_info=True)
+
+    def probe_loop(self):
+        while not self.ev_probe.wait(self.probe_interval):
+            with self.lock:
+                specs = list(self.viewer_specs.items())
+            for key, spec in specs:
+                try:
+                    self._reprobe(key, spec)
+
+                except Exception as e:
+                    self.logger.error("error probing viewer %s: %s" % (
+                        key, str(e)), exc_info=True)
+
+    def _run_parallel(self, fn, specs):
+        # Call `fn` on each of `specs` at the same time, returning the
+        # list of results
+        if len(specs) == 0:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(specs),
+                thread_name_prefix='g2disp-viewer') as executor:
+            return list(executor.map(fn, specs))
+
+    def viewerOn(self, localdisp, localgeom, remotedisp, passwd, viewonly):
+        self.muteOff()
         try:
-            self.procs[key] = myproc.myproc(cmdstr, usepg=True)
+            self._viewerOn(localdisp, localgeom, remotedisp, passwd, viewonly)
         except Exception as e:
             self.logger.error("viewer on error: %s" % (str(e)))
-        #os.remove(passwd_file)
         return 0
 
+    def viewersOn(self, specs, passwd=None, timeout=None):
+        """
+        Start viewers on several screens at once.
+
+        Each item of `specs` is a sequence of (localdisp, localgeom,
+        remotedisp, viewonly), optionally followed by the password for
+        that screen, if it differs from `passwd`.  The viewers are
+        started together, and we wait up to `timeout` seconds for them
+        to connect.  Returns a list with a dict for each screen, telling
+        whether its viewer connected and how long (sec) it took.
+        """
+        self.muteOff()
+        if timeout is None:
+            timeout = self.viewer_timeout
+
+        def _on(spec):
+            localdisp, localgeom, remotedisp, viewonly = spec[:4]
+            res = dict(display=localdisp, geometry=localgeom,
+                       remote=remotedisp, ok=False, connect_time=None,
+                       error=None)
+            try:
+                key = self._viewerOn(localdisp, localgeom, remotedisp,
+                                     spec[4] if len(spec) > 4 else passwd,
+                                     viewonly)
+                res['connect_time'] = self.supervisor.wait_connected(
+                    key, timeout=timeout)
+                if res['connect_time'] is not None:
+                    res['ok'] = True
+                else:
+                    res['error'] = "not connected after %.1f sec" % (
+                        timeout)
+
+            except Exception as e:
+                self.logger.error("viewer on error: %s" % (str(e)))
+                res['error'] = str(e)
+            return res
+
+        return self._run_parallel(_on, specs)
+
     def viewerOff(self, localdisp, localgeom):
         self.muteOn()
-        self.logger.info("viewer OFF (%s)" % (localdisp))
         try:
-            key = localdisp + localgeom
-            self.procs[key].killpg()
-            del self.procs[key]
+            self._viewerOff(localdisp, localgeom)
         except Exception as e:
             self.logger.error("viewer off error: %s" % (str(e)))
         return 0
 
-    def allViewersOff(self):
-        self.logger.info("All viewers OFF")
-        for key in list(self.procs.keys()):
+    def viewersOff(self, specs):
+        """
+        Stop the viewers on several screens at once.  Each item of
+        `specs` is a sequence of (localdisp, localgeom).  Returns a list
+        with a dict for each screen, telling whether its viewer was
+        stopped.
+        """
+        self.muteOn()
+
+        def _off(spec):
+            localdisp, localgeom = spec[:2]
+            res = dict(display=localdisp, geometry=localgeom, ok=False,
+                       error=None)
             try:
-                self.procs[key].killpg()
-                del self.procs[key]
+                self._viewerOff(localdisp, localgeom)
+                res['ok'] = True
+
+            except KeyError:
+                res['error'] = "no viewer"
+
             except Exception as e:
-                self.logger.warn("viewer off error: %s" % (str(e)))
+                self.logger.error("viewer off error: %s" % (str(e)))
+                res['error'] = str(e)
+            return res
+
+        return self._run_parallel(_off, specs)
+
+    def allViewersOff(self):
+        self.logger.info("All viewers OFF")
+        with self.lock:
+            self.viewer_specs = {}
+            keys = list(self.passwd_files.keys())
+        try:
+            self.supervisor.remove_all()
+        except Exception as e:
+            self.logger.warn("viewer off error: %s" % (str(e)))
+        for key in keys:
+            self._remove_passwd(key)
         return 0
 
+    def getViewerStatus(self):
+        """Return the state, CPU and memory use and restart count of
+        each of our viewers, by display and geometry.
+        """
+        return self.supervisor.get_status()
+
+    def getLinkHealth(self):
+        """Return the status of the links to the hosts of the active
+        system, and the percentiles and recent history of the round trip
+        times (sec) of remote objects calls to each of them.
+        """
+        return self.health.get_health()
+
     def muteOn(self):
         self.soundsink.muteOn()
         return 0
 
+    def getPlaybackStats(self):
+        return self.soundsink.getPlaybackStats()
+
+    def getCacheStats(self):
+        return self.soundsink.getCacheStats()
+
+    def getSuppressStats(self):
+        return self.soundsink.getSuppressStats()
+
+    def getMetrics(self):
+        return self.soundsink.getMetrics()
+
+    def getQueueStats(self):
+        return self.soundsink.getQueueStats()
+
     def muteOff(self):
         self.soundsink.muteOff()
         return 0
@@ -183,6 +770,8 @@ class CmdLineUI(object):
     def ui(self, obj):
         obj.start_server(self.options.rohosts.split(','),
                          self.options)
+        if self.options.startup_report:
+            print(startup.timer.format_report())
 
         try:
             try:
@@ -199,15 +788,55 @@ class CmdLineUI(object):
 
 
 def add_options(argprs):
+    argprs.add_argument("--audio-backend", dest="audio_backend",
+                        default=soundsink.default_audio_backend,
+                        metavar="NAME", choices=audio.get_backend_names(),
+                        help="Use audio backend NAME to play sounds (%s)" % (
+                            '|'.join(audio.get_backend_names())))
     argprs.add_argument("--debug", dest="debug", default=False,
                         action="store_true",
                         help="Enter the pdb debugger on main()")
+    argprs.add_argument("--cache-dir", dest="cache_dir", default=None,
+                        metavar="DIR",
+                        help="Keep a persistent cache of decoded sounds in DIR")
+    argprs.add_argument("--cache-size", dest="cache_size", type=int,
+                        default=64, metavar="MB",
+                        help="Use MB megabytes of memory to cache sounds")
     argprs.add_argument("-c", "--channels", dest="channels", default='sound',
                         metavar="LIST",
                         help="Subscribe to the comma-separated LIST of channels")
     argprs.add_argument("-m", "--monitor", dest="monitor", default='monitor',
                         metavar="NAME",
                         help="Subscribe to feeds from monitor service NAME")
+    argprs.add_argument("--health-bad", dest="health_bad", type=float,
+                        default=health.default_bad_rtt * 1000.0,
+                        metavar="MS",
+                        help="Call the link to Gen2 bad if round trip "
+                        "times reach MS milliseconds")
+    argprs.add_argument("--health-interval", dest="health_interval",
+                        type=float, default=5.0, metavar="SEC",
+                        help="Probe the round trip time to the Gen2 hosts "
+                        "every SEC seconds (0 to never)")
+    argprs.add_argument("--health-warn", dest="health_warn", type=float,
+                        default=health.default_warn_rtt * 1000.0,
+                        metavar="MS",
+                        help="Warn of the link to Gen2 if round trip "
+                        "times reach MS milliseconds")
+    argprs.add_argument("--metrics-file", dest="metrics_file",
+                        default=None, metavar="FILE",
+                        help="Periodically write sound latency metrics to "
+                        "FILE (JSON if it ends in .json)")
+    argprs.add_argument("--metrics-interval", dest="metrics_interval",
+                        type=float, default=60.0, metavar="SEC",
+                        help="Write metrics every SEC seconds")
+    argprs.add_argument("--mix", dest="mix", action="store_true",
+                        default=False,
+                        help="Mix sounds of the same priority rather "
+                        "than queuing them (requires numpy)")
+    argprs.add_argument("--mix-duck-gain", dest="duck_gain", type=float,
+                        default=None, metavar="GAIN",
+                        help="With --mix, also mix in lower priority "
+                        "sounds, scaled by GAIN while better ones play")
     argprs.add_argument("--monport", dest="monport", type=int,
                         default=default_mon_port, metavar="PORT",
                         help="Use PORT for our monitor")
@@ -217,12 +846,60 @@ def add_options(argprs):
     argprs.add_argument("--port", dest="port", type=int,
                         default=default_svc_port, metavar="PORT",
                         help="Use PORT for our monitor")
+    argprs.add_argument("--preempt-priority", dest="preempt_priority",
+                        type=int, default=None, metavar="NUM",
+                        help="Sounds of priority NUM or better cut off "
+                        "lower priority sounds")
     argprs.add_argument("--profile", dest="profile", action="store_true",
                         default=False,
                         help="Run the profiler on main()")
+    argprs.add_argument("--suppress-window", dest="suppress_window",
+                        type=float, default=0.0, metavar="SEC",
+                        help="Play identical sounds arriving within SEC "
+                        "seconds only once")
+    argprs.add_argument("--stream-prebuffer", dest="stream_prebuffer",
+                        type=int, default=32, metavar="KB",
+                        help="Buffer KB kilobytes of a streamed sound "
+                        "before playing")
+    argprs.add_argument("--rate-burst", dest="rate_burst", type=int,
+                        default=5, metavar="NUM",
+                        help="Allow bursts of up to NUM sounds under "
+                        "--rate-limit")
+    argprs.add_argument("--rate-limit", dest="rate_limit", type=float,
+                        default=None, metavar="NUM",
+                        help="Play at most NUM sounds per minute with the "
+                        "same source and file name")
     argprs.add_argument("--rohosts", dest="rohosts", default='localhost',
                         metavar="HOSTLIST",
                         help="Hosts to use for remote objects connection")
+    argprs.add_argument("--startup-report", dest="startup_report",
+                        action="store_true", default=False,
+                        help="Print how long each phase of starting up "
+                        "took")
+    argprs.add_argument("--standby", dest="standby", action="append",
+                        default=[], metavar="HOSTLIST",
+                        help="Also connect to the Gen2 system with "
+                        "HOSTLIST, to be able to switch to it at once "
+                        "(may be given more than once)")
+    argprs.add_argument("--vnc-probe-interval", dest="probe_interval",
+                        type=float, default=60.0, metavar="SEC",
+                        help="Probe the links to VNC servers every SEC "
+                        "seconds, to change viewer profiles (0 to never)")
+    argprs.add_argument("--vnc-profile", dest="vnc_profile",
+                        default='auto', metavar="NAME",
+                        help="Use VNC profile NAME for viewers, rather "
+                        "than choosing one from the link (auto)")
+    argprs.add_argument("--viewer-backoff", dest="viewer_backoff",
+                        type=float, default=60.0, metavar="SEC",
+                        help="Wait at most SEC seconds before restarting "
+                        "a viewer that died")
+    argprs.add_argument("--viewer-interval", dest="viewer_interval",
+                        type=float, default=2.0, metavar="SEC",
+                        help="Check on viewers every SEC seconds")
+    argprs.add_argument("--viewer-timeout", dest="viewer_timeout",
+                        type=float, default=10.0, metavar="SEC",
+                        help="Wait up to SEC seconds for viewers started "
+                        "together to connect")
     ssdlog.addlogopts(argprs)
 
 
@@ -234,6 +911,14 @@ def main(options, args, ui):
     logger = ssdlog.make_logger(basename, options)
 
     # Make our callback object
-    mobj = g2Disp(logger=logger, basename=basename)
+    mobj = g2Disp(logger=logger, basename=basename,
+                  viewer_interval=options.viewer_interval,
+                  viewer_backoff=options.viewer_backoff,
+                  viewer_timeout=options.viewer_timeout,
+                  vnc_profile=options.vnc_profile,
+                  probe_interval=options.probe_interval,
+                  health_interval=options.health_interval,
+                  health_warn=options.health_warn / 1000.0,
+                  health_bad=options.health_bad / 1000.0)
 
     ui.ui(mobj)
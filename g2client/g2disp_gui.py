@@ -9,8 +9,9 @@ import re, os
 import logging
 import threading
 
+from collections import deque
+
 from ginga.gw import Widgets, Viewers, GwHelp
-from ginga.RGBImage import RGBImage
 from ginga.misc import Settings
 from ginga.util.paths import ginga_home
 
@@ -18,11 +19,15 @@ import queue as Queue
 from g2base import Bunch, ssdlog
 
 from g2client import g2disp, icons
+from g2client.util import startup, health
 
 
 # path to our icons
 module_path = os.path.split(icons.__file__)[0]
 
+# colors of the link health indicator, by status
+health_colors = dict(ok='palegreen', warn='orange', bad='red')
+
 
 class g2Disp_GUI(object):
 
@@ -35,6 +40,8 @@ class g2Disp_GUI(object):
         self.w = Bunch.Bunch()
 
         self.ev_quit = ev_quit
+        # thread connecting our servers, if they are still starting
+        self.server_thread = None
 
         # size (in lines) we will let log buffer grow to before
         # trimming
@@ -44,15 +51,23 @@ class g2Disp_GUI(object):
         self.rohosts = options.rohosts
 
         # read our configuration file
+        time_start = time.time()
         conf_file = os.path.join(ginga_home, 'g2disp.cfg')
         self.settings = Settings.SettingGroup(name='g2disp', logger=self.logger,
                                               preffile=conf_file)
         # this will throw an error if the configuration file is not present
         self.settings.load()
+        startup.timer.add('settings load', time_start, time.time())
 
         self.sum = self.settings.get('summit')
         self.sim = self.settings.get('simulator')
 
+        # VNC viewer profiles, if they are overridden
+        profiles = self.settings.get('vnc_profiles', None)
+        if profiles is not None:
+            obj.set_vnc_profiles(profiles)
+
+        time_start = time.time()
         self.app = Widgets.Application(logger=self.logger)
         self.app.add_callback('shutdown', self.quit)
         self.top = self.app.make_window("Gen2 Display Server")
@@ -119,12 +134,6 @@ class g2Disp_GUI(object):
 
         #fi.ui_set_active(True)
 
-        # load logo
-        logo_path = os.path.join(module_path, "gen2_logo.png")
-        logo = RGBImage(logger=self.logger)
-        logo.load_file(logo_path)
-        fi.set_image(logo)
-
         nb.add_widget(iw, "Top")
 
         vbox.add_widget(nb, stretch=1)
@@ -138,13 +147,35 @@ class g2Disp_GUI(object):
         btnbox.add_widget(quit)
         btnbox.add_widget(Widgets.Label(''))
 
+        # health of the link to the Gen2 system, and recent round trip
+        # times
+        self.w.health = Widgets.Label("Link: --")
+        self.w.health.set_tooltip("Round trip time (90th percentile) "
+                                  "to the Gen2 hosts")
+        btnbox.add_widget(self.w.health, stretch=0)
+        sp = Viewers.CanvasView(logger=self.logger)
+        sp.set_bg(0.1, 0.1, 0.1)
+        sp.set_desired_size(160, 24)
+        self.sparkline = sp
+        btnbox.add_widget(Viewers.GingaViewerWidget(viewer=sp), stretch=0)
+
         vbox.add_widget(btnbox, stretch=0)
 
-        # pop-up log file
+        # log messages are kept for the pop-up log window, which, like
+        # the system selector, is made the first time it is needed
+        self.w.log = None
+        self.w.selector = None
+        self.logbuf = deque([], self.logsize)
+        self.queue = Queue.Queue()
+        guiHdlr = ssdlog.QueueHandler(self.queue)
+        fmt = logging.Formatter(ssdlog.STD_FORMAT)
+        guiHdlr.setFormatter(fmt)
+        guiHdlr.setLevel(logging.INFO)
+        self.logger.addHandler(guiHdlr)
         self.tmr_log = GwHelp.Timer(1.0)
         self.tmr_log.add_callback('expired', self.logupdate)
-        self.create_logwindow()
-        self.create_selector()
+        self.tmr_health = GwHelp.Timer(2.0)
+        self.tmr_health.add_callback('expired', self.health_update)
 
         self.top.set_widget(vbox)
         self.top.show()
@@ -152,6 +183,103 @@ class g2Disp_GUI(object):
         if self.options.geometry:
             self.set_pos(self.options.geometry)
 
+        # load the logo once we are up
+        self.tmr_logo = GwHelp.Timer(0.0)
+        self.tmr_logo.add_callback('expired', lambda tmr: self.load_logo())
+        self.tmr_logo.set(0.01)
+        startup.timer.add('gui build', time_start, time.time())
+
+    def load_logo(self):
+        from ginga.RGBImage import RGBImage
+
+        with startup.timer.phase('logo load'):
+            logo_path = os.path.join(module_path, "gen2_logo.png")
+            logo = RGBImage(logger=self.logger)
+            logo.load_file(logo_path)
+            self.viewer.set_image(logo)
+
+    def draw_sparkline(self, history, res, color):
+        # plot the round trip times in `history`, lost probes as marks
+        # along the top, and the thresholds as dotted lines
+        canvas = self.sparkline.get_canvas()
+        canvas.delete_all_objects(redraw=False)
+        wd, ht = self.sparkline.get_window_size()
+        if len(history) == 0 or wd <= 1 or ht <= 1:
+            self.sparkline.redraw(whence=3)
+            return
+
+        rtts = [rtt for rtt in history if rtt is not None]
+        max_rtt = max([res['bad_rtt']] + rtts) * 1.1
+        dx = float(wd - 1) / max(1, len(history) - 1)
+
+        def _y(rtt):
+            return (ht - 1) - rtt / max_rtt * (ht - 1)
+
+        Line = canvas.get_draw_class('line')
+        Path = canvas.get_draw_class('path')
+        for rtt, linecolor in ((res['warn_rtt'], 'orange'),
+                               (res['bad_rtt'], 'red')):
+            canvas.add(Line(0, _y(rtt), wd - 1, _y(rtt), color=linecolor,
+                            linestyle='dash', coord='window'),
+                       redraw=False)
+
+        points = []
+        for i, rtt in enumerate(history):
+            if rtt is None:
+                canvas.add(Line(i * dx, 0, i * dx, 3, color='red',
+                                linewidth=2, coord='window'),
+                           redraw=False)
+                continue
+            points.append((i * dx, _y(rtt)))
+        if len(points) > 1:
+            canvas.add(Path(points, color=color, coord='window'),
+                       redraw=False)
+        self.sparkline.redraw(whence=3)
+
+    def health_update(self, tmr):
+        try:
+            res = self.obj.getLinkHealth()
+
+            # show the worst of the links
+            worst = None
+            for name, info in res['targets'].items():
+                if info['status'] is None:
+                    continue
+                key = (health.status_levels.index(info['status']),
+                       info['p90'] or 0.0)
+                if worst is None or key > worst[0]:
+                    worst = (key, name, info)
+
+            if worst is None:
+                self.w.health.set_text("Link: --")
+            else:
+                key, name, info = worst
+                status = info['status']
+                if info['p90'] is None:
+                    text = "Link: %s (no answer)" % (status.upper())
+                else:
+                    text = "Link: %s %.0f ms" % (status.upper(),
+                                                 info['p90'] * 1000.0)
+                self.w.health.set_text(text)
+                self.w.health.set_color(bg=health_colors[status])
+                self.w.health.set_tooltip(
+                    "%s: p50 %s, p90 %s, p99 %s ms, %.0f%% lost" % (
+                        name, self._fmt_ms(info['p50']),
+                        self._fmt_ms(info['p90']),
+                        self._fmt_ms(info['p99']), info['loss'] * 100.0))
+                self.draw_sparkline(info['history'], res,
+                                    health_colors[status])
+
+        except Exception as e:
+            self.logger.debug("error updating link health: %s" % (str(e)))
+
+        if not self.ev_quit.is_set():
+            tmr.set(2.0)
+
+    def _fmt_ms(self, rtt):
+        if rtt is None:
+            return '--'
+        return '%.1f' % (rtt * 1000.0)
 
     def create_logwindow(self):
         # pop-up log file
@@ -165,13 +293,10 @@ class g2Disp_GUI(object):
         tw = Widgets.TextArea(wrap=False, editable=False)
         tw.set_limit(self.logsize)
         self.w.logtw = tw
-
-        self.queue = Queue.Queue()
-        guiHdlr = ssdlog.QueueHandler(self.queue)
-        fmt = logging.Formatter(ssdlog.STD_FORMAT)
-        guiHdlr.setFormatter(fmt)
-        guiHdlr.setLevel(logging.INFO)
-        self.logger.addHandler(guiHdlr)
+        # what was logged before the window was made
+        if len(self.logbuf) > 0:
+            tw.append_text('\n'.join(self.logbuf) + '\n', autoscroll=True)
+            self.logbuf.clear()
 
         vbox.add_widget(tw, stretch=1)
 
@@ -194,6 +319,8 @@ class g2Disp_GUI(object):
 
     def showlog(self):
         # open log window
+        if self.w.log is None:
+            self.create_logwindow()
         self.w.log.show()
 
     def create_selector(self):
@@ -226,9 +353,21 @@ class g2Disp_GUI(object):
         return self.rohosts
 
     def restart_servers(self, rohosts):
-        self.obj.stop_server()
-        time.sleep(1.0)
-        self.obj.start_server(rohosts, self.options)
+        # switch over without tearing down our servers; systems we have
+        # been connected to before are switched to at once.  Connecting
+        # to a new one takes a while, so it is done off the GUI thread.
+        switch_thread = threading.Thread(
+            target=self._switch_system, name='g2disp-switch',
+            args=[rohosts])
+        switch_thread.daemon = True
+        switch_thread.start()
+
+    def _switch_system(self, rohosts):
+        try:
+            self.obj.switchSystem(rohosts)
+        except Exception as e:
+            self.logger.error("error switching to %s: %s" % (
+                ','.join(rohosts), str(e)))
 
     def _update_checkboxes(self):
         rohosts = self.rohosts.lower().split('.')[0]
@@ -242,6 +381,8 @@ class g2Disp_GUI(object):
 
         # Choose summit or simulator or other
         if name == 'other':
+            if self.w.selector is None:
+                self.create_selector()
             self.w.selector.show()
             return True
         self.rohosts = name
@@ -292,6 +433,9 @@ class g2Disp_GUI(object):
             while True:
                 msgstr = self.queue.get(block=False)
 
+                if self.w.log is None:
+                    self.logbuf.append(msgstr)
+                    continue
                 self.w.logtw.append_text(msgstr + '\n',
                                          autoscroll=True)
 
@@ -308,6 +452,9 @@ class g2Disp_GUI(object):
         if getattr(self, '_quitting', False):
             return False
         self._quitting = True
+        # don't tear down servers that are still starting
+        if self.server_thread is not None:
+            self.server_thread.join()
         self.obj.allViewersOff()
         self.logger.debug('stopping server')
         self.obj.stop_server()
@@ -324,12 +471,28 @@ class GraphicalUI(object):
         self.options = options
         self.ev_quit = threading.Event()
 
+    def start_server(self, obj, rohosts, ev_gui):
+        time_start = time.time()
+        obj.start_server(rohosts, self.options)
+        startup.timer.add('start_server', time_start, time.time())
+        if self.options.startup_report:
+            ev_gui.wait()
+            print(startup.timer.format_report())
+
     def ui(self, obj):
+        # connect our servers while the GUI is being built
+        ev_gui = threading.Event()
+        server_thread = threading.Thread(
+            target=self.start_server, name='g2disp-start',
+            args=[obj, self.options.rohosts.split(','), ev_gui])
+        server_thread.daemon = True
+        server_thread.start()
+
         g2disp = g2Disp_GUI(self.options, obj, self.ev_quit)
+        g2disp.server_thread = server_thread
+        ev_gui.set()
 
         g2disp.logupdate(g2disp.tmr_log)
-
-        rohosts = g2disp.get_rohosts().split(',')
-        obj.start_server(rohosts, self.options)
+        g2disp.tmr_health.set(2.0)
 
         g2disp.app.mainloop()
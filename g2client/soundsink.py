@@ -4,13 +4,19 @@ The Gen2 distributed sound system (SoundSink/SoundSource).
 import sys, os
 import time
 import threading
-import hashlib
-import tempfile
+import heapq
+import asyncio
+import functools
+import concurrent.futures
 import queue as Queue
+from collections import OrderedDict
 
 from g2base.remoteObjects import remoteObjects as ro
 from g2base.remoteObjects import Monitor
-from g2base import ssdlog, Task
+from g2base import ssdlog, Task, Bunch
+
+from g2client.util import (audio, soundcache, ttscache, sndcodec, mixer,
+                            suppress, metrics, aioengine, ttsproc, startup)
 
 
 # Default ports
@@ -20,6 +26,44 @@ default_mon_port = 15052
 # Sound device to use for audio when playing sounds locally
 default_sound_dev = "/dev/audio"
 
+# Audio backend to use for playing sounds locally
+default_audio_backend = 'pacat'
+
+# Memory (bytes) to use for caching decoded sounds
+default_cache_size = 64 * 1024 * 1024
+
+# Memory (bytes) a source uses to hold sounds that sinks may fetch by hash
+default_store_size = 64 * 1024 * 1024
+
+# Time (sec) a sink waits for a sound fetched by hash
+default_fetch_timeout = 10.0
+
+# Bytes of a streamed sound a sink buffers before starting to play it
+default_stream_prebuffer = 32 * 1024
+
+# Time (sec) a sink waits for a chunk of a streamed sound before
+# presuming it lost
+default_stream_timeout = 1.0
+
+# Destinations every sink plays, which sources publish on their own
+# sub-channels
+default_dsts = ['all', 'summit']
+
+# Channel on which sinks advertise their capabilities to sources
+sink_channel = 'soundsinks'
+
+# Interval (sec) between sink advertisements
+default_adv_interval = 30.0
+
+# Disk space (bytes) a source uses to cache synthesized speech
+default_tts_cache_size = 100 * 1024 * 1024
+
+# Time to live (sec) of sounds by priority, as a list of (priority, ttl):
+# a sound expires after the ttl of the first entry whose priority is the
+# same as or worse than its own, and sounds of worse priority than every
+# entry never expire.  e.g. [(10, 5.0), (50, 30.0)]
+default_ttls = []
+
 
 # TODO: put this in a utilities module
 def error(msg, exitcode=0):
@@ -31,6 +75,51 @@ def error(msg, exitcode=0):
         sys.exit(exitcode)
 
 
+def get_dst_channels(channels, dsts):
+    """Return the per-destination sub-channels of `channels` for the
+    destinations `dsts`.
+    """
+    return ['%s.%s' % (channel, dst) for channel in channels
+            for dst in sorted(dsts)]
+
+
+def get_decode(info):
+    """Return how to decode the payload of the sound message `info`,
+    for the `decode` parameter of SoundSink.playSound.
+    """
+    if info.get('encoding', None) == 'raw':
+        return 'raw'
+    return True
+
+
+def parse_ttls(spec):
+    """Parse a string of comma separated PRIORITY:TTL pairs into a list
+    of (priority, ttl) sorted by priority.
+    """
+    ttls = []
+    for item in spec.split(','):
+        item = item.strip()
+        if len(item) == 0:
+            continue
+        priority, ttl = item.split(':')
+        ttls.append((int(priority), float(ttl)))
+    return sorted(ttls)
+
+
+def get_raw(buf):
+    """Return the contents of a payload sent as raw bytes, however the
+    transport delivered it.
+    """
+    if isinstance(buf, (bytes, bytearray, memoryview)):
+        return buf
+    # e.g. an xmlrpc Binary wrapper
+    data = getattr(buf, 'data', None)
+    if data is not None:
+        return data
+    # a transport that can't carry bytes will have base64 encoded them
+    return ro.binary_decode(buf)
+
+
 class SoundBase(object):
 
     def __init__(self, **kwdargs):
@@ -71,57 +160,420 @@ class SoundBase(object):
         self.queue.put(filepath)
         return 0
 
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
 
 class SoundSource(SoundBase):
 
     def __init__(self, **kwdargs):
         super(SoundSource, self).__init__(**kwdargs)
 
+        # In hash reference mode, a sound that has already been published
+        # is sent only by its hash; sinks that lack it fetch it from us
+        # by calling fetchSound() on our service `svcname`.
+        self.svcname = kwdargs.get('svcname', None)
+        self.hashref = kwdargs.get('hashref', False)
+        if self.hashref and self.svcname is None:
+            raise ValueError("hash reference mode requires a service name")
+        # how we identify ourselves to sinks
+        self.src_name = self.svcname
+        if self.src_name is None:
+            self.src_name = '%s-%d' % (ro.get_myhost(short=True), os.getpid())
+        # hash -> transport buffer, least recently used first
+        self.store = OrderedDict()
+        self.store_bytes = 0
+        self.max_store_bytes = kwdargs.get('store_size', default_store_size)
+
+        # Codec for sound payloads: None for the legacy `compress` flag,
+        # 'auto' to choose adaptively among the codecs all sinks support,
+        # or the name of a codec
+        self.codec = kwdargs.get('codec', None)
+        if self.codec == 'legacy':
+            self.codec = None
+        self.selector = sndcodec.CodecSelector()
+        # Send payloads as raw bytes rather than base64 encoded, to
+        # sinks that all support it
+        self.raw = kwdargs.get('raw', False)
+        # sink name -> advertised capabilities
+        self.sinks = {}
+        # Sinks of older versions don't advertise, so we can't tell if
+        # any are listening; unless we are told there are none, we send
+        # them only what they can play
+        self.legacy_sinks = kwdargs.get('legacy_sinks', True)
+
+        # Sounds larger than this many bytes are streamed to sinks that
+        # support it in chunks of this size (None to disable)
+        self.stream_chunk_size = kwdargs.get('stream_chunk_size', None)
+        self.msg_count = 0
+        # destinations -> sequence number of the last message sent there
+        self.seqnums = {}
+
+        # Destinations we publish on their own sub-channels, so that
+        # sinks only receive the sounds meant for them
+        self.shard_dsts = set(kwdargs.get('shard_dsts', default_dsts))
+        # Don't send sounds for destinations whose sinks are all muted
+        self.skip_muted = kwdargs.get('skip_muted', False)
+        # Time to live of sounds by priority (see default_ttls)
+        ttls = kwdargs.get('ttls', None)
+        if ttls is None:
+            ttls = default_ttls
+        self.ttls = sorted(ttls)
+
+        # Managed cache of synthesized speech
+        self.tts_cache_size = kwdargs.get('tts_cache_size', None)
+        if self.tts_cache_size is None:
+            self.tts_cache_size = default_tts_cache_size
+        self.tts_cache_dir = kwdargs.get('tts_cache_dir', None)
+        # Rate to resample synthesized speech to (None to leave it)
+        self.tts_rate = kwdargs.get('tts_rate', None)
+        # Speech is made by a pool of workers of its own; requests for
+        # speech that is already being made wait on that
+        self.tts_workers = kwdargs.get('tts_workers', 4)
+        # NOTE: the cache and workers are made the first time speech is
+        # needed, as many sources (e.g. g2disp's) never speak
+        self.tts_cache = None
+        self.tts_pool = None
+        # TTS key -> future for speech being made
+        self.tts_inflight = {}
+        self.tts_stats = dict(submitted=0, deduplicated=0, queued=0,
+                              running=0, synthesized=0, failed=0)
+        self.tts_wait = metrics.Histogram()
+        self.tts_time = metrics.Histogram()
+
         self.tag = 'mon.sound.sound0'
 
-    def _playSound(self, buf, format=None, encode=True, compress=False,
-                   filename=None, priority=20, dst='all'):
+    def _store_sound(self, key, buf):
+        """Remember transport buffer `buf` under `key` so that sinks can
+        fetch it.  Returns True if it was already stored.
+        """
+        with self.lock:
+            if key in self.store:
+                self.store.move_to_end(key)
+                return True
+            self.store[key] = buf
+            self.store_bytes += len(buf)
+            while self.store_bytes > self.max_store_bytes:
+                _key, _buf = self.store.popitem(last=False)
+                self.store_bytes -= len(_buf)
+            return False
+
+    def sink_arr(self, payload, names, channels):
+        """Monitor callback for sink advertisements."""
+        try:
+            bnch = Monitor.unpack_payload(payload)
 
-        ## if compress == None:
-        ##     compress = self.compress
+        except Monitor.MonitorError as e:
+            self.logger.error("malformed packet '%s': %s" % (
+                str(payload), str(e)))
+            return
 
+        info = dict(bnch.value)
+        name = info.get('name', None)
+        if name is None:
+            return
+        info['time_seen'] = time.time()
         with self.lock:
-            if self.muted:
-                self.logger.warn("play sound buffer: mute is ON")
-                return ro.OK
+            if name not in self.sinks:
+                self.logger.info("sound sink '%s' appeared (codecs: %s)" % (
+                    name, ','.join(info.get('codecs', []))))
+            self.sinks[name] = info
+
+    def get_live_sinks(self):
+        """Return the advertisements of the sinks we have heard from
+        recently.
+        """
+        now = time.time()
+        with self.lock:
+            return [info for info in self.sinks.values()
+                    if (now - info['time_seen'] <
+                        3 * info.get('interval', default_adv_interval))]
 
-        if compress:
+    def getSinks(self):
+        return self.get_live_sinks()
+
+    def _sink_codecs(self):
+        """Return the codecs every live sink can decode, or None if
+        we don't know of any sinks.
+        """
+        sinks = self.get_live_sinks()
+        if len(sinks) == 0:
+            return None
+        names = set(sndcodec.get_codec_names())
+        for info in sinks:
+            names.intersection_update(info.get('codecs', []))
+        return sorted(names)
+
+    def getCodecStats(self):
+        return self.selector.get_stats()
+
+    def fetchSound(self, key):
+        """Return the transport buffer of a sound published by hash `key`,
+        or ro.ERROR if we no longer have it.
+        """
+        with self.lock:
+            buf = self.store.get(key, None)
+        if buf is None:
+            self.logger.warning("sink requested unknown sound %s" % (key))
+            return ro.ERROR
+        self.logger.debug("sink fetched sound %s" % (key))
+        return buf
+
+    def _sinks_support(self, feature):
+        """Return True if all the live sinks we know of advertise
+        `feature` (and we know of at least one).  Sinks that don't
+        advertise count as not supporting it, so this is always False
+        unless we have been told there are none (see legacy_sinks).
+        """
+        if self.legacy_sinks:
+            return False
+        sinks = self.get_live_sinks()
+        if len(sinks) == 0:
+            return False
+        for info in sinks:
+            if feature not in info.get('features', []):
+                return False
+        return True
+
+    def _make_id(self):
+        with self.lock:
+            self.msg_count += 1
+            # NOTE: id(self) tells apart sources in the same process
+            return '%s-%d-%x-%d' % (ro.get_myhost(short=True), os.getpid(),
+                                    id(self), self.msg_count)
+
+    def _get_deadline(self, priority, ttl=None, deadline=None):
+        """Return the time after which a sound of `priority` played now
+        should no longer be played, or None if it should always be.  An
+        explicit `deadline` or `ttl` overrides the default for the
+        priority.
+        """
+        if deadline is not None:
+            return deadline
+        if ttl is None:
+            for _priority, _ttl in self.ttls:
+                if priority <= _priority:
+                    ttl = _ttl
+                    break
+            else:
+                return None
+        return time.time() + ttl
+
+    def _stamp(self, extra, dst, deadline=None):
+        # Add the send time and sequence number, so that sinks can
+        # measure latency and spot missing messages.  Messages are
+        # numbered separately for each set of destinations, since a sink
+        # only sees the messages for its own destinations.
+        with self.lock:
+            seqnum = self.seqnums.get(dst, 0) + 1
+            self.seqnums[dst] = seqnum
+        extra.update(dict(seqnum=seqnum, time_sent=time.time()))
+        if deadline is not None:
+            extra['deadline'] = deadline
+
+    def _get_targets(self, dst):
+        """Work out where to send a sound for destinations `dst` (a
+        comma separated string).  Returns a tuple of (channels, dst), or
+        None if no sink needs the sound.
+        """
+        dsts = set(['all'] if dst is None else dst.split(','))
+        sinks = self.get_live_sinks()
+        # NOTE: legacy sinks can't tell us they are muted
+        if self.skip_muted and not self.legacy_sinks:
+            for _dst in list(dsts):
+                serving = [info for info in sinks
+                           if _dst in info.get('dst', [])]
+                if (len(serving) > 0 and
+                    all([info.get('muted', False) for info in serving])):
+                    dsts.discard(_dst)
+            if len(dsts) == 0:
+                return None
+
+        # NOTE: legacy sinks don't subscribe to the sub-channels.  A sink
+        # serving several destinations would get a copy on each of their
+        # sub-channels, so only sounds for one destination are sharded.
+        if (len(dsts) == 1 and dsts.issubset(self.shard_dsts) and
+            self._sinks_support('shard')):
+            return (get_dst_channels(self.channels, dsts),
+                    ','.join(sorted(dsts)))
+        return (self.channels, ','.join(sorted(dsts)))
+
+    def _encode_buf(self, buf, format=None, filename=None, encode=True,
+                    compress=False):
+        """Apply our codec (or legacy compression) and transport encoding
+        to `buf`.  Returns a tuple of the encoded buffer and a dict of the
+        message fields describing how it was encoded.
+        """
+        codec = self.codec
+        allowed = None
+        if codec is not None and self.legacy_sinks:
+            # legacy sinks may get this, and they know of no codecs, but
+            # they can take the legacy compression
+            codec = None
+            compress = True
+        elif codec == 'auto':
+            allowed = self._sink_codecs()
+            if allowed is None:
+                # no sinks have told us what they can decode
+                codec = None
+
+        fields = {}
+        if codec is not None:
+            fmt = format
+            if not fmt:
+                fmt = 'au'
+                if filename:
+                    fmt = os.path.splitext(filename)[1][1:].lower()
+            beforesize = len(buf)
+            if allowed is not None:
+                codec, buf = self.selector.encode(buf, fmt, allowed)
+            else:
+                try:
+                    buf = sndcodec.encode(codec, buf, format=fmt)
+
+                except sndcodec.CodecError:
+                    # codec does not apply to this payload
+                    codec = 'zlib'
+                    buf = sndcodec.encode(codec, buf, format=fmt)
+            compress = False
+            fields['codec'] = codec
+            self.logger.debug("Encoded audio buffer %d->%d bytes (%s)." % (
+                beforesize, len(buf), codec))
+
+        elif compress:
             beforesize = len(buf)
-            buf = ro.compress(buf)
+            buf = ro.compress(bytes(buf))
             aftersize = len(buf)
             self.logger.debug("Compressed audio buffer %d->%d bytes." % (
                     beforesize, aftersize))
 
-        if encode:
-            buf = ro.binary_encode(buf)
+        if encode and self.raw and self._sinks_support('raw'):
+            # send the bytes as they are; copy only if we must
+            if not isinstance(buf, bytes):
+                buf = bytes(buf)
+            fields['encoding'] = 'raw'
+
+        elif encode:
+            buf = ro.binary_encode(bytes(buf))
             self.logger.debug("Encoded audio buffer for transport.")
 
+        fields['compressed'] = compress
+        return buf, fields
+
+    def _prepare(self, buf, format=None, filename=None, encode=True,
+                 compress=False):
+        # Encode sound `buf` for sending, returning a tuple of the buffer
+        # to send and the message fields describing it
+        buf, fields = self._encode_buf(buf, format=format, filename=filename,
+                                       encode=encode, compress=compress)
+        # NOTE: legacy sinks can't fetch sounds sent by reference
+        if self.hashref and not self.legacy_sinks:
+            key = soundcache.get_key(buf)
+            fields['hash'] = key
+            if self._store_sound(key, buf):
+                # sinks have seen this sound already
+                buf = ''
+        return buf, fields
+
+    def _playSound(self, buf, format=None, encode=True, compress=False,
+                   filename=None, priority=20, dst='all', deadline=None):
+
+        ## if compress == None:
+        ##     compress = self.compress
+
+        with self.lock:
+            if self.muted:
+                self.logger.warn("play sound buffer: mute is ON")
+                return ro.OK
+
+        targets = self._get_targets(dst)
+        if targets is None:
+            self.logger.debug("play sound buffer: all sinks muted")
+            return ro.OK
+        channels, dst = targets
+
+        if (self.stream_chunk_size is not None and
+            len(buf) > self.stream_chunk_size and
+            self._sinks_support('stream')):
+            return self._playStream(buf, channels, format=format,
+                                    encode=encode, compress=compress,
+                                    filename=filename, priority=priority,
+                                    dst=dst, deadline=deadline)
+
+        buf, extra = self._prepare(buf, format=format, filename=filename,
+                                   encode=encode, compress=compress)
+        extra['msgid'] = self._make_id()
+        self._stamp(extra, dst, deadline=deadline)
+        extra['src'] = self.src_name
+
         try:
-            self.monitor.setvals(self.channels, self.tag,
+            self.monitor.setvals(channels, self.tag,
                                  buffer=buf, format=format,
                                  filename=filename,
-                                 compressed=compress,
-                                 priority=priority, dst=dst)
+                                 priority=priority, dst=dst, **extra)
 
         except Exception as e:
             self.logger.error("Error submitting remote sound: {}".format(e),
                               exc_info=True)
 
+    def _playStream(self, buf, channels, format=None, encode=True,
+                    compress=False, filename=None, priority=20, dst='all',
+                    deadline=None):
+        """Publish a large sound as a stream of sequenced chunks, so that
+        sinks can start playing it before it has all arrived.
+        """
+        stream_id = self._make_id()
+        chunk_size = self.stream_chunk_size
+        mv = memoryview(buf)
+        # lets sinks suppress repeats of the sound, as for other sounds
+        key = soundcache.get_key(buf)
+        nchunks = (len(mv) + chunk_size - 1) // chunk_size
+        self.logger.debug("Streaming audio buffer (%d bytes) as %d chunks" % (
+            len(mv), nchunks))
+
+        for seq in range(nchunks):
+            chunk = mv[seq * chunk_size:(seq + 1) * chunk_size]
+            chunk, extra = self._encode_buf(chunk, format=format,
+                                            filename=filename,
+                                            encode=encode, compress=compress)
+            try:
+                extra['msgid'] = '%s.%d' % (stream_id, seq)
+                extra['src'] = self.src_name
+                self._stamp(extra, dst, deadline=deadline)
+                self.monitor.setvals(channels, self.tag,
+                                     buffer='', chunk=chunk, hash=key,
+                                     stream=stream_id, seq=seq,
+                                     nchunks=nchunks, chunk_size=chunk_size,
+                                     total=len(mv), format=format,
+                                     filename=filename,
+                                     priority=priority, dst=dst, **extra)
+
+            except Exception as e:
+                self.logger.error("Error submitting sound chunk: {}".format(e),
+                                  exc_info=True)
+                return
+
     def playSound(self, buf, format=None, encode=True, compress=False,
-                  priority=20, dst='all'):
+                  priority=20, dst='all', ttl=None, deadline=None):
+        """
+        Play sound `buf` on the sinks for `dst`.
+
+        A sound that cannot be played within `ttl` seconds, or by the
+        time `deadline`, is dropped by the sinks instead of being played
+        late.  By default, the ttl depends on the priority.
+        """
+        deadline = self._get_deadline(priority, ttl=ttl, deadline=deadline)
         t = Task.FuncTask2(self._playSound, buf, format=format,
                            encode=encode, compress=compress,
-                           priority=priority, dst=dst)
+                           priority=priority, dst=dst, deadline=deadline)
         t.init_and_start(self)
         return ro.OK
 
     def _playFile(self, file, format=None, encode=True, compress=False,
-                  priority=20, dst='all'):
+                  priority=20, dst='all', deadline=None):
         with self.lock:
             if self.muted:
                 self.logger.warn("play sound buffer: mute is ON")
@@ -135,197 +587,1308 @@ class SoundSource(SoundBase):
 
             self._playSound(buf, format=format, filename=filename,
                             encode=encode, compress=compress,
-                            priority=priority, dst=dst)
+                            priority=priority, dst=dst, deadline=deadline)
 
         except Exception as e:
             self.logger.error("Error submitting remote sound: {}".format(e),
                               exc_info=True)
 
     def playFile(self, file, format=None, encode=True, compress=False,
-                 priority=20, dst='all'):
+                 priority=20, dst='all', ttl=None, deadline=None):
+        deadline = self._get_deadline(priority, ttl=ttl, deadline=deadline)
         t = Task.FuncTask2(self._playFile, file, format=format,
                            encode=encode, compress=compress,
-                           priority=priority, dst=dst)
+                           priority=priority, dst=dst, deadline=deadline)
         t.init_and_start(self)
         return ro.OK
 
-    def _playText(self, text, voice='slt', volume=None,
-                  encode=True, compress=False, priority=20, dst='all'):
-        if volume is None:
-            volume = 0
-        # TODO: figure out volume options
-        hashobj = hashlib.sha256()
-        combo = text + voice + str(volume)
-        hashobj.update(combo.encode())
-        fname = hashobj.hexdigest() + '.wav'
-        sndpath = os.path.join("/tmp", fname)
+    def _load_item(self, item):
+        # Return a tuple of (buf, format, filename) for an item of a batch
+        if 'text' in item:
+            voice = item.get('voice', None) or 'slt'
+            volume = item.get('volume', None) or 0
+            res = self._getText(item['text'], voice, volume)
+            if res is None:
+                raise IOError("could not synthesize '%s'" % (item['text']))
+            data, filename = res
+            return data, 'wav', filename
+
+        if 'file' in item:
+            with open(item['file'], 'rb') as in_f:
+                return (in_f.read(), item.get('format', None),
+                        os.path.basename(item['file']))
+
+        return (item['buffer'], item.get('format', None),
+                item.get('filename', None))
+
+    def _playSounds(self, items, encode=True, compress=False, priority=20,
+                    dst='all', deadline=None):
+        with self.lock:
+            if self.muted:
+                self.logger.warn("play sound batch: mute is ON")
+                return ro.OK
+
+        parts = []
+        for item in items:
+            try:
+                parts.append(self._load_item(item))
+
+            except Exception as e:
+                self.logger.error("Error loading sound for batch: %s" % (
+                    str(e)))
+
+        targets = self._get_targets(dst)
+        if targets is None:
+            self.logger.debug("play sound batch: all sinks muted")
+            return ro.OK
+        channels, _dst = targets
+
+        if not self._sinks_support('batch'):
+            # send them one by one, in order
+            for buf, format, filename in parts:
+                self._playSound(buf, format=format, filename=filename,
+                                encode=encode, compress=compress,
+                                priority=priority, dst=dst,
+                                deadline=deadline)
+            return ro.OK
+        dst = _dst
+
+        batch = []
+        for buf, format, filename in parts:
+            buf, fields = self._prepare(buf, format=format, filename=filename,
+                                        encode=encode, compress=compress)
+            batch.append(dict(buffer=buf, format=format, filename=filename,
+                              **fields))
+        extra = dict(msgid=self._make_id(), src=self.src_name)
+        self._stamp(extra, dst, deadline=deadline)
+
+        try:
+            self.monitor.setvals(channels, self.tag, buffer='', batch=batch,
+                                 priority=priority, dst=dst, **extra)
+
+        except Exception as e:
+            self.logger.error("Error submitting remote sound: {}".format(e),
+                              exc_info=True)
+        return ro.OK
+
+    def playSounds(self, sounds, encode=True, compress=False, priority=20,
+                   dst='all', ttl=None, deadline=None):
+        """
+        Play a batch of sounds one after the other, as a group.
+
+        Each item of `sounds` is a dict describing one sound, with either
+          - 'buffer' (and optionally 'format' and 'filename'),
+          - 'file' (and optionally 'format'), the path of a sound file, or
+          - 'text' (and optionally 'voice' and 'volume'), to be spoken.
+        The batch goes to the sinks in a single message, and they play
+        its sounds in order without any other sound in between.  The
+        batch expires as a whole (see playSound).
+        """
+        deadline = self._get_deadline(priority, ttl=ttl, deadline=deadline)
+        t = Task.FuncTask2(self._playSounds, sounds, encode=encode,
+                           compress=compress, priority=priority, dst=dst,
+                           deadline=deadline)
+        t.init_and_start(self)
+        return ro.OK
+
+    def playFiles(self, files, format=None, encode=True, compress=False,
+                  priority=20, dst='all', ttl=None, deadline=None):
+        """Play the sound files `files` one after the other, as a
+        group (see playSounds).
+        """
+        items = [dict(file=file, format=format) for file in files]
+        return self.playSounds(items, encode=encode, compress=compress,
+                               priority=priority, dst=dst, ttl=ttl,
+                               deadline=deadline)
+
+    def _get_tts_key(self, text, voice, volume):
+        return ttscache.get_key(text, voice, volume, rate=self.tts_rate)
+
+    def _synthesize(self, text, voice, volume):
+        """Synthesize `text` with `voice` at `volume` dB into the TTS
+        cache and return the contents of the WAV file, or None on error.
+        """
+        key = self._get_tts_key(text, voice, volume)
+        try:
+            data = ttsproc.synthesize(text, voice)
+            data = ttsproc.process(data, volume=volume, rate=self.tts_rate)
+
+        except ttsproc.TTSError as e:
+            self.logger.error("Error creating WAV sound file: %s" % (str(e)))
+            return None
+
+        try:
+            self.tts_cache.add_data(key, data, text, voice, volume)
+
+        except (IOError, OSError) as e:
+            # we have the speech; it just won't be cached
+            self.logger.error("Error caching WAV sound file: %s" % (str(e)))
+        return data
+
+    def _start_tts(self):
+        # Make the TTS cache and workers, if we haven't yet
+        with self.lock:
+            if self.tts_pool is not None:
+                return
+            self.tts_cache = ttscache.TTSCache(self.logger,
+                                               cache_dir=self.tts_cache_dir,
+                                               max_bytes=self.tts_cache_size)
+            self.tts_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.tts_workers,
+                thread_name_prefix='soundsink-tts')
+
+    def _submit_tts(self, text, voice, volume):
+        """Get the speech for `text` with `voice` at `volume` dB made by
+        a TTS worker.  Returns a concurrent.futures.Future for a tuple of
+        (data, filename), or None on error.  A request for speech that
+        is already being made shares the future of that request.
+        """
+        key = self._get_tts_key(text, voice, volume)
+        self._start_tts()
+        with self.lock:
+            future = self.tts_inflight.get(key, None)
+            if future is not None:
+                self.tts_stats['deduplicated'] += 1
+                return future
+            self.tts_stats['submitted'] += 1
+            self.tts_stats['queued'] += 1
+            future = self.tts_pool.submit(self._tts_job, key, text, voice,
+                                          volume, time.time())
+            self.tts_inflight[key] = future
+
+        def _done(future):
+            with self.lock:
+                del self.tts_inflight[key]
+        future.add_done_callback(_done)
+        return future
+
+    def _tts_job(self, key, text, voice, volume, time_submit):
+        # Runs in a TTS worker
+        time_start = time.time()
+        with self.lock:
+            self.tts_stats['queued'] -= 1
+            self.tts_stats['running'] += 1
+            self.tts_wait.add(time_start - time_submit)
+        try:
+            return self._getTextSound(key, text, voice, volume)
+
+        finally:
+            with self.lock:
+                self.tts_stats['running'] -= 1
+
+    def _getTextSound(self, key, text, voice, volume):
         # see if we need to create this sound file--there will be a cached
         # copy if all the parameters are the same and we have generated one
-        # recently
-        if not os.path.exists(sndpath):
-            tmppath = os.path.join('/tmp', 'snd' + str(time.time()) + '.wav')
-            cmd_str = 'flite -t "%s" -voice "%s" -o %s' % (text, voice, tmppath)
-            res = os.system(cmd_str)
-            if res != 0:
-                self.logger.error("Error creating WAV sound file: res=%d" % (res))
-                return
+        # recently.  Returns a tuple of (data, filename), or None.
+        filename = key + '.wav'
+        sndpath = self.tts_cache.lookup(key)
+        if sndpath is not None:
+            try:
+                with open(sndpath, 'rb') as in_f:
+                    return in_f.read(), filename
 
-            # We have to manually increase or decrease the volume on the
-            # file because flite doesn't seem to give us this control...*sigh*
-            cmd_str = 'sox %s %s vol %ddb' % (tmppath, sndpath, volume)
-            res = os.system(cmd_str)
-            os.remove(tmppath)
-            if res != 0:
-                self.logger.error("Error setting volume of sound file: res=%d" % (res))
+            except (IOError, OSError) as e:
+                self.logger.warning("Error reading cached TTS file: %s" % (
+                    str(e)))
+
+        time_start = time.time()
+        data = self._synthesize(text, voice, volume)
+        with self.lock:
+            if data is None:
+                self.tts_stats['failed'] += 1
+                return None
+            self.tts_stats['synthesized'] += 1
+            self.tts_time.add(time.time() - time_start)
+        return data, filename
+
+    def _getText(self, text, voice, volume):
+        # Returns a tuple of (data, filename) for `text`, or None
+        return self._submit_tts(text, voice, volume).result()
+
+    def _playText_done(self, future, encode=True, compress=False,
+                       priority=20, dst='all', deadline=None):
+        try:
+            res = future.result()
+            if res is None:
                 return
+            data, filename = res
+            self._playSound(data, format='wav', filename=filename,
+                            encode=encode, compress=compress,
+                            priority=priority, dst=dst, deadline=deadline)
+
+        except Exception as e:
+            self.logger.error("Error playing text: %s" % (str(e)),
+                              exc_info=True)
+
+    def _prewarmText(self, phrases):
+        time_start = time.time()
+        self._start_tts()
+        futures = []
+        for text, voice, volume in phrases:
+            if voice is None:
+                voice = 'slt'
+            if volume is None:
+                volume = 0
+            futures.append(self._submit_tts(text, voice, volume))
+        count = len([future for future in futures
+                     if future.result() is not None])
+        self.tts_cache.flush()
+        self.logger.info("prewarmed TTS cache with %d/%d phrases in %.2f sec" % (
+            count, len(phrases), time.time() - time_start))
+
+    def prewarmText(self, phrases):
+        """
+        Synthesize a list of phrases into the TTS cache ahead of time.
+
+        Each item of `phrases` is a (text, voice, volume) sequence, where
+        voice and volume may be None to use the defaults.
+        """
+        phrases = [(item[0], item[1], item[2]) for item in phrases]
+        t = Task.FuncTask2(self._prewarmText, phrases)
+        t.init_and_start(self)
+        return ro.OK
 
-        self._playFile(sndpath, format='wav', encode=encode,
-                       compress=compress, priority=priority, dst=dst)
+    def prewarmTextFile(self, filepath):
+        """Prewarm the TTS cache with the phrases listed in `filepath`
+        (see ttscache.load_phrases for the format).
+        """
+        try:
+            phrases = ttscache.load_phrases(filepath)
+
+        except (IOError, OSError, ValueError) as e:
+            self.logger.error("Error reading phrases from %s: %s" % (
+                filepath, str(e)))
+            return ro.ERROR
+        return self.prewarmText(phrases)
+
+    def getTTSStats(self):
+        """Return statistics of the TTS cache and workers."""
+        stats = {}
+        if self.tts_cache is not None:
+            stats = self.tts_cache.get_stats()
+        with self.lock:
+            stats.update(self.tts_stats)
+            stats['workers'] = self.tts_workers
+            stats['wait_time'] = self.tts_wait.get_stats()
+            stats['synth_time'] = self.tts_time.get_stats()
+        return stats
+
+    def stop(self):
+        with self.lock:
+            if self.tts_pool is None:
+                return
+            self.tts_pool.shutdown(wait=False)
+            self.tts_cache.flush()
 
     def playText(self, text, voice='slt', volume=None,
-                 encode=True, compress=False, priority=20, dst='all'):
+                 encode=True, compress=False, priority=20, dst='all',
+                 ttl=None, deadline=None):
         """
         TTS text-to-sound service.
 
-        NOTE: this requires that the `flite` and `sox` programs be installed
-        on the system running the soundsink server.
+        NOTE: this requires that the `flite` program be installed on the
+        system running the soundsink server (and `sox`, if numpy is not
+        available).  The time taken to synthesize the speech counts
+        against its ttl (see playSound).
         """
-        t = Task.FuncTask2(self._playText, text, voice=voice, volume=volume,
-                           encode=encode, compress=compress,
-                           priority=priority, dst=dst)
-        t.init_and_start(self)
+        deadline = self._get_deadline(priority, ttl=ttl, deadline=deadline)
+        if volume is None:
+            volume = 0
+        # TODO: figure out volume options
+        future = self._submit_tts(text, voice, volume)
+        future.add_done_callback(functools.partial(
+            self._playText_done, encode=encode, compress=compress,
+            priority=priority, dst=dst, deadline=deadline))
         return ro.OK
 
 
+class _PlayEntry(object):
+    """A sound waiting in the PlaybackScheduler."""
+
+    def __init__(self, priority, seq, time_arrival, time_ready,
+                 time_sent=None, deadline=None):
+        self.priority = priority
+        self.seq = seq
+        self.time_arrival = time_arrival
+        self.time_ready = time_ready
+        self.time_sent = time_sent
+        self.deadline = deadline
+        self.sound = None
+        self.dropped = False
+        self.ev_cancel = threading.Event()
+        # called with the entry if it is dropped without being played
+        self.drop_fn = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def is_expired(self, now):
+        return self.deadline is not None and now > self.deadline
+
+
+class PlaybackScheduler(object):
+    """Plays sounds one at a time, best (lowest numbered) priority first.
+
+    A slot is reserved with submit() as soon as a sound arrives, so that
+    it holds back lower priority sounds while it is still being decoded,
+    and the sound is handed over with ready() when it can be played.
+    Each sound is held for `waitval` seconds after arrival, allowing a
+    small window in which sounds with higher priority might reach us and
+    be played first.  A single thread pops the best candidate off a heap
+    and plays it with `play_fn`.
+
+    If `preempt_priority` is set, a sound with that priority or better
+    cuts off a lower priority sound that is already playing.
+
+    A sound whose deadline passes while it waits is dropped, ready or
+    not, instead of being played late.  An entry that is dropped, or
+    withdrawn with cancel(), has its `drop_fn` called (outside of our
+    lock), so that whatever was preparing the sound can give up on it.
+
+    If a `mixer` (see g2client.util.mixer) is given, all the sounds of
+    the best priority that are ready to play are mixed and played
+    together, instead of one after the other.  With `duck` set, ready
+    sounds of lower priority are mixed in too, ducked while the better
+    ones play.
+    """
+
+    def __init__(self, logger, play_fn, waitval=0.150,
+                 preempt_priority=None, mixer=None, duck=False,
+                 metrics=None):
+        self.logger = logger
+        self.play_fn = play_fn
+        self.waitval = waitval
+        self.preempt_priority = preempt_priority
+        self.mixer = mixer
+        self.duck = duck
+        self.metrics = metrics
+
+        self.cond = threading.Condition()
+        self.heap = []
+        self.count = 0
+        self.playing = None
+        self.ev_quit = threading.Event()
+        self.thread = None
+
+        self.num_played = 0
+        self.num_preempted = 0
+        self.num_expired = 0
+        # entries dropped by the player thread, whose drop_fn is due
+        self.expired = []
+        # priority -> wait time statistics
+        self.wait_stats = {}
+
+    def start(self):
+        self.ev_quit.clear()
+        self.thread = threading.Thread(target=self.play_loop,
+                                       name='soundsink-player')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.ev_quit.set()
+        with self.cond:
+            if self.playing is not None:
+                self.playing.ev_cancel.set()
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, priority, time_sent=None, deadline=None):
+        """Reserve a place in the queue for a sound of `priority`, sent
+        by its source at `time_sent` and to be played by `deadline` (if
+        known).
+        """
+        time_arrival = time.time()
+        with self.cond:
+            self.count += 1
+            entry = _PlayEntry(priority, self.count, time_arrival,
+                               time_arrival + self.waitval,
+                               time_sent=time_sent, deadline=deadline)
+            heapq.heappush(self.heap, entry)
+            return entry
+
+    def ready(self, entry, sound):
+        """Supply the audio.Sound to be played for `entry`."""
+        with self.cond:
+            entry.sound = sound
+            playing = self.playing
+            if (playing is not None and self.preempt_priority is not None and
+                entry.priority <= self.preempt_priority and
+                entry.priority < playing.priority):
+                self.logger.info("priority %d sound preempts priority %d" % (
+                    entry.priority, playing.priority))
+                self.num_preempted += 1
+                playing.ev_cancel.set()
+            self.cond.notify_all()
+
+    def cancel(self, entry):
+        """Withdraw `entry` from the queue."""
+        with self.cond:
+            if entry.dropped:
+                return
+            entry.dropped = True
+            self.cond.notify_all()
+        self._call_drop_fn(entry)
+
+    def _call_drop_fn(self, entry):
+        if entry.drop_fn is None:
+            return
+        try:
+            entry.drop_fn(entry)
+
+        except Exception as e:
+            self.logger.error("Error dropping sound: %s" % (str(e)),
+                              exc_info=True)
+
+    def _next_entry(self):
+        # Called with the condition held.  Returns the next entry to play,
+        # or None if we should quit or have expired entries to see to.
+        while not self.ev_quit.is_set():
+            now = time.time()
+            while len(self.heap) > 0 and (self.heap[0].dropped or
+                                          self.heap[0].is_expired(now)):
+                entry = heapq.heappop(self.heap)
+                if not entry.dropped:
+                    self._expire(entry)
+            if len(self.expired) > 0:
+                return None
+
+            timeout = 1.0
+            if len(self.heap) > 0:
+                entry = self.heap[0]
+                if entry.sound is not None:
+                    time_delta = entry.time_ready - time.time()
+                    if time_delta <= 0:
+                        return heapq.heappop(self.heap)
+                    timeout = min(timeout, time_delta)
+                # else best sound is still decoding; it will notify us
+                if entry.deadline is not None:
+                    timeout = max(0.0, min(timeout, entry.deadline - now))
+
+            self.cond.wait(timeout)
+        return None
+
+    def _expire(self, entry):
+        # Called with the condition held
+        entry.dropped = True
+        self.num_expired += 1
+        self.expired.append(entry)
+        self.logger.debug("dropped priority %d sound past its deadline "
+                          "by %.3f sec" % (entry.priority,
+                                           time.time() - entry.deadline))
+
+    def _take_mixable(self, entry):
+        # Called with the condition held.  Removes from the heap and
+        # returns the entries that can be mixed with `entry`.
+        if not self.mixer.can_mix(entry.sound):
+            return []
+        now = time.time()
+        group = []
+        for other in self.heap:
+            if (other.dropped or other.sound is None or
+                other.is_expired(now)):
+                continue
+            if other.priority == entry.priority or (
+                    self.duck and other.priority > entry.priority and
+                    other.time_ready <= now):
+                if self.mixer.can_mix(other.sound):
+                    group.append(other)
+        if len(group) > 0:
+            for other in group:
+                other.dropped = True
+            self.heap = [other for other in self.heap if not other.dropped]
+            heapq.heapify(self.heap)
+        return group
+
+    def _record_wait(self, entry):
+        time_wait = time.time() - entry.time_arrival
+        stats = self.wait_stats.setdefault(
+            entry.priority, dict(count=0, total=0.0, max=0.0))
+        stats['count'] += 1
+        stats['total'] += time_wait
+        stats['max'] = max(stats['max'], time_wait)
+        if self.metrics is not None:
+            self.metrics.record('wait', time_wait)
+        return time_wait
+
+    def play_loop(self):
+        while not self.ev_quit.is_set():
+            group = []
+            with self.cond:
+                entry = self._next_entry()
+                expired, self.expired = self.expired, []
+                if entry is not None:
+                    if self.mixer is not None:
+                        group = self._take_mixable(entry)
+                    self.playing = entry
+                    time_wait = self._record_wait(entry)
+                    for other in group:
+                        self._record_wait(other)
+                    self.logger.debug("playing priority %d sound after "
+                                      "%.3f sec (%d mixed, %d queued)" % (
+                                          entry.priority, time_wait,
+                                          len(group), len(self.heap)))
+            for other in expired:
+                self._call_drop_fn(other)
+            if entry is None:
+                # we are quitting, or had only dropped sounds to see to
+                continue
+            try:
+                sound = entry.sound
+                if len(group) > 0:
+                    entries = [entry] + sorted(group)
+                    sound = self.mixer.mix(
+                        [other.sound for other in entries],
+                        ducked=[other.priority > entry.priority
+                                for other in entries])
+                time_start = time.time()
+                res = self.play_fn(sound, ev_cancel=entry.ev_cancel)
+
+                if self.metrics is not None and res is not None:
+                    time_first = time_start + res.ttfs
+                    for other in [entry] + group:
+                        if other.time_sent is not None:
+                            self.metrics.record('total',
+                                                time_first - other.time_sent)
+
+            except Exception as e:
+                self.logger.error("Failed to play sound: %s" % (str(e)),
+                                  exc_info=True)
+            finally:
+                with self.cond:
+                    self.playing = None
+                    self.num_played += 1 + len(group)
+
+    def get_stats(self):
+        with self.cond:
+            depth = len([entry for entry in self.heap if not entry.dropped])
+            waits = {}
+            for priority, stats in self.wait_stats.items():
+                count = stats['count']
+                waits[str(priority)] = dict(count=count,
+                                            mean=stats['total'] / count,
+                                            max=stats['max'])
+            playing = self.playing
+            stats = dict(queue_depth=depth,
+                         playing=(playing.priority if playing is not None
+                                  else None),
+                         played=self.num_played,
+                         preempted=self.num_preempted,
+                         expired=self.num_expired,
+                         wait_times=waits)
+            if self.mixer is not None:
+                stats['mixer'] = self.mixer.get_stats()
+            return stats
+
+
 class SoundSink(SoundBase):
 
     def __init__(self, **kwdargs):
         super(SoundSink, self).__init__(**kwdargs)
 
         self.sound_dev = kwdargs.get('sound_dev', default_sound_dev)
-        self.playcmd = "paplay"
-        #self.playcmd = "play -q"
+        # Persistent audio output engine, with `paplay` as the fallback
+        # for sounds it cannot stream
+        backend = kwdargs.get('backend', None)
+        if backend is None:
+            backend = default_audio_backend
+        self.audio = audio.make_backend(backend, self.logger)
+        if self.audio.name == 'paplay':
+            self.audio_fallback = self.audio
+        else:
+            self.audio_fallback = audio.PaplayBackend(self.logger)
+        self.play_stats = dict(count=0, fallbacks=0, ttfs_total=0.0,
+                               ttfs_max=0.0, ttfs_last=0.0)
+        # Cache of decoded sounds, keyed by payload hash
+        cache_size = kwdargs.get('cache_size', None)
+        if cache_size is None:
+            cache_size = default_cache_size
+        self.cache = soundcache.SoundCache(self.logger,
+                                           max_bytes=cache_size,
+                                           cache_dir=kwdargs.get('cache_dir',
+                                                                 None))
         self.lock_sound = threading.Lock()
-        self.count = 0
-        self.maxcount = 20
-        self.playcond = threading.Condition()
-        self.priority_list = []
+        # Sounds are decoded and fetched by coroutines on this engine,
+        # with blocking work in a few threads of its own
+        self.engine = aioengine.AsyncEngine(
+            self.logger, name='soundsink-engine',
+            workers=kwdargs.get('decode_workers', 4))
+        # hash -> future for an in-progress fetch of a sound published
+        # by reference
+        self.fetches = {}
+        self.fetch_timeout = kwdargs.get('fetch_timeout',
+                                         default_fetch_timeout)
+        self.proxies = {}
+        # makes a proxy to fetch sounds from the source with a service name
+        self.make_proxy = kwdargs.get('make_proxy', ro.remoteObjectProxy)
         self.waitval = 0.150
-        self.dst = set(['all', 'summit'])
+        # Optionally mix sounds of the same priority instead of queuing
+        # them, ducking lower priority ones if duck_gain is given
+        mix = None
+        duck_gain = kwdargs.get('duck_gain', None)
+        if kwdargs.get('mix', False):
+            if mixer.have_numpy:
+                mix = mixer.Mixer(self.logger,
+                                  duck_gain=(duck_gain
+                                             if duck_gain is not None
+                                             else 1.0))
+            else:
+                self.logger.warning("mixing requires numpy; sounds will "
+                                    "be queued instead")
+        # Latency of each stage of playing a sound, periodically written
+        # to `metrics_file` if given
+        self.metrics = metrics.SoundMetrics()
+        self.metrics_file = kwdargs.get('metrics_file', None)
+        self.metrics_interval = kwdargs.get('metrics_interval', 60.0)
+        self.ev_metrics = threading.Event()
+        self.metrics_thread = None
+
+        self.scheduler = PlaybackScheduler(
+            self.logger, self._play, waitval=self.waitval,
+            preempt_priority=kwdargs.get('preempt_priority', None),
+            mixer=mix, duck=(duck_gain is not None), metrics=self.metrics)
+        self.dst = set(default_dsts)
         dst = kwdargs.get('dst', None)
         if dst is not None:
             self.dst.add(dst)
 
-        self.tag = 'soundsink'
+        # We periodically advertise our capabilities to sources under
+        # our name on the sink channel
+        self.name = kwdargs.get('name', None)
+        if self.name is None:
+            self.name = '%s-%d' % (ro.get_myhost(short=True), os.getpid())
+        self.adv_interval = kwdargs.get('adv_interval',
+                                        default_adv_interval)
+        self.features = ['stream', 'shard', 'batch', 'raw']
+
+        # Coalescing and rate limiting of repeated sounds
+        self.suppressor = suppress.SoundSuppressor(
+            self.logger, window=kwdargs.get('suppress_window', 0.0),
+            rate=kwdargs.get('rate_limit', None),
+            burst=kwdargs.get('rate_burst', 5))
+        # Ids of recently received messages; a sound published for
+        # several of our destinations reaches us once on each sub-channel
+        self.msgids = OrderedDict()
+
+        # Sounds being streamed to us, by stream id
+        self.streams = {}
+        # Recently finished stream ids, to recognize late chunks
+        self.streams_done = OrderedDict()
+        self.stream_prebuffer = kwdargs.get('stream_prebuffer', None)
+        if self.stream_prebuffer is None:
+            self.stream_prebuffer = default_stream_prebuffer
+        self.stream_timeout = kwdargs.get('stream_timeout',
+                                          default_stream_timeout)
+        self.stream_stats = dict(streams=0, chunks=0, late=0, lost=0)
+        # Counts of sounds dropped because their deadline passed before
+        # they could be played, by the stage at which we noticed
+        self.expire_stats = dict(receipt=0, decode=0)
+        self.ev_adv = threading.Event()
+        self.adv_thread = None
 
-    def _playSound_bg(self, buf, filename=None, decode=True,
-                      format=None, decompress=False, priority=20):
+        self.tag = 'soundsink'
 
-        # First thing is to add our priority to the priority list
-        # so it will be noticed by any other threads playing sounds
+    async def _get_sound(self, buf, filename=None, decode=True,
+                         format=None, decompress=False, key=None, src=None,
+                         codec=None):
+        # Returns a tuple of the audio.Sound for `buf` and the key under
+        # which it should be added to the cache (None if it need not be)
+        if key is None:
+            key = soundcache.get_key(buf)
+        # A sound we have seen before goes straight to playback
+        sound = self.cache.get(key)
+        if sound is not None:
+            if filename is not None and sound.filename != filename:
+                sound = sound.with_filename(filename)
+            return sound, None
+
+        if not buf:
+            # published by reference only--fetch it
+            sound = await self._fetch(key, src, filename=filename,
+                                      decode=decode, format=format,
+                                      decompress=decompress, codec=codec)
+            return sound, None
+
+        sound = await self.engine.run_blocking(
+            self._decode, buf, filename=filename, decode=decode,
+            format=format, decompress=decompress, codec=codec)
+        return sound, key
+
+    def _is_expired(self, deadline, stage):
+        # Returns True (and counts it) if `deadline` has passed
+        if deadline is None or time.time() <= deadline:
+            return False
         with self.lock_sound:
-            self.priority_list.append(priority)
+            self.expire_stats[stage] += 1
+        self.logger.debug("dropped sound past its deadline on %s" % (stage))
+        return True
+
+    def _ready(self, entry, sound):
+        # Hand a prepared sound over to the scheduler, unless it expired
+        # while we were preparing it
+        if entry.dropped:
+            # the scheduler dropped it already
+            return
+        if self._is_expired(entry.deadline, 'decode'):
+            self.scheduler.cancel(entry)
+            return
+        self.scheduler.ready(entry, sound)
+
+    async def _playSound_async(self, entry, buf, filename=None,
+                               decode=True, format=None, decompress=False,
+                               key=None, src=None, codec=None):
+        try:
+            sound, cache_key = await self._get_sound(
+                buf, filename=filename, decode=decode, format=format,
+                decompress=decompress, key=key, src=src, codec=codec)
+
+        except Exception as e:
+            self.scheduler.cancel(entry)
+            self.logger.error("Failed to play sound buffer: %s" % (
+                str(e)))
+            return
 
-        # Record start time and add interval we should wait before playing
+        self._ready(entry, sound)
+
+        # caching may write to disk, so keep it off the path to playback
+        if cache_key is not None:
+            await self.engine.run_blocking(self.cache.put, cache_key, sound)
+
+    async def _playSounds_async(self, entry, parts, src=None):
+        try:
+            results = await asyncio.gather(*[
+                self._get_sound(part['buffer'],
+                                filename=part.get('filename', None),
+                                decode=get_decode(part),
+                                format=part.get('format', None),
+                                decompress=part.get('compressed', False),
+                                key=part.get('hash', None), src=src,
+                                codec=part.get('codec', None))
+                for part in parts])
+
+        except Exception as e:
+            self.scheduler.cancel(entry)
+            self.logger.error("Failed to play sound batch: %s" % (
+                str(e)))
+            return
+
+        self._ready(entry, audio.SoundSequence(
+            [sound for sound, cache_key in results]))
+
+        for sound, cache_key in results:
+            if cache_key is not None:
+                await self.engine.run_blocking(self.cache.put, cache_key,
+                                               sound)
+
+    def _decode_data(self, buf, decode=True, decompress=False, codec=None):
+        # Decode binary data
         time_start = time.time()
-        time_limit = time_start + self.waitval
+        if decode == 'raw':
+            data = get_raw(buf)
+
+        elif decode:
+            data = ro.binary_decode(buf)
+            time_end = time.time()
+            self.metrics.record('decode', time_end - time_start)
+            time_start = time_end
+        else:
+            data = buf
+
+        # Decompress data if necessary
+        if decompress or codec is not None:
+            if decompress:
+                data = ro.uncompress(data)
+
+            if codec is not None:
+                data = sndcodec.decode(codec, data)
+            self.metrics.record('decompress', time.time() - time_start)
+        return data
+
+    def _get_format(self, format, filename):
+        # If format is not explicitly provided, then assume 'au' and
+        # override if a filename was given with an extension
+        if not format:
+            format = 'au'
+            if filename:
+                dirname, filename = os.path.split(filename)
+                pfx, ext = os.path.splitext(filename)
+                format = ext[1:].lower()
+        return format
+
+    def _decode(self, buf, filename=None, decode=True,
+                format=None, decompress=False, codec=None):
+        data = self._decode_data(buf, decode=decode, decompress=decompress,
+                                 codec=codec)
+        format = self._get_format(format, filename)
+        if filename:
+            filename = os.path.basename(filename)
+        return audio.Sound(data, format=format, filename=filename)
+
+    def get_channels(self, channels):
+        """Return the channels to subscribe to for `channels`: the
+        channels themselves, for sources that publish all sounds on
+        them, and their sub-channels for our destinations.
+        """
+        return list(channels) + get_dst_channels(channels, self.dst)
+
+    def _seen_msg(self, msgid):
+        # Returns True if we have already received message `msgid`
+        with self.lock_sound:
+            if msgid in self.msgids:
+                return True
+            self.msgids[msgid] = True
+            while len(self.msgids) > 1000:
+                self.msgids.popitem(last=False)
+            return False
+
+    def stream_arr(self, info):
+        """Handle a chunk of a sound that is being streamed to us."""
+        stream_id = info['stream']
+        with self.lock_sound:
+            self.stream_stats['chunks'] += 1
+            if stream_id in self.streams_done:
+                self.stream_stats['late'] += 1
+                return
+            stream = self.streams.get(stream_id, None)
+            if stream is None:
+                with self.lock:
+                    muted = self.muted
+                if muted:
+                    self.logger.warn("play sound stream: mute is ON")
+                    self._finish_stream(stream_id)
+                    return
+                deadline = info.get('deadline', None)
+                if deadline is not None and time.time() > deadline:
+                    # we are too late for all of it
+                    self.expire_stats['receipt'] += 1
+                    self._finish_stream(stream_id)
+                    return
+                if self.suppressor.is_enabled():
+                    # streams from older sources carry no hash
+                    key = info.get('hash', None) or stream_id
+                    if self.suppressor.check(
+                            key, src=info.get('src', None),
+                            filename=info['filename']) is not None:
+                        self._finish_stream(stream_id)
+                        return
+                format = self._get_format(info['format'], info['filename'])
+                stream = audio.StreamingSound(info['nchunks'],
+                                              info['chunk_size'],
+                                              info['total'], format=format,
+                                              filename=info['filename'],
+                                              timeout=self.stream_timeout)
+                stream.stream_id = stream_id
+                stream.started = False
+                self.streams[stream_id] = stream
+                self.stream_stats['streams'] += 1
+                stream.entry = self.scheduler.submit(
+                    info['priority'], time_sent=info.get('time_sent', None),
+                    deadline=deadline)
+                stream.entry.drop_fn = functools.partial(self._drop_stream,
+                                                         stream)
+                # don't wait forever for the prebuffer to fill
+                timer = threading.Timer(self.stream_timeout,
+                                        self._start_stream, args=[stream])
+                timer.daemon = True
+                timer.start()
 
         try:
+            data = self._decode_data(info['chunk'],
+                                     decode=get_decode(info),
+                                     decompress=info.get('compressed', False),
+                                     codec=info.get('codec', None))
+
+        except Exception as e:
+            # treat the chunk as lost
+            self.logger.error("Failed to decode sound chunk: %s" % (str(e)))
+            return
+
+        if not stream.add_chunk(info['seq'], data):
+            with self.lock_sound:
+                self.stream_stats['late'] += 1
+            return
+
+        if (stream.bytes_received >= self.stream_prebuffer or
+            stream.num_received == stream.nchunks):
+            self._start_stream(stream)
+
+    def _start_stream(self, stream):
+        with self.lock_sound:
+            if stream.started:
+                return
+            stream.started = True
+            lost = stream.num_received == 0 or 0 not in stream.chunks
+        if lost:
+            # we never got the start of the stream
+            self.logger.error("Sound stream %s lost its first chunk" % (
+                stream.stream_id))
+            self.scheduler.cancel(stream.entry)
+            return
+        self.scheduler.ready(stream.entry, stream)
+
+    def _drop_stream(self, stream, entry):
+        # Called when the scheduler drops `stream` without playing it
+        stream.abort()
+        with self.lock_sound:
+            self._finish_stream(stream.stream_id)
+
+    def _finish_stream(self, stream_id):
+        # called with lock_sound held
+        stream = self.streams.pop(stream_id, None)
+        if stream is not None:
+            self.stream_stats['lost'] += stream.num_lost
+            self.stream_stats['late'] += stream.num_late
+        self.streams_done[stream_id] = time.time()
+        while len(self.streams_done) > 1000:
+            self.streams_done.popitem(last=False)
+
+    def getStreamStats(self):
+        """Return counts of streams and their chunks received, lost and
+        late.
+        """
+        with self.lock_sound:
+            stats = dict(self.stream_stats)
+            stats['active'] = len(self.streams)
+        return stats
+
+    def _get_proxy(self, svcname):
+        with self.lock_sound:
+            proxy = self.proxies.get(svcname, None)
+            if proxy is None:
+                proxy = self.make_proxy(svcname)
+                self.proxies[svcname] = proxy
+            return proxy
+
+    def clear_proxies(self):
+        """Forget the proxies to sound sources, so that they are made
+        again (e.g. after switching to another Gen2 system).
+        """
+        with self.lock_sound:
+            self.proxies = {}
+
+    async def _fetch(self, key, src, **kwdargs):
+        """Fetch the sound with hash `key` from source service `src`,
+        decode it and add it to the cache.  Only one fetch is made for a
+        given key at a time; concurrent requests wait for its result.
+        """
+        # NOTE: self.fetches is only touched from the engine's loop
+        flight = self.fetches.get(key, None)
+        if flight is not None:
+            self.logger.debug("waiting on fetch of sound %s" % (key))
             try:
-                # Decode binary data
-                if decode:
-                    data = ro.binary_decode(buf)
-                else:
-                    data = buf
-
-                # Decompress data if necessary
-                if decompress:
-                    data = ro.uncompress(data)
-
-                # If format is not explicitly provided, then assume 'au' and
-                # override if a filename was given with an extension
-                if not format:
-                    format = 'au'
-                    if filename:
-                        dirname, filename = os.path.split(filename)
-                        pfx, ext = os.path.splitext(filename)
-                        format = ext[1:].lower()
-
-                # Get a temp filename and write out our buffer to a file
-                with self.lock_sound:
-                    self.count = (self.count + 1) % self.maxcount
-                    tmpfile = "_snd%d_%d.%s" % (
-                        os.getpid(), self.count, format)
-
-                tmppath = os.path.join('/tmp', tmpfile)
-                with open(tmppath, 'wb') as out_f:
-                    out_f.write(data)
-
-                # Now sleep the remaining time until our required delay
-                # time is reached.  This allows a small window in which
-                # other sounds with higher priority might reach us and
-                # be played first
-                time_delta = time_limit - time.time()
-                if time_delta > 0:
-                    self.logger.debug("Sleeping for %.3f sec" % (time_delta))
-                    time.sleep(time_delta)
-
-                # Acquire the condition and then check the highest priority
-                # in the queue.  If there are sounds with higher priority
-                # then wait until we are notified.
-                with self.playcond:
-                    with self.lock_sound:
-                        minval = min(self.priority_list)
-                    self.logger.info("minval: %d priority: %d list: %s" % (
-                        minval, priority, self.priority_list))
-
-                    while minval < priority:
-                        self.playcond.wait()
-                        self.logger.debug("awakened by notifier!")
-                        with self.lock_sound:
-                            minval = min(self.priority_list)
-                        self.logger.info("minval: %d priority: %d list: %s" % (
-                            minval, priority, self.priority_list))
-
-                # Play the file and remove the temp file
-                cmd_str = "%s %s" % (
-                    self.playcmd, tmppath)
-                self.logger.info("Play command is: %s" % cmd_str)
-                res = os.system(cmd_str)
-                #os.remove(tmppath)
+                return await asyncio.wait_for(asyncio.shield(flight),
+                                              self.fetch_timeout)
+            except asyncio.TimeoutError:
+                raise IOError("fetch of sound %s timed out" % (key))
+
+        flight = self.engine.loop.create_future()
+        self.fetches[key] = flight
+        try:
+            if src is None:
+                raise IOError("sound %s sent by reference without a source" % (
+                    key))
+            self.logger.debug("fetching sound %s from %s" % (key, src))
+            try:
+                buf = await asyncio.wait_for(
+                    self.engine.run_blocking(
+                        lambda: self._get_proxy(src).fetchSound(key)),
+                    self.fetch_timeout)
+
+            except Exception as e:
+                raise IOError("error fetching sound %s from %s: %s" % (
+                    key, src, str(e)))
+            if buf == ro.ERROR:
+                raise IOError("source %s no longer has sound %s" % (src, key))
+
+            sound = await self.engine.run_blocking(self._decode, buf,
+                                                   **kwdargs)
+            await self.engine.run_blocking(self.cache.put, key, sound)
+            flight.set_result(sound)
+            return sound
+
+        except Exception as e:
+            flight.set_exception(e)
+            # don't complain if no one else was waiting on this
+            flight.exception()
+            raise
 
-            except (IOError, OSError) as e:
-                self.logger.error("Failed to play sound buffer: %s" % (
-                    str(e)))
         finally:
-            # Finally, remove our priority from the list and notify any
-            # waiters (presumably with lower priority).
-            with self.playcond:
+            del self.fetches[key]
+
+    def _play(self, sound, ev_cancel=None):
+        if isinstance(sound, audio.SoundSequence):
+            return self._play_sequence(sound, ev_cancel=ev_cancel)
+        if sound.streaming:
+            try:
+                return self._play_backend(sound, ev_cancel=ev_cancel)
+            finally:
                 with self.lock_sound:
-                    self.priority_list.remove(priority)
-                    self.playcond.notifyAll()
+                    self._finish_stream(sound.stream_id)
+        return self._play_backend(sound, ev_cancel=ev_cancel)
+
+    def _play_sequence(self, seq, ev_cancel=None):
+        time_start = time.time()
+        ttfs = None
+        for sound in seq.sounds:
+            if ev_cancel is not None and ev_cancel.is_set():
+                break
+            try:
+                res = self._play(sound, ev_cancel=ev_cancel)
+                if ttfs is None:
+                    ttfs = res.ttfs
+
+            except Exception as e:
+                self.logger.error("Failed to play sound %s: %s" % (
+                    sound.filename, str(e)))
+
+        return Bunch.Bunch(ttfs=ttfs if ttfs is not None else 0.0,
+                           elapsed=time.time() - time_start,
+                           cancelled=(ev_cancel is not None and
+                                      ev_cancel.is_set()))
+
+    def _play_backend(self, sound, ev_cancel=None):
+        backend = self.audio
+        if not backend.can_play(sound):
+            backend = self.audio_fallback
+        try:
+            res = backend.play(sound, ev_cancel=ev_cancel)
+
+        except audio.AudioError as e:
+            if backend is self.audio_fallback or sound.streaming:
+                # NOTE: a stream can't be replayed once it is consumed
+                raise
+            self.logger.warning("%s backend failed (%s); falling back to %s" % (
+                backend.name, str(e), self.audio_fallback.name))
+            backend = self.audio_fallback
+            res = backend.play(sound, ev_cancel=ev_cancel)
+
+        self.logger.info("played %s via %s: time to first sample %.1f ms" % (
+            sound.filename, backend.name, res.ttfs * 1000.0))
+        self.metrics.record('start', res.ttfs)
+        self.metrics.record('play', res.elapsed)
+        with self.lock_sound:
+            stats = self.play_stats
+            stats['count'] += 1
+            if backend is not self.audio:
+                stats['fallbacks'] += 1
+            stats['ttfs_last'] = res.ttfs
+            stats['ttfs_total'] += res.ttfs
+            stats['ttfs_max'] = max(stats['ttfs_max'], res.ttfs)
+        return res
+
+    def getPlaybackStats(self):
+        """Return statistics about sounds played by the audio backend."""
+        with self.lock_sound:
+            stats = dict(self.play_stats)
+        stats['backend'] = self.audio.name
+        count = stats['count']
+        stats['ttfs_mean'] = stats['ttfs_total'] / count if count > 0 else 0.0
+        return stats
+
+    def getCacheStats(self):
+        """Return hit/miss counters and resident bytes of the sound cache."""
+        return self.cache.get_stats()
+
+    def clearCache(self):
+        self.cache.clear()
+        return ro.OK
+
+    def getSuppressStats(self):
+        """Return counts of the sounds suppressed as duplicates or by
+        rate limiting, and the sounds suppressed most.
+        """
+        return self.suppressor.get_stats()
+
+    def getMetrics(self):
+        """Return latency histograms for each stage of playing a sound,
+        and counts of missing and out of order messages per source.
+        """
+        return self.metrics.get_metrics()
+
+    def getMetricsText(self):
+        return self.metrics.format_text()
+
+    def dump_metrics(self):
+        try:
+            self.metrics.dump(self.metrics_file)
+
+        except (IOError, OSError) as e:
+            self.logger.error("Failed to write metrics to %s: %s" % (
+                self.metrics_file, str(e)))
+
+    def metrics_loop(self):
+        while not self.ev_metrics.wait(self.metrics_interval):
+            self.dump_metrics()
+
+    def getQueueStats(self):
+        """Return play queue depth and wait times by priority, the
+        number of sounds being prepared by the engine, and the number of
+        sounds dropped past their deadline on receipt, after decoding and
+        while queued.
+        """
+        stats = self.scheduler.get_stats()
+        stats['engine'] = self.engine.get_stats()
+        with self.lock_sound:
+            stats['expired'] = dict(self.expire_stats,
+                                    queue=stats['expired'])
+        return stats
+
+    def get_capabilities(self):
+        with self.lock:
+            muted = self.muted
+        return dict(name=self.name, codecs=sndcodec.get_codec_names(),
+                    features=self.features, muted=muted,
+                    dst=sorted(self.dst), interval=self.adv_interval)
+
+    def advertise(self):
+        """Publish our capabilities for sources on the sink channel."""
+        info = self.get_capabilities()
+        info['time'] = time.time()
+        try:
+            self.monitor.setvals([sink_channel], 'mon.sound.sink.%s' % (
+                self.name), **info)
+
+        except Exception as e:
+            self.logger.warning("Error advertising sound sink: %s" % (
+                str(e)))
 
+    def advertise_loop(self):
+        while not self.ev_adv.is_set():
+            self.advertise()
+            self.ev_adv.wait(self.adv_interval)
+
+    def muteOn(self):
+        super(SoundSink, self).muteOn()
+        if self.adv_thread is not None:
+            self.advertise()
+        return 0
+
+    def muteOff(self):
+        super(SoundSink, self).muteOff()
+        if self.adv_thread is not None:
+            self.advertise()
+        return 0
+
+    def start(self):
+        self.engine.start()
+        self.scheduler.start()
+        self.ev_adv.clear()
+        self.adv_thread = threading.Thread(target=self.advertise_loop,
+                                           name='soundsink-advertise')
+        self.adv_thread.daemon = True
+        self.adv_thread.start()
+        if self.metrics_file is not None:
+            self.ev_metrics.clear()
+            self.metrics_thread = threading.Thread(target=self.metrics_loop,
+                                                   name='soundsink-metrics')
+            self.metrics_thread.daemon = True
+            self.metrics_thread.start()
+
+    def stop(self):
+        if self.adv_thread is not None:
+            self.ev_adv.set()
+            self.adv_thread.join()
+            self.adv_thread = None
+        if self.metrics_thread is not None:
+            self.ev_metrics.set()
+            self.metrics_thread.join()
+            self.metrics_thread = None
+            self.dump_metrics()
+        self.scheduler.stop()
+        self.engine.stop()
+        self.audio.stop()
+        if self.audio_fallback is not self.audio:
+            self.audio_fallback.stop()
 
     def playSound_bg(self, buf, filename=None, decode=True,
-                     format=None, decompress=False, priority=20):
-        t = Task.FuncTask2(self._playSound_bg, buf, format=format,
-                           filename=filename, decode=decode,
-                           decompress=decompress, priority=priority)
-        t.init_and_start(self)
+                     format=None, decompress=False, priority=20,
+                     key=None, src=None, codec=None, time_sent=None,
+                     deadline=None):
+        # First thing is to reserve our place in the play queue, so that
+        # we hold back sounds of lower priority while we are decoding
+        entry = self.scheduler.submit(priority, time_sent=time_sent,
+                                      deadline=deadline)
+        # the rest is done on our engine, not in the monitor's threads
+        self.engine.submit(self._playSound_async, entry, buf,
+                           format=format, filename=filename, decode=decode,
+                           decompress=decompress, key=key, src=src,
+                           codec=codec)
 
     def playSound(self, buf, format=None,
                   filename=None, decode=True, decompress=False,
-                  priority=20):
+                  priority=20, key=None, src=None, codec=None,
+                  time_sent=None, deadline=None):
         with self.lock:
             if self.muted:
                 self.logger.warn("play sound buffer: mute is ON")
                 return ro.OK
 
+        if self._is_expired(deadline, 'receipt'):
+            return ro.OK
+
+        if decode == 'raw':
+            buf = get_raw(buf)
+
+        if self.suppressor.is_enabled():
+            if key is None:
+                key = soundcache.get_key(buf)
+            if self.suppressor.check(key, src=src,
+                                     filename=filename) is not None:
+                return ro.OK
+
+        with self.lock:
             self.playSound_bg(buf, format=format,
                               filename=filename, decode=decode,
-                              decompress=decompress, priority=priority)
+                              decompress=decompress, priority=priority,
+                              key=key, src=src, codec=codec,
+                              time_sent=time_sent, deadline=deadline)
             return ro.OK
 
+    def playSounds(self, parts, priority=20, src=None, time_sent=None,
+                   deadline=None):
+        """Play a batch of sounds one after another, as a group.  Each
+        item of `parts` is a dict with the 'buffer', 'format',
+        'filename' etc. of a sound, as would be passed to playSound().
+        """
+        with self.lock:
+            if self.muted:
+                self.logger.warn("play sound batch: mute is ON")
+                return ro.OK
+
+        if self._is_expired(deadline, 'receipt'):
+            return ro.OK
+
+        for part in parts:
+            if get_decode(part) == 'raw':
+                part['buffer'] = get_raw(part['buffer'])
+
+        # a part with no buffer must name the sound to fetch by its hash
+        _parts = [part for part in parts
+                  if part['buffer'] or part.get('hash', None)]
+        if len(_parts) < len(parts):
+            self.logger.error("skipping %d sound(s) of batch with neither "
+                              "buffer nor hash" % (len(parts) - len(_parts)))
+            parts = _parts
+            if len(parts) == 0:
+                return ro.OK
+
+        if self.suppressor.is_enabled():
+            key = soundcache.get_key(''.join(
+                [part.get('hash', None) or soundcache.get_key(part['buffer'])
+                 for part in parts]))
+            filename = '+'.join([str(part.get('filename', None))
+                                 for part in parts])
+            if self.suppressor.check(key, src=src,
+                                     filename=filename) is not None:
+                return ro.OK
+
+        entry = self.scheduler.submit(priority, time_sent=time_sent,
+                                      deadline=deadline)
+        self.engine.submit(self._playSounds_async, entry, parts, src=src)
+        return ro.OK
+
     def playFile(self, file, format=None, decode=False, decompress=False,
                  priority=20):
         with self.lock:
@@ -371,10 +1934,39 @@ class SoundSink(SoundBase):
             if len(dsts) == 0:
                 return
 
+        msgid = info.get('msgid', None)
+        if msgid is not None and self._seen_msg(msgid):
+            return
+
+        time_sent = info.get('time_sent', None)
+        if time_sent is not None:
+            self.metrics.record('transit', time.time() - time_sent)
+        seqnum = info.get('seqnum', None)
+        if seqnum is not None:
+            self.metrics.record_seq(info.get('src', None),
+                                    info.get('dst', None), seqnum)
+
+        # a batch of sounds to be played as a group
+        if 'batch' in info:
+            self.playSounds(info['batch'], priority=info['priority'],
+                            src=info.get('src', None), time_sent=time_sent,
+                            deadline=info.get('deadline', None))
+            return
+
+        # large sounds may be streamed to us in chunks
+        if 'stream' in info:
+            self.stream_arr(info)
+            return
+
+        # sounds sent by reference carry a hash and the service to fetch
+        # them from; legacy messages always carry the full buffer
         self.playSound(info['buffer'], filename=info['filename'],
-                       decode=True, format=info['format'],
+                       decode=get_decode(info), format=info['format'],
                        decompress=info['compressed'],
-                       priority=info['priority'])
+                       priority=info['priority'],
+                       key=info.get('hash', None), src=info.get('src', None),
+                       codec=info.get('codec', None), time_sent=time_sent,
+                       deadline=info.get('deadline', None))
 
 
 def main(options, args):
@@ -387,7 +1979,8 @@ def main(options, args):
     if options.rohosts is not None:
         args = options.rohosts.split(',')
     try:
-        ro.init(args)
+        with startup.timer.phase('ro.init'):
+            ro.init(args)
 
     except ro.remoteObjectError as e:
         logger.error("Error initializing remote objects subsystem: %s" % \
@@ -395,6 +1988,7 @@ def main(options, args):
         sys.exit(1)
 
     ev_quit = threading.Event()
+    time_start = time.time()
 
     # Create a local pub sub instance
     monname = '%s.mon' % basename
@@ -410,11 +2004,43 @@ def main(options, args):
     if options.soundsink:
         mobj = SoundSink(monitor=minimon, logger=logger, queue=queue,
                          channels=channels, ev_quit=ev_quit,
-                         dst=options.destination)
+                         dst=options.destination,
+                         backend=options.audio_backend,
+                         cache_size=options.cache_size * 1024 * 1024,
+                         cache_dir=options.cache_dir,
+                         preempt_priority=options.preempt_priority,
+                         mix=options.mix, duck_gain=options.duck_gain,
+                         suppress_window=options.suppress_window,
+                         rate_limit=(options.rate_limit / 60.0
+                                     if options.rate_limit else None),
+                         rate_burst=options.rate_burst,
+                         metrics_file=options.metrics_file,
+                         metrics_interval=options.metrics_interval,
+                         name='%s-%s' % (basename,
+                                         ro.get_myhost(short=True)),
+                         stream_prebuffer=options.stream_prebuffer * 1024)
     else:
         mobj = SoundSource(monitor=minimon, logger=logger, queue=queue,
                            channels=channels, ev_quit=ev_quit,
-                           compress=options.compress)
+                           compress=options.compress,
+                           svcname=basename, hashref=options.hashref,
+                           codec=options.codec, raw=options.raw,
+                           legacy_sinks=options.legacy_sinks,
+                           shard_dsts=options.shard_dsts.split(','),
+                           skip_muted=options.skip_muted,
+                           stream_chunk_size=(options.stream_chunk * 1024
+                                              if options.stream_chunk
+                                              else None),
+                           tts_cache_dir=options.tts_cache_dir,
+                           tts_rate=options.tts_rate,
+                           tts_workers=options.tts_workers,
+                           ttls=(parse_ttls(options.ttls)
+                                 if options.ttls else None),
+                           tts_cache_size=(options.tts_cache_size *
+                                           1024 * 1024))
+
+    startup.timer.add('sound sink' if options.soundsink else 'sound source',
+                      time_start, time.time())
 
     svc = ro.remoteObjectServer(svcname=basename,
                                 obj=mobj, logger=logger,
@@ -426,26 +2052,48 @@ def main(options, args):
     ro_server_started = False
     try:
         # Startup monitor threadpool
-        minimon.start(wait=True)
-        minimon.start_server(wait=True, port=options.monport)
+        with startup.timer.phase('monitor start'):
+            minimon.start(wait=True)
+            minimon.start_server(wait=True, port=options.monport)
         mon_server_started = True
 
         # Configure logger for logging via our monitor
         # if options.logmon:
         #     minimon.logmon(logger, options.logmon, ['logs'])
 
+        time_start = time.time()
         if options.soundsink:
             # Subscribe our callback functions to the local monitor
+            channels = mobj.get_channels(channels)
             minimon.subscribe_cb(mobj.anon_arr, channels)
             minimon.subscribe_remote(options.monitor, channels, {})
+            # advertise our capabilities to sources
+            minimon.publish_to(options.monitor, [sink_channel], {})
         else:
             # publish our channels to the specified monitor
-            minimon.publish_to(options.monitor, channels, {})
+            minimon.publish_to(options.monitor,
+                               channels + get_dst_channels(channels,
+                                                           mobj.shard_dsts),
+                               {})
+            # listen for sink advertisements
+            minimon.subscribe_cb(mobj.sink_arr, [sink_channel])
+            minimon.subscribe_remote(options.monitor, [sink_channel], {})
+        startup.timer.add('subscribe', time_start, time.time())
+
+        mobj.start()
 
 
-        svc.ro_start(wait=True)
+        with startup.timer.phase('ro server start'):
+            svc.ro_start(wait=True)
         ro_server_started = True
 
+        if not options.soundsink and options.tts_prewarm is not None:
+            with startup.timer.phase('tts prewarm'):
+                mobj.prewarmTextFile(options.tts_prewarm)
+
+        if options.startup_report:
+            print(startup.timer.format_report())
+
         try:
             mobj.server_loop()
 
@@ -454,6 +2102,7 @@ def main(options, args):
 
     finally:
         ev_quit.set()
+        mobj.stop()
         if mon_server_started:
             minimon.stop_server(wait=True)
         if ro_server_started:
@@ -0,0 +1,176 @@
+"""
+Tests of the audio backends of g2client.util.audio, with stand-ins for
+the player commands
+"""
+import os
+import time
+import struct
+import logging
+import tempfile
+import threading
+
+import pytest
+
+from g2client.util import audio
+from g2client.bench.codec_bench import make_wav
+
+logger = logging.getLogger('test_audio')
+
+
+def wait_for(pred, timeout=5.0):
+    time_end = time.time() + timeout
+    while time.time() < time_end:
+        if pred():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def make_player(path, script):
+    """Write a stand-in player command to `path`, returning its path."""
+    with open(str(path), 'w') as out_f:
+        out_f.write('#!/bin/sh\n' + script + '\n')
+    os.chmod(str(path), 0o755)
+    return str(path)
+
+
+def get_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+@pytest.fixture
+def pacat(tmp_path):
+    """A stand-in for pacat, appending each of its command lines to
+    'args' and what is played to 'out'.
+    """
+    out = str(tmp_path / 'out')
+    args = str(tmp_path / 'args')
+    cmd = make_player(tmp_path / 'pacat',
+                      'echo "$@" >> %s\nexec cat >> %s' % (args, out))
+    backend = audio.PulseStreamBackend(logger, playcmd=cmd, latency_ms=50)
+    yield backend, out, args
+    backend.stop()
+
+
+def test_pacat_reuse(pacat):
+    backend, out, args = pacat
+    sound = audio.Sound(make_wav(duration=0.2), format='wav')
+    spec, frames = sound.get_pcm()
+    assert backend.can_play(sound)
+
+    for i in range(2):
+        res = backend.play(sound)
+        assert not res.cancelled
+        assert res.elapsed >= 0.2
+    # one resident stream plays both sounds
+    assert wait_for(lambda: get_size(out) == 2 * len(frames))
+    with open(args, 'r') as in_f:
+        lines = in_f.read().splitlines()
+    assert len(lines) == 1
+    assert '--format=s16le' in lines[0] and '--rate=16000' in lines[0]
+
+
+def test_pacat_pad(pacat):
+    backend, out, args = pacat
+    sound = audio.Sound(make_wav(duration=0.01), format='wav')
+    spec, frames = sound.get_pcm()
+    backend.play(sound)
+    # short sounds are padded with silence to the stream's latency
+    prebuf = 16000 * 50 // 1000 * 2
+    assert wait_for(lambda: get_size(out) == prebuf)
+    with open(out, 'rb') as in_f:
+        data = in_f.read()
+    assert data == bytes(frames) + b'\x00' * (prebuf - len(frames))
+
+
+def test_pacat_cancel(pacat):
+    backend, out, args = pacat
+    sound = audio.Sound(make_wav(duration=5.0), format='wav')
+    ev_cancel = threading.Event()
+    threading.Timer(0.1, ev_cancel.set).start()
+    res = backend.play(sound, ev_cancel=ev_cancel)
+    assert res.cancelled and res.elapsed < 1.0
+    # a cancelled stream still has audio queued, so it is not reused
+    assert backend.idle == []
+
+
+def test_pacat_not_pcm(pacat):
+    backend, out, args = pacat
+    sound = audio.Sound(b'ID3' + b'\x00' * 100, format='mp3')
+    assert not backend.can_play(sound)
+
+
+def make_au(samples, rate=8000, encoding=3, length=None):
+    """Return the contents of an AU file of 16-bit `samples`."""
+    data = struct.pack('>%dh' % len(samples), *samples)
+    if length is None:
+        length = len(data)
+    return struct.pack('>4s5I', b'.snd', 24, length, encoding, rate,
+                       1) + data
+
+
+def test_parse_pcm():
+    data = make_wav(duration=0.1)
+    spec, offset, length = audio.parse_pcm(data)
+    assert spec == audio.PCMSpec('s16le', 16000, 1, 2)
+    assert offset == 44 and length == 3200
+
+    data = make_au([0, 1, -1, 2])
+    assert audio.parse_pcm(data) == (audio.PCMSpec('s16be', 8000, 1, 2),
+                                     24, 8)
+    # an unknown length runs to the end of the file
+    data = make_au([0, 1, -1, 2], length=0xffffffff)
+    assert audio.parse_pcm(data)[2] == 8
+    # as does a length longer than the file, if it is only the start
+    assert audio.parse_pcm(data[:28], total=len(data))[2] == 8
+
+    for data in (b'ID3' + b'\x00' * 100, make_au([0], encoding=23),
+                 b'RIFF\x00\x00\x00\x00WAVE'):
+        with pytest.raises(audio.AudioError):
+            audio.parse_pcm(data)
+
+
+def test_sound_pcm():
+    sound = audio.Sound(make_au([0, 1, -1, 2]), format='au')
+    spec, frames = sound.get_pcm()
+    assert bytes(frames) == struct.pack('>4h', 0, 1, -1, 2)
+    assert sound.get_duration() == 4 / 8000.0
+
+    sound = audio.Sound(b'ID3' + b'\x00' * 100, format='mp3')
+    assert not sound.is_pcm() and sound.get_duration() is None
+
+
+@pytest.mark.parametrize('use_memfd', [True, False])
+def test_paplay(tmp_path, monkeypatch, use_memfd):
+    if use_memfd and not hasattr(os, 'memfd_create'):
+        pytest.skip("no memfd on this platform")
+    out = str(tmp_path / 'out')
+    # played from the file named, or from stdin
+    cmd = make_player(tmp_path / 'paplay',
+                      'if [ -n "$1" ]; then exec cat "$1" > %s; '
+                      'else exec cat > %s; fi' % (out, out))
+    tmpdir = tmp_path / 'tmp'
+    tmpdir.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+
+    backend = audio.PaplayBackend(logger, playcmd=cmd, use_memfd=use_memfd)
+    data = make_wav(duration=0.1)
+    res = backend.play(audio.Sound(data, format='wav'))
+    assert not res.cancelled
+    with open(out, 'rb') as in_f:
+        assert in_f.read() == data
+    # no temp files were used
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_paplay_cancel(tmp_path):
+    cmd = make_player(tmp_path / 'paplay', 'exec sleep 5')
+    backend = audio.PaplayBackend(logger, playcmd=cmd)
+    ev_cancel = threading.Event()
+    threading.Timer(0.1, ev_cancel.set).start()
+    res = backend.play(audio.Sound(make_wav(duration=0.1), format='wav'),
+                       ev_cancel=ev_cancel)
+    assert res.cancelled and res.elapsed < 1.0
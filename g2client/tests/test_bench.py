@@ -0,0 +1,80 @@
+"""
+Small runs of the benchmarks of g2client.bench
+"""
+import json
+import logging
+from argparse import Namespace
+
+from g2client.util import sndcodec
+from g2client.bench import pipeline_bench, codec_bench
+
+logger = logging.getLogger('test_bench')
+
+
+def test_throughput():
+    res = pipeline_bench.bench_throughput(logger, Namespace(num=20))
+    assert res['messages'] == 20
+    assert res['msgs_per_sec'] > 0 and res['send_per_sec'] > 0
+
+
+def test_contention():
+    res = pipeline_bench.bench_contention(logger, Namespace(num=8))
+    assert res['messages'] == 8
+    assert sum([stats['count']
+                for stats in res['latency'].values()]) == 8
+
+
+def test_memory():
+    res = pipeline_bench.bench_memory(logger, Namespace(num=10))
+    assert res['queued'] == 10
+    assert res['bytes_per_sound'] > 0
+
+
+def test_costs():
+    res = pipeline_bench.bench_costs(logger, Namespace(repeat=0))
+    modes = set([rec['mode'] for rec in res])
+    assert set(['plain', 'compress', 'zlib']) <= modes
+    for rec in res:
+        if rec['mode'] == 'plain':
+            # base64 encoded
+            assert rec['wire'] > rec['size']
+
+
+def test_main_compare(tmp_path, capsys):
+    path = str(tmp_path / 'res.json')
+    options = Namespace(tests='throughput', num=10, repeat=1, output=path,
+                        compare=None)
+    pipeline_bench.main(options, [])
+    with open(path, 'r') as in_f:
+        old = json.load(in_f)
+    assert old['results']['throughput']['messages'] == 10
+
+    options.output = None
+    options.compare = path
+    pipeline_bench.main(options, [])
+    out = capsys.readouterr().out
+    assert 'throughput.msgs_per_sec' in out
+
+
+def test_flatten():
+    flat = pipeline_bench.flatten(dict(a=dict(b=1, c='x'),
+                                       d=[dict(mode='zlib', size=10,
+                                               wire=5)]))
+    assert flat == {'a.b': 1, 'd.zlib/size=10.wire': 5}
+
+
+def test_codecs(tmp_path):
+    path = tmp_path / 'beep.wav'
+    path.write_bytes(codec_bench.make_wav(duration=0.1))
+    corpus = codec_bench.get_corpus([str(path)])
+    assert [(name, format) for name, format, data in corpus] == [
+        ('beep.wav', 'wav')]
+
+    data = corpus[0][2]
+    for name in sndcodec.get_codec_names():
+        res = codec_bench.run_codec(name, data, 'wav', 1)
+        assert res['codec'] == name and res['size'] == len(data)
+    # codecs that do not apply to a payload are passed over
+    if 'pcmdelta' in sndcodec.get_codec_names():
+        assert codec_bench.run_codec('pcmdelta', b'ID3' + b'\x00' * 100,
+                                     'mp3', 1) is None
@@ -0,0 +1,301 @@
+"""
+Tests of g2client.g2disp, without a Gen2 system or VNC viewers
+"""
+import time
+import logging
+import argparse
+import threading
+
+import pytest
+
+from g2base import Bunch
+from g2base.remoteObjects import remoteObjects as ro
+
+from g2client import g2disp, soundsink
+from g2client.bench import standins
+from g2client.bench.codec_bench import make_wav
+from g2client.util import vncprobe
+
+logger = logging.getLogger('test_g2disp')
+
+
+def wait_for(pred, timeout=5.0):
+    time_end = time.time() + timeout
+    while time.time() < time_end:
+        if pred():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+class Supervisor(object):
+    """Records the viewers started and stopped.  Viewers take
+    `connect_time` sec to connect, except those of `unreachable`
+    remote displays.
+    """
+
+    def __init__(self, connect_time=0.2, unreachable=()):
+        self.lock = threading.Lock()
+        self.connect_time = connect_time
+        self.unreachable = unreachable
+        self.launched = []
+        self.removed = []
+        # key -> command line
+        self.viewers = {}
+
+    def add(self, key, cmdstr, info=None):
+        with self.lock:
+            self.launched.append((key, info['profile']))
+            self.viewers[key] = cmdstr
+
+    def remove(self, key):
+        with self.lock:
+            del self.viewers[key]
+            self.removed.append(key)
+
+    def wait_connected(self, key, timeout=10.0):
+        with self.lock:
+            cmdstr = self.viewers[key]
+        if any([remote in cmdstr for remote in self.unreachable]):
+            time.sleep(timeout)
+            return None
+        time.sleep(self.connect_time)
+        return self.connect_time
+
+    def profiles(self):
+        with self.lock:
+            return [profile for key, profile in self.launched]
+
+
+class Link(object):
+    """Stands in for probing the link to a VNC server."""
+
+    def __init__(self, rtt, jitter=0.0):
+        self.rtt = rtt
+        self.jitter = jitter
+        self.probes = []
+
+    def probe(self, host, port, count=3, timeout=2.0):
+        self.probes.append((host, port))
+        return Bunch.Bunch(rtt=self.rtt, jitter=self.jitter, failed=0,
+                           time=time.time())
+
+
+@pytest.fixture
+def make_disp(monkeypatch, tmp_path):
+
+    def _make(rtt=0.001, **kwdargs):
+        link = Link(rtt)
+        monkeypatch.setattr(vncprobe, 'probe', link.probe)
+        monkeypatch.setattr(g2disp.tempfile, 'tempdir', str(tmp_path))
+        disp = g2disp.g2Disp(logger=logger, **kwdargs)
+        disp.supervisor = Supervisor()
+        return disp, link
+
+    return _make
+
+
+def viewer_on(disp):
+    return disp._viewerOn(':1', '800x600+0+0', 'vnchost:1', 'c2VjcmV0',
+                          False)
+
+
+def test_profile_unprobed(make_disp):
+    disp, link = make_disp(rtt=0.001)
+    key = viewer_on(disp)
+    # started on the default profile, then tuned to the link
+    assert wait_for(lambda: len(disp.supervisor.launched) == 2)
+    assert disp.supervisor.launched == [(key, 'wan'), (key, 'lan')]
+    assert link.probes == [('vnchost', 5901)]
+    assert disp.viewer_specs[key].rtt == 0.001
+
+
+def test_profile_probed_long_ago(make_disp):
+    disp, link = make_disp(rtt=0.001)
+    disp.prober.probe('vnchost:1')
+    # however old the last probe, it is used to start with
+    res = disp.prober.get_last_result('vnchost:1')
+    res.time -= 1000.0
+    assert disp.prober.get_result('vnchost:1') is None
+
+    viewer_on(disp)
+    time.sleep(0.1)
+    assert disp.supervisor.profiles() == ['lan']
+    assert len(link.probes) == 1
+
+
+def test_profile_named(make_disp):
+    disp, link = make_disp(vnc_profile='constrained')
+    viewer_on(disp)
+    time.sleep(0.1)
+    assert disp.supervisor.profiles() == ['constrained']
+    assert link.probes == []
+
+
+def test_reprobe(make_disp):
+    disp, link = make_disp(rtt=0.001)
+    disp.prober.probe('vnchost:1')
+    key = viewer_on(disp)
+    spec = disp.viewer_specs[key]
+    assert disp.supervisor.profiles() == ['lan']
+
+    # the link got worse: switch once that is seen twice running
+    link.rtt = 0.200
+    disp.prober.results.clear()
+    disp._reprobe(key, spec)
+    assert disp.supervisor.profiles() == ['lan']
+    disp.prober.results.clear()
+    disp._reprobe(key, spec)
+    assert disp.supervisor.profiles() == ['lan', 'constrained']
+
+    # not after the viewer was turned off
+    disp._viewerOff(':1', '800x600+0+0')
+    link.rtt = 0.001
+    disp.prober.results.clear()
+    disp._reprobe(key, spec, confirm=False)
+    assert disp.supervisor.profiles() == ['lan', 'constrained']
+    assert disp.supervisor.removed == [key]
+
+
+class Client(object):
+    """Stands in for a remote objects client."""
+
+    def __init__(self, *args, **kwdargs):
+        pass
+
+    def ro_echo(self, arg):
+        return arg
+
+    def ro_start(self, wait=True):
+        pass
+
+    def ro_stop(self, wait=True):
+        pass
+
+
+@pytest.fixture
+def make_server(monkeypatch, tmp_path):
+    """Makes a g2Disp talking to in-process stand-ins for Gen2 systems,
+    which records what the remote objects state was pointed at.
+    """
+    inits = []
+    disps = []
+    monkeypatch.setattr(g2disp.Monitor, 'Monitor', standins.LocalMonitor)
+    monkeypatch.setattr(ro, 'remoteObjectServer', Client)
+    monkeypatch.setattr(ro, 'remoteObjectClient', Client)
+    monkeypatch.setattr(ro, 'init', lambda rohosts: inits.append(
+        ','.join(rohosts)))
+
+    def _make(args=[]):
+        argprs = argparse.ArgumentParser()
+        g2disp.add_options(argprs)
+        options = argprs.parse_args(['--audio-backend', 'null',
+                                     '--cache-dir', str(tmp_path)] + args)
+        disp = g2disp.g2Disp(logger=logger, basename='g2disp-test',
+                             health_interval=0, probe_interval=0,
+                             start_timeout=5.0)
+        disps.append(disp)
+        return disp, options, inits
+
+    yield _make
+    for disp in disps:
+        if disp.ev_started.is_set():
+            disp.stop_server()
+
+
+def test_switch_before_start(make_server):
+    disp, options, inits = make_server()
+    disp.start_timeout = 0.1
+    with pytest.raises(ro.remoteObjectError):
+        disp.addSystem('b1,b2')
+    with pytest.raises(ro.remoteObjectError):
+        disp.switchSystem('b1,b2')
+    assert inits == []
+
+
+def test_switch_during_start(make_server):
+    disp, options, inits = make_server()
+    res = []
+    switch_thread = threading.Thread(
+        target=lambda: res.append(disp.switchSystem('b1,b2')))
+    switch_thread.start()
+    time.sleep(0.1)
+    # the switch waits for the server to connect to its first system
+    assert res == [] and inits == []
+
+    disp.start_server(['a1', 'a2'], options)
+    switch_thread.join(5.0)
+    assert len(res) == 1
+    systems = disp.getSystems()
+    assert [(system['rohosts'], system['active'])
+            for system in systems['systems']] == [('a1,a2', False),
+                                                  ('b1,b2', True)]
+    assert systems['switches'] == 1
+    # remote objects are left pointed at the active system
+    assert inits[-1] == 'b1,b2'
+
+
+def test_switch_standby(make_server):
+    disp, options, inits = make_server(['--standby', 'b1,b2'])
+    disp.start_server(['a1', 'a2'], options)
+    assert inits == ['a1,a2', 'b1,b2', 'a1,a2']
+    conn_a, conn_b = list(disp.connections.values())
+    assert disp.active is conn_a
+
+    # sounds from the standby system are not passed on
+    source = soundsink.SoundSource(monitor=conn_b.monitor, logger=logger,
+                                   channels=['sound'])
+    source._playSound(make_wav(duration=0.05), format='wav',
+                      filename='a.wav')
+    assert disp.route_stats['standby'] == 1
+    assert disp.route_stats['routed'] == 0
+
+    assert disp.switchSystem(['b1', 'b2']) >= 0.0
+    assert disp.active is conn_b and disp.prev_active is conn_a
+    assert disp.soundsource.monitor is conn_b.monitor
+    assert inits[-1] == 'b1,b2'
+    # switching to the active system does nothing
+    assert disp.switchSystem('b1,b2') == 0.0
+    assert disp.route_stats['switches'] == 1
+
+
+class Sink(object):
+
+    def __init__(self):
+        self.muted = False
+
+    def muteOn(self):
+        self.muted = True
+
+    def muteOff(self):
+        self.muted = False
+
+
+def test_viewers_on(make_disp):
+    disp, link = make_disp(vnc_profile='wan')
+    disp.soundsink = Sink()
+    disp.supervisor = Supervisor(unreachable=['badhost:1'])
+    specs = [(':1', '800x600+0+0', 'vnchost:1', False),
+             (':2', '800x600+0+0', 'vnchost:2', True, 'b3RoZXI='),
+             (':3', '800x600+0+0', 'badhost:1', False)]
+    time_start = time.time()
+    res = disp.viewersOn(specs, passwd='c2VjcmV0', timeout=0.3)
+    # started together, so it takes about as long as the slowest one
+    assert time.time() - time_start < 0.55
+    assert [(r['display'], r['ok'], r['connect_time']) for r in res] == [
+        (':1', True, 0.2), (':2', True, 0.2), (':3', False, None)]
+    assert 'not connected' in res[2]['error']
+    assert not disp.soundsink.muted
+
+    # each screen has its own password file
+    with open(disp.passwd_files[':1800x600+0+0'], 'rb') as in_f:
+        assert in_f.read() == b'secret'
+    with open(disp.passwd_files[':2800x600+0+0'], 'rb') as in_f:
+        assert in_f.read() == b'other'
+    assert '-viewonly' in disp.supervisor.viewers[':2800x600+0+0']
+
+    res = disp.viewersOff([(':1', '800x600+0+0'), (':4', '800x600+0+0')])
+    assert [(r['display'], r['ok'], r['error']) for r in res] == [
+        (':1', True, None), (':4', False, "no viewer")]
+    assert disp.soundsink.muted
+    assert ':1800x600+0+0' not in disp.passwd_files
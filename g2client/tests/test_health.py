@@ -0,0 +1,107 @@
+"""
+Tests of the HealthProbe of g2client.util.health
+"""
+import time
+import logging
+import threading
+import concurrent.futures
+
+import pytest
+
+from g2client.util import health
+
+logger = logging.getLogger('test_health')
+
+
+def test_percentile():
+    assert health.percentile([], 50) is None
+    values = [0.5, 0.1, 0.2, 0.4, 0.3]
+    assert health.percentile(values, 0) == 0.1
+    assert health.percentile(values, 50) == 0.3
+    assert health.percentile(values, 100) == 0.5
+
+
+@pytest.fixture
+def probe():
+    # checked by hand, rather than in its own thread
+    probe = health.HealthProbe(logger, interval=0.0, timeout=0.2,
+                               warn_rtt=0.020, bad_rtt=0.200)
+    probe.pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    ev_hang = threading.Event()
+    yield probe, ev_hang
+    ev_hang.set()
+    probe.stop()
+
+
+def run(probe, count):
+    # probe all targets `count` times, waiting for each round
+    for i in range(count):
+        probe.check()
+        time_end = time.time() + 1.0
+        while time.time() < time_end:
+            with probe.lock:
+                if all([target.future is None or target.future.done()
+                        for target in probe.targets.values()]):
+                    break
+            time.sleep(0.005)
+    probe.check()
+
+
+def fail():
+    raise OSError("connection refused")
+
+
+def test_status(probe):
+    probe, ev_hang = probe
+    probe.set_targets([('fast', 'ro', 'h1', lambda: None),
+                       ('slow', 'ro', 'h2', lambda: time.sleep(0.03)),
+                       ('down', 'ro', 'h3', fail)])
+    run(probe, 3)
+    res = probe.get_health()
+    targets = res['targets']
+    assert targets['fast']['status'] == 'ok'
+    assert targets['slow']['status'] == 'warn'
+    assert targets['slow']['p50'] >= 0.03
+    assert targets['down']['status'] == 'bad'
+    assert targets['down']['loss'] == 1.0
+    assert targets['down']['last_error'] == "connection refused"
+    assert targets['down']['history'] == [None] * 3
+    # the overall status is the worst of them
+    assert res['status'] == 'bad'
+
+
+def test_timeout(probe):
+    probe, ev_hang = probe
+    calls = []
+
+    def hang():
+        calls.append(time.time())
+        ev_hang.wait()
+
+    probe.set_targets([('hung', 'monitor', 'h1', hang)])
+    probe.check()
+    time.sleep(0.25)
+    probe.check()
+    info = probe.get_health()['targets']['hung']
+    assert info['last_error'] == "timed out"
+    assert info['status'] == 'bad'
+    # the probe that timed out is lost, and so is each one due while it
+    # hangs, but no more calls are piled on the host
+    probe.check()
+    assert probe.get_health()['targets']['hung']['history'] == [None] * 3
+    assert len(calls) == 1
+
+
+def test_set_targets(probe):
+    probe, ev_hang = probe
+    assert probe.get_health()['status'] is None
+    probe.set_targets([('ro:a', 'ro', 'a', lambda: None),
+                       ('monitor', 'monitor', 'a,b', lambda: None)])
+    run(probe, 2)
+    # the history of a target is kept only while its host is the same
+    probe.set_targets([('ro:a', 'ro', 'a', lambda: None),
+                       ('monitor', 'monitor', 'c,d', lambda: None)])
+    targets = probe.get_health()['targets']
+    assert targets['ro:a']['count'] == 2
+    assert targets['monitor']['count'] == 0
+    assert targets['monitor']['status'] is None
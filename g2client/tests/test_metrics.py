@@ -0,0 +1,68 @@
+"""
+Tests of the latency metrics of g2client.util.metrics
+"""
+import json
+
+import pytest
+
+from g2client.util import metrics
+
+
+def test_histogram():
+    hist = metrics.Histogram(base=0.001)
+    assert hist.get_stats() == dict(count=0)
+    assert hist.percentile(50) is None
+
+    for value in [0.0005] * 8 + [0.003, 0.1]:
+        hist.add(value)
+    stats = hist.get_stats()
+    assert stats['count'] == 10
+    assert stats['min'] == 0.0005 and stats['max'] == 0.1
+    assert stats['mean'] == pytest.approx(0.107 / 10)
+    # percentiles are the upper bounds of their buckets
+    assert stats['p50'] == 0.001
+    assert stats['p90'] == 0.004
+    assert stats['p99'] == 0.1
+    assert stats['buckets'] == [(0.001, 8), (0.004, 1), (0.128, 1)]
+
+
+def test_histogram_range():
+    hist = metrics.Histogram(base=0.001, nbuckets=4)
+    hist.add(-1.0)
+    hist.add(100.0)
+    assert hist.counts == [1, 0, 0, 1]
+    # the last bucket has no upper bound
+    assert hist.percentile(100) == 100.0
+
+
+def test_sequence():
+    tracker = metrics.SequenceTracker()
+    for seqnum in [5, 6, 8, 9, 7, 12]:
+        tracker.add(seqnum)
+    # 7 came late, and 10 and 11 never came
+    assert tracker.get_stats() == dict(received=6, missing=2,
+                                       out_of_order=1)
+
+
+def test_dump(tmp_path):
+    sm = metrics.SoundMetrics()
+    sm.record('wait', 0.010)
+    sm.record_seq('src', 'all', 1)
+    sm.record_seq('src', 'all', 3)
+
+    path = str(tmp_path / 'metrics.json')
+    sm.dump(path)
+    with open(path, 'r') as in_f:
+        res = json.load(in_f)
+    assert res['stages']['wait']['count'] == 1
+    assert res['stages']['play'] == dict(count=0)
+    assert res['sources'] == {'src/all': dict(received=2, missing=1,
+                                              out_of_order=0)}
+
+    path = str(tmp_path / 'metrics.txt')
+    sm.dump(path)
+    with open(path, 'r') as in_f:
+        lines = in_f.read().splitlines()
+    assert lines[0].split()[:2] == ['stage', 'count']
+    assert lines[4].split()[:2] == ['wait', '1']
+    assert lines[-1].split() == ['src/all', '2', '1', '0']
@@ -0,0 +1,93 @@
+"""
+Tests of the PCM Mixer of g2client.util.mixer
+"""
+import struct
+import logging
+
+import pytest
+
+from g2client.util import audio, mixer
+
+np = pytest.importorskip('numpy')
+
+logger = logging.getLogger('test_mixer')
+
+
+def make_sound(samples, rate=8000, channels=1, filename=None):
+    """Return a 16-bit WAV audio.Sound of the list of `samples`."""
+    spec = audio.PCMSpec('s16le', rate, channels, 2)
+    data = struct.pack('<%dh' % len(samples), *samples)
+    return audio.Sound(mixer.make_wav(spec, data), format='wav',
+                       filename=filename)
+
+
+def get_samples(sound):
+    spec, frames = sound.get_pcm()
+    return np.frombuffer(frames, dtype='<i2').reshape((-1, spec.channels))
+
+
+def test_to_float():
+    # A-law has no zero, only the smallest steps either side of it
+    for fmt, silent in (('ulaw', b'\xff'), ('alaw', b'\xd5'),
+                        ('u8', b'\x80')):
+        spec = audio.PCMSpec(fmt, 8000, 1, 1)
+        assert np.all(np.abs(mixer.to_float(spec, silent * 4)) < 0.001)
+
+    spec = audio.PCMSpec('s24be', 8000, 2, 3)
+    samples = mixer.to_float(spec, b'\x40\x00\x00\xc0\x00\x00')
+    assert samples.shape == (1, 2)
+    assert list(samples[0]) == [0.5, -0.5]
+
+
+def test_convert():
+    samples = np.array([[0.0], [1.0]], dtype=np.float32)
+    out = mixer.convert(samples, 8000, 16000, 2)
+    assert out.shape == (4, 2)
+    assert list(out[:, 0]) == list(out[:, 1]) == [0.0, 0.5, 1.0, 1.0]
+
+
+def test_mix():
+    mix = mixer.Mixer(logger, duck_gain=0.5)
+    a = make_sound([1000] * 800, filename='a.au')
+    # 100 frames at our rate, once converted
+    b = make_sound([2000] * 400, rate=16000, channels=2, filename='b.au')
+    sound = mix.mix([a, b])
+    # in the rate and channels of the first, as long as the longest
+    assert sound.filename == 'a.au+b.au'
+    spec, frames = sound.get_pcm()
+    assert (spec.rate, spec.channels) == (8000, 1)
+    samples = get_samples(sound)[:, 0]
+    assert len(samples) == 800
+    assert abs(int(samples[50]) - 3000) <= 1
+    assert abs(int(samples[700]) - 1000) <= 1
+    assert mix.get_stats() == dict(mixes=1, mixed=2, limited=0)
+
+
+def test_limit():
+    mix = mixer.Mixer(logger)
+    a = make_sound([30000] * 800)
+    sound = mix.mix([a, a])
+    # scaled down to fit, rather than clipped
+    assert np.all(get_samples(sound) <= 32767)
+    assert abs(int(get_samples(sound)[0, 0]) - 32767) <= 1
+    assert mix.get_stats()['limited'] == 800 // 160
+
+
+def test_duck():
+    mix = mixer.Mixer(logger, duck_gain=0.5)
+    a = make_sound([1000] * 400)
+    b = make_sound([4000] * 800)
+    sound = mix.mix([a, b], ducked=[False, True])
+    samples = get_samples(sound)[:, 0]
+    # ducked while the other plays, then at full volume
+    assert abs(int(samples[100]) - 3000) <= 1
+    assert abs(int(samples[700]) - 4000) <= 1
+
+
+def test_can_mix():
+    mix = mixer.Mixer(logger)
+    assert mix.can_mix(make_sound([0] * 10))
+    assert not mix.can_mix(audio.Sound(b'ID3' + b'\x00' * 100,
+                                       format='mp3'))
+    stream = audio.StreamingSound(1, 100, 100, format='wav')
+    assert not mix.can_mix(stream)
@@ -0,0 +1,276 @@
+"""
+Tests of sounds going from a SoundSource to a SoundSink, through the
+stand-ins of g2client.bench.pipeline_bench
+"""
+import logging
+
+import pytest
+
+from g2base import Bunch
+from g2base.remoteObjects import remoteObjects as ro
+
+from g2client.util import audio, suppress
+from g2client.bench import standins
+from g2client.bench.pipeline_bench import Pipeline
+from g2client.bench.codec_bench import make_wav
+
+logger = logging.getLogger('test_pipeline')
+
+
+class Recorder(audio.NullBackend):
+    """Records the filename and contents of each sound played."""
+
+    def __init__(self, logger):
+        super(Recorder, self).__init__(logger)
+        self.sounds = []
+
+    def play(self, sound, ev_cancel=None):
+        data = b''.join([bytes(piece) for piece in sound.iter_data()])
+        with self.lock:
+            self.sounds.append((sound.filename, data))
+        return Bunch.Bunch(ttfs=0.0, elapsed=0.0, cancelled=False)
+
+
+class Wire(object):
+    """Records the sound messages that reach the sink of `pipe`, with
+    the channels they came on.
+    """
+
+    def __init__(self, pipe):
+        self.msgs = []
+        pipe.monitor.subscribe_cb(self.anon_arr,
+                                  pipe.sink.get_channels(['sound']))
+
+    def anon_arr(self, payload, names, channels):
+        self.msgs.append((channels[0], payload['value']))
+
+
+@pytest.fixture
+def make_pipeline():
+    pipes = []
+
+    def _make(**kwdargs):
+        recorder = Recorder(logger)
+        pipe = Pipeline(logger, backend=recorder, **kwdargs)
+        pipe.sink.scheduler.waitval = 0.0
+        pipes.append(pipe)
+        return pipe, recorder
+
+    yield _make
+    for pipe in pipes:
+        pipe.stop()
+
+
+def test_plain(make_pipeline):
+    pipe, recorder = make_pipeline()
+    data = make_wav(duration=0.1)
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(1, timeout=5.0)
+    assert recorder.sounds == [('a.wav', data)]
+
+
+def test_hashref(make_pipeline):
+    pipe, recorder = make_pipeline(hashref=True, svcname='test.src')
+    standins.connect_proxy(pipe.sink, pipe.source)
+    fetched = []
+    fetch = pipe.source.fetchSound
+
+    def count_fetch(key):
+        fetched.append(key)
+        return fetch(key)
+
+    pipe.source.fetchSound = count_fetch
+    data = make_wav(duration=0.1)
+
+    # the first time the sound goes in full
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(1, timeout=5.0)
+    # then by reference, played from the sink's cache
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(2, timeout=5.0)
+    assert fetched == []
+    assert pipe.sink.getCacheStats()['hits'] == 1
+    # or fetched from the source, if the sink no longer has it
+    pipe.sink.clearCache()
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(3, timeout=5.0)
+    assert len(fetched) == 1
+
+    assert recorder.sounds == [('a.wav', data)] * 3
+
+
+def test_stream(make_pipeline):
+    pipe, recorder = make_pipeline(stream_chunk_size=4000)
+    data = make_wav(duration=1.0)
+    small = make_wav(duration=0.05)
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    pipe.source._playSound(small, format='wav', filename='b.wav')
+    assert pipe.wait_played(2, timeout=5.0)
+    assert recorder.sounds == [('a.wav', data), ('b.wav', small)]
+
+    stats = pipe.sink.getStreamStats()
+    # only the large sound is streamed
+    assert stats['streams'] == 1
+    assert stats['chunks'] == (len(data) + 3999) // 4000
+    assert stats['lost'] == 0 and stats['active'] == 0
+
+
+def test_stream_suppressed(make_pipeline):
+    pipe, recorder = make_pipeline(stream_chunk_size=4000)
+    pipe.sink.suppressor = suppress.SoundSuppressor(logger, window=10.0)
+    data = make_wav(duration=1.0)
+    other = make_wav(duration=1.0, freq=440.0)
+    for buf in (data, data, other):
+        pipe.source._playSound(buf, format='wav', filename='a.wav')
+    assert pipe.wait_played(2, timeout=5.0)
+    # the repeat of the streamed sound is coalesced
+    assert recorder.sounds == [('a.wav', data), ('a.wav', other)]
+    assert pipe.sink.getSuppressStats()['coalesced'] == 1
+    assert pipe.sink.getStreamStats()['streams'] == 2
+
+
+def test_batch(make_pipeline):
+    pipe, recorder = make_pipeline()
+    sounds = [('%d.wav' % i, make_wav(duration=0.05, freq=440.0 * (i + 1)))
+              for i in range(3)]
+    num_msgs = pipe.monitor.num_msgs
+    res = pipe.source._playSounds([dict(buffer=data, format='wav',
+                                        filename=filename)
+                                   for filename, data in sounds])
+    assert res == ro.OK
+    # the batch goes in one message and takes one place in the queue,
+    # and its sounds are played in order
+    assert pipe.wait_played(1, timeout=5.0)
+    assert pipe.monitor.num_msgs == num_msgs + 1
+    assert recorder.sounds == sounds
+
+
+def test_batch_empty_part(make_pipeline):
+    pipe, recorder = make_pipeline()
+    data = make_wav(duration=0.05)
+    part = dict(buffer=ro.binary_encode(data), format='wav',
+                filename='a.wav')
+    empty = dict(buffer='', format='wav', filename='b.wav')
+    # a part with neither buffer nor hash is skipped
+    assert pipe.sink.playSounds([empty, part, empty]) == ro.OK
+    assert pipe.wait_played(1, timeout=5.0)
+    assert pipe.sink.playSounds([empty]) == ro.OK
+    assert recorder.sounds == [('a.wav', data)]
+    assert pipe.sink.getQueueStats()['played'] == 1
+
+
+def test_batch_legacy(make_pipeline):
+    pipe, recorder = make_pipeline(legacy_sinks=True)
+    sounds = [('%d.wav' % i, make_wav(duration=0.05, freq=440.0 * (i + 1)))
+              for i in range(3)]
+    res = pipe.source._playSounds([dict(buffer=data, format='wav',
+                                        filename=filename)
+                                   for filename, data in sounds])
+    # legacy sinks get the sounds one by one, in order
+    assert res == ro.OK
+    assert pipe.wait_played(3, timeout=5.0)
+    assert recorder.sounds == sounds
+
+
+@pytest.mark.parametrize('legacy_sinks, channel', [(True, 'sound'),
+                                                    (False, 'sound.all')])
+def test_one_copy_per_sink(make_pipeline, legacy_sinks, channel):
+    pipe, recorder = make_pipeline(legacy_sinks=legacy_sinks)
+    wire = Wire(pipe)
+    data = make_wav(duration=0.1)
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(1, timeout=5.0)
+    assert [msg[0] for msg in wire.msgs] == [channel]
+    assert recorder.sounds == [('a.wav', data)]
+
+
+@pytest.mark.parametrize('legacy_sinks, dst, channel', [
+    (True, 'summit', 'sound'),
+    (False, 'summit', 'sound.summit'),
+    # our sink serves both, so it would get a copy on each sub-channel
+    (False, 'all,summit', 'sound'),
+    # not one of the destinations sharded
+    (False, 'other', 'sound'),
+    ])
+def test_shard_channels(make_pipeline, legacy_sinks, dst, channel):
+    pipe, recorder = make_pipeline(legacy_sinks=legacy_sinks)
+    wire = Wire(pipe)
+    pipe.source._playSound(make_wav(duration=0.05), format='wav',
+                           filename='a.wav', dst=dst)
+    assert [msg[0] for msg in wire.msgs] == [channel]
+    assert wire.msgs[0][1]['dst'] == dst
+
+
+@pytest.mark.parametrize('legacy_sinks', [True, False])
+def test_raw(make_pipeline, legacy_sinks):
+    pipe, recorder = make_pipeline(raw=True, legacy_sinks=legacy_sinks)
+    wire = Wire(pipe)
+    data = make_wav(duration=0.1)
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(1, timeout=5.0)
+    assert len(wire.msgs) == 1
+    info = wire.msgs[0][1]
+    if legacy_sinks:
+        # legacy sinks can only take base64
+        assert info.get('encoding', None) is None
+        assert len(info['buffer']) > len(data)
+    else:
+        assert info['encoding'] == 'raw'
+        assert len(info['buffer']) == len(data)
+    assert recorder.sounds == [('a.wav', data)]
+
+
+@pytest.mark.parametrize('legacy_sinks', [True, False])
+def test_hashref_bytes(make_pipeline, legacy_sinks):
+    pipe, recorder = make_pipeline(hashref=True, svcname='test.src',
+                                   legacy_sinks=legacy_sinks)
+    standins.connect_proxy(pipe.sink, pipe.source)
+    wire = Wire(pipe)
+    data = make_wav(duration=0.1)
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(1, timeout=5.0)
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(2, timeout=5.0)
+
+    sizes = [len(msg[1]['buffer']) for msg in wire.msgs]
+    assert len(sizes) == 2 and sizes[0] > len(data)
+    if legacy_sinks:
+        # legacy sinks know nothing of hashes, so both go in full
+        assert sizes[1] == sizes[0]
+        assert all('hash' not in msg[1] for msg in wire.msgs)
+    else:
+        assert sizes[1] == 0
+    assert recorder.sounds == [('a.wav', data)] * 2
+
+
+@pytest.mark.parametrize('legacy_sinks', [True, False])
+def test_codec_bytes(make_pipeline, legacy_sinks):
+    pipe, recorder = make_pipeline(codec='zlib', legacy_sinks=legacy_sinks)
+    wire = Wire(pipe)
+    data = make_wav(duration=0.5)
+    pipe.source._playSound(data, format='wav', filename='a.wav')
+    assert pipe.wait_played(1, timeout=5.0)
+
+    assert len(wire.msgs) == 1
+    info = wire.msgs[0][1]
+    if legacy_sinks:
+        # legacy sinks get the legacy compression instead
+        assert info['compressed'] and 'codec' not in info
+    else:
+        assert info['codec'] == 'zlib' and not info['compressed']
+    # smaller than the base64 of the plain buffer
+    assert len(info['buffer']) < len(data) * 4 // 3
+    assert recorder.sounds == [('a.wav', data)]
+
+
+def test_metrics(make_pipeline):
+    pipe, recorder = make_pipeline()
+    for i in range(3):
+        pipe.source._playSound(make_wav(duration=0.05, freq=440.0 * (i + 1)),
+                               format='wav', filename='%d.wav' % i)
+    assert pipe.wait_played(3, timeout=5.0)
+    res = pipe.sink.getMetrics()
+    for stage in ('transit', 'decode', 'wait', 'start', 'play', 'total'):
+        assert res['stages'][stage]['count'] == 3
+    assert [stats['received'] for stats in res['sources'].values()] == [3]
+    assert [stats['missing'] for stats in res['sources'].values()] == [0]
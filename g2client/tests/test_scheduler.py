@@ -0,0 +1,161 @@
+"""
+Tests of the PlaybackScheduler of g2client.soundsink
+"""
+import time
+import logging
+import threading
+
+import pytest
+
+from g2client import soundsink
+
+logger = logging.getLogger('test_scheduler')
+
+
+def wait_for(pred, timeout=5.0):
+    time_end = time.time() + timeout
+    while time.time() < time_end:
+        if pred():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+class Player(object):
+    """Records the sounds played.  Sounds named 'long' play until they
+    are cancelled.
+    """
+
+    def __init__(self):
+        self.played = []
+        self.cancelled = []
+        self.ev_started = threading.Event()
+
+    def play(self, sound, ev_cancel=None):
+        self.played.append(sound)
+        self.ev_started.set()
+        if sound == 'long':
+            if ev_cancel.wait(5.0):
+                self.cancelled.append(sound)
+
+
+@pytest.fixture
+def player():
+    return Player()
+
+
+def make_scheduler(player, **kwdargs):
+    kwdargs.setdefault('waitval', 0.05)
+    return soundsink.PlaybackScheduler(logger, player.play, **kwdargs)
+
+
+def test_priority_order(player):
+    scheduler = make_scheduler(player)
+    for priority, sound in ((30, 'c'), (10, 'a1'), (20, 'b'), (10, 'a2')):
+        scheduler.ready(scheduler.submit(priority), sound)
+    scheduler.start()
+    try:
+        assert wait_for(lambda: len(player.played) == 4)
+    finally:
+        scheduler.stop()
+    # best priority first, in order of arrival within a priority
+    assert player.played == ['a1', 'a2', 'b', 'c']
+    assert scheduler.get_stats()['played'] == 4
+
+
+def test_waits_for_better_sound_to_decode(player):
+    scheduler = make_scheduler(player)
+    scheduler.start()
+    try:
+        entry = scheduler.submit(10)
+        scheduler.ready(scheduler.submit(20), 'worse')
+        time.sleep(0.2)
+        assert player.played == []
+        scheduler.ready(entry, 'better')
+        assert wait_for(lambda: len(player.played) == 2)
+    finally:
+        scheduler.stop()
+    assert player.played == ['better', 'worse']
+
+
+def test_preemption(player):
+    scheduler = make_scheduler(player, preempt_priority=5)
+    scheduler.start()
+    try:
+        scheduler.ready(scheduler.submit(20), 'long')
+        assert player.ev_started.wait(5.0)
+        scheduler.ready(scheduler.submit(1), 'urgent')
+        assert wait_for(lambda: len(player.played) == 2)
+    finally:
+        scheduler.stop()
+    assert player.played == ['long', 'urgent']
+    assert player.cancelled == ['long']
+    assert scheduler.get_stats()['preempted'] == 1
+
+
+def test_no_preemption_below_threshold(player):
+    scheduler = make_scheduler(player, preempt_priority=5)
+    scheduler.start()
+    try:
+        scheduler.ready(scheduler.submit(20), 'long')
+        assert player.ev_started.wait(5.0)
+        scheduler.ready(scheduler.submit(10), 'better')
+        time.sleep(0.2)
+        assert player.played == ['long']
+    finally:
+        scheduler.stop()
+    assert scheduler.get_stats()['preempted'] == 0
+
+
+def test_expiry(player):
+    scheduler = make_scheduler(player)
+    dropped = []
+    scheduler.start()
+    try:
+        # never becomes ready; dropped once its deadline passes
+        entry = scheduler.submit(10, deadline=time.time() + 0.1)
+        entry.drop_fn = dropped.append
+        scheduler.ready(scheduler.submit(20), 'next')
+        assert wait_for(lambda: len(dropped) == 1)
+        assert wait_for(lambda: len(player.played) == 1)
+    finally:
+        scheduler.stop()
+    assert dropped == [entry]
+    assert player.played == ['next']
+    assert scheduler.get_stats()['expired'] == 1
+
+
+def test_expiry_while_playing(player):
+    scheduler = make_scheduler(player)
+    dropped = []
+    scheduler.start()
+    try:
+        scheduler.ready(scheduler.submit(10), 'long')
+        assert player.ev_started.wait(5.0)
+        entry = scheduler.submit(20, deadline=time.time() + 0.1)
+        entry.drop_fn = dropped.append
+        scheduler.ready(entry, 'late')
+        time.sleep(0.3)
+        scheduler.playing.ev_cancel.set()
+        assert wait_for(lambda: len(dropped) == 1)
+    finally:
+        scheduler.stop()
+    assert player.played == ['long']
+
+
+def test_cancel(player):
+    scheduler = make_scheduler(player)
+    dropped = []
+    entry = scheduler.submit(10)
+    entry.drop_fn = dropped.append
+    scheduler.cancel(entry)
+    scheduler.cancel(entry)
+    scheduler.ready(scheduler.submit(20), 'other')
+    scheduler.start()
+    try:
+        assert wait_for(lambda: len(player.played) == 1)
+    finally:
+        scheduler.stop()
+    # the drop callback is called once only
+    assert dropped == [entry]
+    assert player.played == ['other']
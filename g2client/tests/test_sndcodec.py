@@ -0,0 +1,82 @@
+"""
+Tests of g2client.util.sndcodec
+"""
+import struct
+
+import pytest
+
+from g2client.util import sndcodec
+from g2client.bench.codec_bench import make_wav, make_au
+
+
+def make_au16(nframes=800, channels=2):
+    """Return a 16-bit big endian PCM AU file, with a trailing odd byte."""
+    samples = [(i * 37) % 65536 - 32768 for i in range(nframes * channels)]
+    data = struct.pack('>%dh' % len(samples), *samples)
+    header = struct.pack('>4s5I', b'.snd', 24, len(data), 3, 8000, channels)
+    return header + data + b'\x01'
+
+
+sounds = [
+    ('wav mono', make_wav(duration=0.1)),
+    ('wav stereo noisy', make_wav(duration=0.1, channels=2, noise=0.3)),
+    ('au ulaw', make_au(duration=0.1)),
+    ('au s16be', make_au16()),
+    ('empty wav', make_wav(duration=0.0)),
+    ]
+
+
+@pytest.mark.parametrize('name', sndcodec.get_codec_names())
+@pytest.mark.parametrize('label, data', sounds)
+def test_round_trip(name, label, data):
+    try:
+        buf = sndcodec.encode(name, data, format='wav')
+    except sndcodec.CodecError:
+        # pcmdelta only applies to 16-bit PCM
+        assert name == 'pcmdelta' and label == 'au ulaw'
+        return
+    assert bytes(sndcodec.decode(name, buf)) == data
+
+
+def test_pcmdelta_compresses():
+    codec = sndcodec.codecs.get('pcmdelta', None)
+    if codec is None:
+        pytest.skip("pcmdelta requires numpy")
+    data = make_wav(duration=1.0)
+    assert len(codec.encode(data)) < len(sndcodec.encode('zlib', data))
+
+
+def test_pcmdelta_rejects_bad_data():
+    codec = sndcodec.codecs.get('pcmdelta', None)
+    if codec is None:
+        pytest.skip("pcmdelta requires numpy")
+    with pytest.raises(sndcodec.CodecError):
+        codec.encode(b'not a sound file')
+    buf = codec.encode(make_wav(duration=0.1))
+    with pytest.raises(sndcodec.CodecError):
+        codec.decode(b'XXXX' + buf[4:])
+    with pytest.raises(sndcodec.CodecError):
+        codec.decode(buf[:-10])
+
+
+def test_unknown_codec():
+    with pytest.raises(sndcodec.CodecError):
+        sndcodec.get_codec('no-such-codec')
+
+
+def test_selector_skips_compressed_formats():
+    selector = sndcodec.CodecSelector()
+    assert selector.choose('mp3', 1000, ['zlib', 'none']) == 'none'
+
+
+def test_selector_falls_back_to_none():
+    # a codec that does not apply to a payload is not tried again
+    if 'pcmdelta' not in sndcodec.codecs:
+        pytest.skip("pcmdelta requires numpy")
+    selector = sndcodec.CodecSelector()
+    data = make_au(duration=0.1)
+    name, buf = selector.encode(data, 'au', ['pcmdelta'])
+    assert name == 'none' and buf == data
+    for i in range(3):
+        name, buf = selector.encode(data, 'au', ['pcmdelta', 'zlib'])
+        assert name == 'zlib'
@@ -0,0 +1,81 @@
+"""
+Tests of the SoundCache of g2client.util.soundcache
+"""
+import os
+import logging
+
+from g2client.util import audio, soundcache
+
+logger = logging.getLogger('test_soundcache')
+
+
+def make_sound(i, size=1000):
+    return audio.Sound(bytes([i % 256]) * size, format='au')
+
+
+def test_key():
+    # keys are the same whether the payload is bytes or base64 text
+    assert soundcache.get_key(b'abc') == soundcache.get_key('abc')
+    assert len(soundcache.get_key(b'abc')) == 64
+    assert soundcache.get_key(b'abc') != soundcache.get_key(b'abd')
+
+
+def test_lru():
+    cache = soundcache.SoundCache(logger, max_bytes=3000)
+    for i in range(3):
+        cache.put('key%d' % i, make_sound(i))
+    # using the oldest keeps it from being evicted
+    assert cache.get('key0').data == make_sound(0).data
+    cache.put('key3', make_sound(3))
+    assert cache.get('key1') is None
+    for i in (0, 2, 3):
+        assert cache.get('key%d' % i) is not None
+
+    stats = cache.get_stats()
+    assert stats['evictions'] == 1
+    assert stats['mem_sounds'] == 3 and stats['mem_bytes'] == 3000
+    assert stats['hits'] == 4 and stats['misses'] == 1
+
+
+def test_too_large():
+    cache = soundcache.SoundCache(logger, max_bytes=3000)
+    cache.put('small', make_sound(0))
+    cache.put('large', make_sound(1, size=4000))
+    assert cache.get('large') is None
+    assert cache.get('small') is not None
+
+
+def test_disk(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    key = soundcache.get_key(b'payload')
+    cache = soundcache.SoundCache(logger, cache_dir=cache_dir)
+    cache.put(key, make_sound(1))
+    assert os.listdir(cache_dir) == ['%s.au' % (key)]
+
+    # a new cache finds the sounds left on disk
+    cache = soundcache.SoundCache(logger, cache_dir=cache_dir)
+    sound = cache.get(key)
+    assert sound.format == 'au'
+    assert bytes(sound.data) == make_sound(1).data
+    assert cache.get_stats()['disk_hits'] == 1
+    # and keeps it in memory after that
+    cache.get(key)
+    assert cache.get_stats()['hits'] == 1
+
+
+def test_disk_trim(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cache = soundcache.SoundCache(logger, cache_dir=cache_dir,
+                                  max_disk_bytes=2500)
+    keys = [soundcache.get_key(str(i)) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, make_sound(i))
+    assert sorted(os.listdir(cache_dir)) == sorted(['%s.au' % (key)
+                                                    for key in keys[1:]])
+    assert cache.get_stats()['disk_bytes'] == 2000
+
+    # a file that has gone missing is dropped from the index
+    cache.clear()
+    os.remove(os.path.join(cache_dir, '%s.au' % (keys[1])))
+    assert cache.get(keys[1]) is None
+    assert cache.get_stats()['disk_sounds'] == 1
@@ -0,0 +1,92 @@
+"""
+Tests of the ViewerSupervisor of g2client.util.supervisor
+"""
+import os
+import time
+import signal
+import logging
+import subprocess
+
+import pytest
+
+from g2client.util import supervisor
+
+logger = logging.getLogger('test_supervisor')
+
+
+class Proc(object):
+    """A process in its own process group, as from spawn_fn."""
+
+    def __init__(self, cmdstr):
+        self.proc = subprocess.Popen(cmdstr, shell=True,
+                                     start_new_session=True)
+
+    def getpid(self):
+        return self.proc.pid
+
+    def killpg(self):
+        os.killpg(self.proc.pid, signal.SIGTERM)
+        self.proc.wait()
+
+
+def wait_for(pred, timeout=5.0):
+    time_end = time.time() + timeout
+    while time.time() < time_end:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def sup():
+    sup = supervisor.ViewerSupervisor(logger, Proc, backoff=0.0)
+    yield sup
+    sup.remove_all()
+
+
+def is_zombie(pid):
+    stat = supervisor.read_proc(pid)
+    return stat is not None and stat.state == 'Z'
+
+
+@pytest.mark.parametrize('cmdstr, error', [
+    ('exit 3', "exited with status 3"),
+    ('kill -TERM $$', "exited with status %d" % (-signal.SIGTERM)),
+    ])
+def test_reap_exited(sup, cmdstr, error):
+    sup.add('v', cmdstr)
+    pid = sup.get_status()['v']['pid']
+    assert wait_for(lambda: is_zombie(pid))
+
+    sup.check()
+    status = sup.get_status()['v']
+    assert status['state'] == 'dead' and not status['alive']
+    assert status['last_error'] == error
+    # it was reaped, so it is not left a zombie
+    assert supervisor.read_proc(pid) is None
+
+    # and it is restarted after its (zero) backoff
+    sup.check()
+    status = sup.get_status()['v']
+    assert status['restarts'] == 1
+    assert status['pid'] != pid
+
+
+def test_running(sup):
+    sup.add('v', 'sleep 30')
+
+    def is_running():
+        # it may be briefly in an uninterruptible wait as it starts
+        sup.check(time_delta=1.0)
+        return sup.get_status()['v']['state'] == 'running'
+
+    assert wait_for(is_running)
+    status = sup.get_status()['v']
+    assert status['alive']
+    assert status['restarts'] == 0
+
+    pid = status['pid']
+    sup.remove('v')
+    assert 'v' not in sup.get_status()
+    assert wait_for(lambda: supervisor.read_proc(pid) is None)
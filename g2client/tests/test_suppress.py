@@ -0,0 +1,76 @@
+"""
+Tests of g2client.util.suppress
+"""
+import logging
+
+import pytest
+
+from g2client.util import suppress
+
+logger = logging.getLogger('test_suppress')
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(suppress, 'time', clock)
+    return clock
+
+
+def test_disabled(clock):
+    suppressor = suppress.SoundSuppressor(logger)
+    assert not suppressor.is_enabled()
+    for i in range(10):
+        assert suppressor.check('key', src='src', filename='a.au') is None
+
+
+def test_coalesce_duplicates(clock):
+    suppressor = suppress.SoundSuppressor(logger, window=2.0)
+    assert suppressor.check('key1', src='src') is None
+    clock.now += 1.0
+    assert suppressor.check('key1', src='src') == 'duplicate'
+    # a different sound is not a duplicate
+    assert suppressor.check('key2', src='src') is None
+    clock.now += 1.5
+    # the window runs from when the sound was last played
+    assert suppressor.check('key1', src='src') is None
+    stats = suppressor.get_stats()
+    assert stats['passed'] == 3 and stats['coalesced'] == 1
+
+
+def test_rate_limit(clock):
+    suppressor = suppress.SoundSuppressor(logger, rate=1.0, burst=3)
+    results = [suppressor.check('key%d' % i, src='src', filename='a.au')
+               for i in range(5)]
+    assert results == [None, None, None, 'rate', 'rate']
+    # other sounds have buckets of their own
+    assert suppressor.check('key', src='src', filename='b.au') is None
+    assert suppressor.check('key', src='other', filename='a.au') is None
+    # tokens come back at `rate`
+    clock.now += 1.0
+    assert suppressor.check('key5', src='src', filename='a.au') is None
+    assert suppressor.check('key6', src='src', filename='a.au') == 'rate'
+
+    stats = suppressor.get_stats()
+    assert stats['rate_limited'] == 3
+    assert stats['top'] == [dict(src='src', filename='a.au', count=3)]
+
+
+def test_clean(clock):
+    suppressor = suppress.SoundSuppressor(logger, window=1.0, rate=1.0,
+                                          burst=2)
+    suppressor.check('key', src='src', filename='a.au')
+    clock.now += 120.0
+    suppressor.check('other', src='src', filename='b.au')
+    # what is too old to matter is forgotten
+    assert list(suppressor.recent.keys()) == ['other']
+    assert list(suppressor.buckets.keys()) == [('src', 'b.au')]
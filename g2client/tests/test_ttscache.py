@@ -0,0 +1,125 @@
+"""
+Tests of g2client.util.ttscache
+"""
+import os
+import time
+import logging
+
+from g2client.util import ttscache
+
+logger = logging.getLogger('test_ttscache')
+
+
+def make_cache(cache_dir, **kwdargs):
+    return ttscache.TTSCache(logger, cache_dir=str(cache_dir), **kwdargs)
+
+
+def add(cache, text, size=100):
+    key = ttscache.get_key(text, 'slt', 0)
+    cache.add_data(key, b'x' * size, text, 'slt', 0)
+    return key
+
+
+def test_add_and_lookup(tmp_path):
+    cache = make_cache(tmp_path)
+    key = add(cache, 'hello')
+    path = cache.lookup(key)
+    assert path is not None
+    with open(path, 'rb') as in_f:
+        assert in_f.read() == b'x' * 100
+    assert cache.lookup(ttscache.get_key('other', 'slt', 0)) is None
+    stats = cache.get_stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    # no temp files are left behind
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        [key + '.wav', 'index.json', 'index.lock'])
+
+
+def test_index_is_kept(tmp_path):
+    key = add(make_cache(tmp_path), 'hello')
+    cache = make_cache(tmp_path)
+    assert cache.lookup(key) is not None
+    assert cache.get_stats()['bytes'] == 100
+
+
+def test_missing_file(tmp_path):
+    cache = make_cache(tmp_path)
+    key = add(cache, 'hello')
+    os.remove(cache.get_path(key))
+    assert cache.lookup(key) is None
+    assert cache.get_stats()['phrases'] == 0
+
+
+def test_evict_lru_by_size(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=250)
+    key1 = add(cache, 'one')
+    key2 = add(cache, 'two')
+    # make 'one' the most recently used
+    time.sleep(0.01)
+    assert cache.lookup(key1) is not None
+    key3 = add(cache, 'three')
+    assert cache.lookup(key2) is None
+    assert not os.path.exists(cache.get_path(key2))
+    assert cache.lookup(key1) is not None
+    assert cache.lookup(key3) is not None
+
+
+def test_evict_by_count_and_age(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    keys = [add(cache, text) for text in ('one', 'two', 'three')]
+    assert [cache.lookup(key) is not None for key in keys] == [
+        False, True, True]
+
+    cache = make_cache(tmp_path, max_age=0.05)
+    time.sleep(0.1)
+    key = add(cache, 'four')
+    assert cache.get_stats()['phrases'] == 1
+    assert cache.lookup(key) is not None
+
+
+def test_shared_directory(tmp_path):
+    # two processes (here, two caches) using the same directory keep
+    # what the other adds
+    cache1 = make_cache(tmp_path)
+    cache2 = make_cache(tmp_path)
+    key1 = add(cache1, 'one')
+    key2 = add(cache2, 'two')
+    cache1.flush()
+    cache3 = make_cache(tmp_path)
+    assert cache3.lookup(key1) is not None
+    assert cache3.lookup(key2) is not None
+    assert cache1.get_stats()['phrases'] == 2
+
+
+def test_shared_directory_eviction(tmp_path):
+    # what one cache evicts is not brought back by another
+    cache1 = make_cache(tmp_path, max_entries=1)
+    cache2 = make_cache(tmp_path)
+    key1 = add(cache2, 'one')
+    add(cache1, 'two')
+    cache2.flush()
+    assert make_cache(tmp_path).lookup(key1) is None
+
+
+def test_orphans(tmp_path):
+    stale = os.path.join(str(tmp_path), 'stale.wav')
+    fresh = os.path.join(str(tmp_path), 'fresh.wav')
+    for path in (stale, fresh):
+        with open(path, 'wb') as out_f:
+            out_f.write(b'x')
+    old = time.time() - 120.0
+    os.utime(stale, (old, old))
+    cache = make_cache(tmp_path, orphan_age=60.0)
+    # a file not in the index may still be being written by another
+    # process, unless it is old
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+    assert cache.get_stats()['phrases'] == 0
+
+
+def test_load_phrases(tmp_path):
+    path = os.path.join(str(tmp_path), 'phrases.txt')
+    with open(path, 'w') as out_f:
+        out_f.write("# comment\n\nhello there\nbye\tkal\t-3\n")
+    assert ttscache.load_phrases(path) == [('hello there', None, None),
+                                           ('bye', 'kal', -3)]
@@ -0,0 +1,160 @@
+"""
+Tests of speech synthesis, in g2client.util.ttsproc and the SoundSource,
+with a stand-in for flite
+"""
+import os
+import time
+import logging
+
+import pytest
+
+from g2client import soundsink
+from g2client.util import audio, ttsproc
+from g2client.bench import standins
+from g2client.bench.codec_bench import make_wav
+
+logger = logging.getLogger('test_ttsproc')
+
+
+@pytest.fixture
+def flite(tmp_path, monkeypatch):
+    """A stand-in for flite, on our PATH, writing each of its arguments
+    on a line of 'args' and 'speech.wav' to its stdout.  It fails if the
+    file 'fail' exists, and takes the seconds in 'delay' if that does.
+    """
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    speech = str(tmp_path / 'speech.wav')
+    with open(speech, 'wb') as out_f:
+        out_f.write(make_wav(duration=0.1, rate=8000))
+    args = str(tmp_path / 'args')
+    fail = str(tmp_path / 'fail')
+    delay = str(tmp_path / 'delay')
+    path = str(bindir / 'flite')
+    with open(path, 'w') as out_f:
+        out_f.write('#!/bin/sh\n'
+                    'printf "%%s\\n" "$@" >> %s\n'
+                    'if [ -e %s ]; then echo "no such voice" >&2; exit 2; fi\n'
+                    'if [ -e %s ]; then sleep `cat %s`; fi\n'
+                    'exec cat %s\n' % (args, fail, delay, delay, speech))
+    os.chmod(path, 0o755)
+    monkeypatch.setenv('PATH', '%s:%s' % (str(bindir), os.environ['PATH']))
+    return tmp_path
+
+
+def read_lines(path):
+    with open(str(path), 'r') as in_f:
+        return in_f.read().splitlines()
+
+
+def test_synthesize(flite):
+    # the text is passed as it is, not through a shell
+    text = "it's $(HOME) `date`; ok"
+    data = ttsproc.synthesize(text, voice='kal')
+    with open(str(flite / 'speech.wav'), 'rb') as in_f:
+        assert data == in_f.read()
+    assert read_lines(flite / 'args') == ['-t', text, '-voice', 'kal',
+                                          '-o', '/dev/stdout']
+
+
+def test_synthesize_fails(flite):
+    (flite / 'fail').write_bytes(b'')
+    with pytest.raises(ttsproc.TTSError, match='no such voice'):
+        ttsproc.synthesize('hello')
+    with pytest.raises(ttsproc.TTSError):
+        ttsproc.synthesize('hello', flitecmd=str(flite / 'nonesuch'))
+
+
+def test_process():
+    data = make_wav(duration=0.1, rate=8000)
+    assert ttsproc.process(data) is data
+
+    pytest.importorskip('numpy')
+    res = ttsproc.process(data, volume=-6, rate=16000)
+    spec, offset, length = audio.parse_pcm(res)
+    assert spec == audio.PCMSpec('s16le', 16000, 1, 2)
+    assert length == 2 * 1600
+
+    sound_in = audio.Sound(data, format='wav')
+    sound_out = audio.Sound(res, format='wav')
+    peak_in = max(abs(val) for val in
+                  memoryview(sound_in.get_pcm()[1]).cast('h'))
+    peak_out = max(abs(val) for val in
+                   memoryview(sound_out.get_pcm()[1]).cast('h'))
+    assert peak_out == pytest.approx(peak_in * 10 ** (-6 / 20.0), rel=0.01)
+
+    with pytest.raises(ttsproc.TTSError):
+        ttsproc.process(b'ID3' + b'\x00' * 100, volume=-6)
+
+
+@pytest.fixture
+def source(tmp_path):
+    monitor = standins.LocalMonitor('test.mon', logger)
+    source = soundsink.SoundSource(monitor=monitor, logger=logger,
+                                   channels=['sound'],
+                                   tts_cache_dir=str(tmp_path / 'tts'))
+    yield source
+    source.stop()
+
+
+def test_source_synthesize(flite, source):
+    source._start_tts()
+    data = source._synthesize('hello', 'slt', 0)
+    key = source._get_tts_key('hello', 'slt', 0)
+    with open(source.tts_cache.lookup(key), 'rb') as in_f:
+        assert in_f.read() == data
+
+    # errors are logged, and come back as None
+    (flite / 'fail').write_bytes(b'')
+    assert source._synthesize('goodbye', 'slt', 0) is None
+
+
+def test_source_synthesize_uncached(flite, source, monkeypatch):
+    source._start_tts()
+
+    def add_data(*args):
+        raise OSError("disk full")
+
+    # speech that cannot be cached is still played
+    monkeypatch.setattr(source.tts_cache, 'add_data', add_data)
+    assert source._synthesize('hello', 'slt', 0) is not None
+
+
+def test_single_flight(flite, source):
+    (flite / 'delay').write_text('0.3')
+    futures = [source._submit_tts('hello', 'slt', 0) for i in range(5)]
+    # the same speech asked for again while it is being made shares
+    # the request
+    assert all([future is futures[0] for future in futures])
+    data, filename = futures[0].result()
+    assert read_lines(flite / 'args').count('hello') == 1
+
+    stats = source.getTTSStats()
+    assert stats['submitted'] == 1 and stats['deduplicated'] == 4
+    assert stats['synthesized'] == 1
+    assert stats['queued'] == 0 and stats['running'] == 0
+    # and once made, it comes from the cache
+    assert source._getText('hello', 'slt', 0) == (data, filename)
+    assert stats['synthesized'] == source.getTTSStats()['synthesized']
+
+
+def test_parallel(flite, source):
+    (flite / 'delay').write_text('0.3')
+    time_start = time.time()
+    futures = [source._submit_tts('phrase %d' % i, 'slt', 0)
+               for i in range(4)]
+    assert all([future.result() is not None for future in futures])
+    # made by the workers at the same time
+    assert time.time() - time_start < 1.0
+    assert source.getTTSStats()['synthesized'] == 4
+
+
+def test_failed(flite, source):
+    (flite / 'fail').write_bytes(b'')
+    assert source._getText('hello', 'slt', 0) is None
+    assert source.getTTSStats()['failed'] == 1
+    # the failure is not shared with later requests
+    time_end = time.time() + 5.0
+    while len(source.tts_inflight) > 0 and time.time() < time_end:
+        time.sleep(0.005)
+    assert source.tts_inflight == {}
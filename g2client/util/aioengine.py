@@ -0,0 +1,93 @@
+#
+# Asyncio engine for the Gen2 sound sink.
+#
+"""
+Asyncio engine for the Gen2 sound sink.
+
+An `AsyncEngine` runs an asyncio event loop in its own thread.  Work for
+a sound is submitted to it as a coroutine, so a sound that is waiting
+(on a fetch from its source, say) costs a suspended coroutine rather
+than a thread.  Blocking steps such as decoding are run in a small pool
+of worker threads of the engine's own, and never in the monitor's
+thread pool, which is left free for callbacks and remote calls.
+"""
+import asyncio
+import functools
+import threading
+import concurrent.futures
+
+
+class AsyncEngine(object):
+
+    def __init__(self, logger, name='engine', workers=4):
+        self.logger = logger
+        self.name = name
+        self.workers = workers
+        # NOTE: work may be submitted before we are started; it will run
+        # once the loop does
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix=self.name)
+        self.thread = None
+
+        self.lock = threading.Lock()
+        self.num_submitted = 0
+        self.num_pending = 0
+        self.max_pending = 0
+        self.num_errors = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.thread = None
+        self.executor.shutdown(wait=False)
+
+    def submit(self, coro_fn, *args, **kwdargs):
+        """Run coroutine function `coro_fn` with the given arguments on
+        the engine.  May be called from any thread.  Returns a
+        concurrent.futures.Future for the result.
+        """
+        with self.lock:
+            self.num_submitted += 1
+            self.num_pending += 1
+            self.max_pending = max(self.max_pending, self.num_pending)
+        return asyncio.run_coroutine_threadsafe(
+            self._wrap(coro_fn(*args, **kwdargs)), self.loop)
+
+    async def _wrap(self, coro):
+        try:
+            return await coro
+
+        except Exception as e:
+            with self.lock:
+                self.num_errors += 1
+            self.logger.error("Error in %s task: %s" % (self.name, str(e)),
+                              exc_info=True)
+        finally:
+            with self.lock:
+                self.num_pending -= 1
+
+    def run_blocking(self, fn, *args, **kwdargs):
+        """Return an awaitable that runs `fn` in one of our worker
+        threads.  Call only from the engine's own coroutines.
+        """
+        return self.loop.run_in_executor(
+            self.executor, functools.partial(fn, *args, **kwdargs))
+
+    def get_stats(self):
+        with self.lock:
+            return dict(submitted=self.num_submitted,
+                        pending=self.num_pending,
+                        max_pending=self.max_pending,
+                        errors=self.num_errors, workers=self.workers)
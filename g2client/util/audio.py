@@ -0,0 +1,734 @@
+#
+# Audio output backends for the Gen2 sound sink.
+#
+"""
+Audio output backends for the Gen2 sound sink.
+
+A backend takes a `Sound` (the contents of a sound file held in memory)
+and plays it on the local audio device.  The `pacat` backend keeps
+resident PulseAudio playback streams open and feeds them decoded PCM
+frames over a pipe, so that playing a sound does not cost a process
+launch and server handshake.  The `paplay` backend launches one player
+per sound, as the sink has always done, and is used as the fallback for
+anything the streaming backend cannot handle.
+"""
+import os
+import struct
+import time
+import threading
+import subprocess
+from collections import namedtuple
+
+from g2base import Bunch
+
+
+class AudioError(Exception):
+    pass
+
+
+# Sample format description, using PulseAudio sample format names
+PCMSpec = namedtuple('PCMSpec', ['format', 'rate', 'channels', 'width'])
+
+# AU encoding number -> (sample format, sample width)
+au_encodings = {
+    1: ('ulaw', 1),
+    3: ('s16be', 2),
+    4: ('s24be', 3),
+    5: ('s32be', 4),
+    6: ('float32be', 4),
+    27: ('alaw', 1),
+    }
+
+# WAV (format tag, bits per sample) -> sample format
+wav_encodings = {
+    (1, 8): 'u8',
+    (1, 16): 's16le',
+    (1, 24): 's24le',
+    (1, 32): 's32le',
+    (3, 32): 'float32le',
+    (6, 8): 'alaw',
+    (7, 8): 'ulaw',
+    }
+
+
+def _parse_au(mv, total):
+    if len(mv) < 24:
+        raise AudioError("truncated AU header")
+    (offset, length, encoding, rate,
+     channels) = struct.unpack('>5I', mv[4:24])
+    if encoding not in au_encodings:
+        raise AudioError("unsupported AU encoding (%d)" % (encoding))
+    fmt, width = au_encodings[encoding]
+    avail = total - offset
+    if length == 0xffffffff or length > avail:
+        length = avail
+    return PCMSpec(fmt, rate, channels, width), offset, length
+
+
+def _parse_wav(mv, total):
+    spec = None
+    pos = 12
+    while pos + 8 <= len(mv):
+        chunk_id = bytes(mv[pos:pos + 4])
+        chunk_len = struct.unpack('<I', mv[pos + 4:pos + 8])[0]
+        pos += 8
+        if chunk_id == b'fmt ':
+            if chunk_len < 16:
+                raise AudioError("malformed WAV fmt chunk")
+            (tag, channels, rate, _bps, _align,
+             bits) = struct.unpack('<HHIIHH', mv[pos:pos + 16])
+            if tag == 0xFFFE and chunk_len >= 26:
+                # WAVE_FORMAT_EXTENSIBLE: real tag starts the subformat GUID
+                tag = struct.unpack('<H', mv[pos + 24:pos + 26])[0]
+            fmt = wav_encodings.get((tag, bits), None)
+            if fmt is None:
+                raise AudioError("unsupported WAV encoding (tag=%d bits=%d)" % (
+                    tag, bits))
+            spec = PCMSpec(fmt, rate, channels, bits // 8)
+
+        elif chunk_id == b'data':
+            if spec is None:
+                raise AudioError("WAV data chunk precedes fmt chunk")
+            length = min(chunk_len, total - pos)
+            return spec, pos, length
+
+        # chunks are padded to an even length
+        pos += chunk_len + (chunk_len & 1)
+
+    raise AudioError("no data chunk found in WAV file")
+
+
+def parse_pcm(data, total=None):
+    """Locate the PCM samples in the sound file contents `data`.
+
+    Returns a tuple of (spec, offset, length) where `spec` is a `PCMSpec`
+    and `offset` and `length` give the extent of the sample data.
+    Raises `AudioError` if the data is not an AU or WAV file in a sample
+    format we can stream.  If `data` is only the start of a file, `total`
+    gives the size of the whole file.
+    """
+    mv = memoryview(data)
+    if total is None:
+        total = len(mv)
+    magic = bytes(mv[:4])
+    if magic == b'.snd':
+        return _parse_au(mv, total)
+    if magic == b'RIFF' and bytes(mv[8:12]) == b'WAVE':
+        return _parse_wav(mv, total)
+    raise AudioError("not an AU or WAV file")
+
+
+# Byte value of a silent sample, for formats where it is not zero
+silence = {
+    'ulaw': b'\xff',
+    'alaw': b'\xd5',
+    'u8': b'\x80',
+    }
+
+
+class Sound(object):
+    """The contents of a sound file held in memory, ready to play."""
+
+    streaming = False
+
+    def __init__(self, data, format='au', filename=None):
+        self.data = data
+        self.format = format
+        self.filename = filename
+        self._pcm = None
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def with_filename(self, filename):
+        """Return a Sound sharing our data, but with a different filename."""
+        sound = Sound(self.data, format=self.format, filename=filename)
+        sound._pcm = self._pcm
+        return sound
+
+    def get_pcm(self):
+        """Return a tuple of (spec, frames) for this sound, where `frames`
+        is a memoryview of the raw sample data, or None if the sound is
+        not in a format that can be streamed as PCM.
+        """
+        if self._pcm is None:
+            try:
+                spec, offset, length = parse_pcm(self.data)
+                length -= length % (spec.width * spec.channels)
+                frames = memoryview(self.data)[offset:offset + length]
+                self._pcm = (spec, frames)
+            except AudioError:
+                self._pcm = False
+        if self._pcm is False:
+            return None
+        return self._pcm
+
+    def is_pcm(self):
+        return self.get_pcm() is not None
+
+    def get_pcm_stream(self):
+        """Return a tuple of (spec, pieces), where `pieces` iterates over
+        the sample data in whole frames.
+        """
+        pcm = self.get_pcm()
+        if pcm is None:
+            raise AudioError("sound is not in a streamable format")
+        spec, frames = pcm
+        return spec, iter([frames])
+
+    def iter_data(self, chunk_size=16384):
+        """Iterate over the contents of the sound file in pieces."""
+        mv = memoryview(self.data)
+        for offset in range(0, len(mv), chunk_size):
+            yield mv[offset:offset + chunk_size]
+
+    def get_duration(self):
+        """Return the playing time of the sound in seconds, or None if
+        it cannot be determined.
+        """
+        pcm = self.get_pcm()
+        if pcm is None:
+            return None
+        spec, frames = pcm
+        return len(frames) / float(spec.width * spec.channels * spec.rate)
+
+
+class SoundSequence(object):
+    """Several sounds to be played one after another, as a group."""
+
+    streaming = False
+
+    def __init__(self, sounds):
+        self.sounds = sounds
+        self.format = 'sequence'
+        self.filename = '+'.join([str(sound.filename) for sound in sounds])
+
+    @property
+    def size(self):
+        return sum([sound.size for sound in self.sounds])
+
+    def get_pcm(self):
+        return None
+
+    def is_pcm(self):
+        return False
+
+    def get_duration(self):
+        durations = [sound.get_duration() for sound in self.sounds]
+        if None in durations:
+            return None
+        return sum(durations)
+
+
+class StreamingSound(object):
+    """A sound file that is still arriving in sequenced chunks.
+
+    Chunks are added with add_chunk() as they arrive, in any order, and
+    are consumed in sequence by whoever plays the sound.  If the next
+    chunk has not arrived within `timeout` seconds it is presumed lost
+    and replaced by silence of the same length; a chunk that turns up
+    after its place has been passed is discarded as late.
+    """
+
+    streaming = True
+
+    def __init__(self, nchunks, chunk_size, total, format='au',
+                 filename=None, timeout=1.0):
+        self.nchunks = nchunks
+        self.chunk_size = chunk_size
+        self.size = total
+        self.format = format
+        self.filename = filename
+        self.timeout = timeout
+
+        self.cond = threading.Condition()
+        # seq -> chunk data, for chunks not yet consumed
+        self.chunks = {}
+        self.next_seq = 0
+        self.num_received = 0
+        self.bytes_received = 0
+        self.num_lost = 0
+        self.num_late = 0
+        self.aborted = False
+        self.fill = b'\x00'
+
+    def add_chunk(self, seq, data):
+        """Add chunk number `seq`.  Returns False if it is late, a
+        duplicate or out of range.
+        """
+        with self.cond:
+            if (seq < self.next_seq or seq >= self.nchunks or
+                seq in self.chunks):
+                self.num_late += 1
+                return False
+            self.chunks[seq] = data
+            self.num_received += 1
+            self.bytes_received += len(data)
+            self.cond.notify_all()
+            return True
+
+    def is_complete(self):
+        with self.cond:
+            return self.num_received + self.num_lost >= self.nchunks
+
+    def abort(self):
+        with self.cond:
+            self.aborted = True
+            self.cond.notify_all()
+
+    def is_pcm(self):
+        return self.format in ('au', 'snd', 'wav')
+
+    def iter_data(self, chunk_size=None):
+        """Iterate over the contents of the sound file, chunk by chunk,
+        blocking as needed for chunks to arrive.
+        """
+        while True:
+            with self.cond:
+                seq = self.next_seq
+                if seq >= self.nchunks:
+                    return
+                time_limit = time.time() + self.timeout
+                while seq not in self.chunks and not self.aborted:
+                    time_delta = time_limit - time.time()
+                    if time_delta <= 0:
+                        break
+                    self.cond.wait(time_delta)
+                if self.aborted:
+                    raise AudioError("stream aborted")
+                data = self.chunks.pop(seq, None)
+                self.next_seq += 1
+                if data is None:
+                    self.num_lost += 1
+
+            if data is None:
+                if seq == 0:
+                    raise AudioError("first chunk of stream was lost")
+                length = min(self.chunk_size, self.size - seq * self.chunk_size)
+                data = self.fill * length
+            yield data
+
+    def get_pcm_stream(self):
+        chunks = self.iter_data()
+        head = b''
+        for data in chunks:
+            head += bytes(data)
+            try:
+                spec, offset, length = parse_pcm(head, total=self.size)
+                break
+
+            except AudioError:
+                # not enough of the header yet?
+                if len(head) > 65536:
+                    raise
+        else:
+            raise AudioError("stream ended before its header")
+
+        self.fill = silence.get(spec.format, b'\x00')
+        frame_size = spec.width * spec.channels
+        length -= length % frame_size
+
+        def pieces(buf, remaining):
+            for data in chunks:
+                buf += bytes(data)
+                nbytes = min(len(buf) - len(buf) % frame_size, remaining)
+                if nbytes > 0:
+                    yield buf[:nbytes]
+                    buf = buf[nbytes:]
+                    remaining -= nbytes
+                if remaining <= 0:
+                    return
+
+        first = head[offset:offset + length]
+        first = first[:len(first) - len(first) % frame_size]
+        rest = head[offset + len(first):offset + length]
+
+        def all_pieces():
+            if len(first) > 0:
+                yield first
+            for piece in pieces(rest, length - len(first)):
+                yield piece
+
+        return spec, all_pieces()
+
+    def get_duration(self):
+        return None
+
+
+class AudioBackend(object):
+    """Base class for audio output backends."""
+
+    name = None
+
+    def __init__(self, logger, **kwdargs):
+        self.logger = logger
+        self.lock = threading.RLock()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def can_play(self, sound):
+        return True
+
+    def play(self, sound, ev_cancel=None):
+        """Play `sound`, returning when it has finished playing.
+
+        If the threading.Event `ev_cancel` is set while the sound is
+        playing, playback is cut off as soon as possible.  Returns a
+        Bunch with the time-to-first-sample (`ttfs`) and total elapsed
+        time (`elapsed`) in seconds, and whether the sound was cancelled.
+        """
+        raise NotImplementedError("subclass should override this method")
+
+
+class PaplayBackend(AudioBackend):
+    """Play each sound by running a player command on it.
+
+    The sound is handed to the player straight from memory, with no
+    temp file: where the platform supports it the data is placed in an
+    anonymous memory file (memfd) that the player opens by its
+    /proc/self/fd path, which keeps it seekable for any format;
+    otherwise it is streamed to the player on stdin.
+    """
+
+    name = 'paplay'
+
+    def __init__(self, logger, playcmd='paplay', use_memfd=None,
+                 **kwdargs):
+        super(PaplayBackend, self).__init__(logger, **kwdargs)
+        self.playcmd = playcmd
+        if use_memfd is None:
+            use_memfd = (hasattr(os, 'memfd_create') and
+                         os.path.isdir('/proc/self/fd'))
+        self.use_memfd = use_memfd
+        self.chunk_size = 16384
+
+    def _start_memfd(self, sound):
+        fd = os.memfd_create('g2snd', 0)
+        try:
+            mv = memoryview(sound.data)
+            while len(mv) > 0:
+                mv = mv[os.write(fd, mv):]
+            os.lseek(fd, 0, os.SEEK_SET)
+
+            cmd = self.playcmd.split() + ['/proc/self/fd/%d' % fd]
+            self.logger.debug("Play command is: %s" % ' '.join(cmd))
+            return subprocess.Popen(cmd, pass_fds=(fd,))
+
+        finally:
+            # child has its own copy of the descriptor
+            os.close(fd)
+
+    def _start_pipe(self, sound):
+        cmd = self.playcmd.split()
+        self.logger.debug("Play command is: %s < [%s bytes]" % (
+            ' '.join(cmd), sound.size))
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def play(self, sound, ev_cancel=None):
+        time_start = time.time()
+
+        try:
+            if self.use_memfd and not sound.streaming:
+                proc = self._start_memfd(sound)
+            else:
+                proc = self._start_pipe(sound)
+        except OSError as e:
+            raise AudioError("cannot run '%s': %s" % (self.playcmd, str(e)))
+        # the best we can say is when the player was started
+        ttfs = time.time() - time_start
+
+        cancelled = False
+        if proc.stdin is not None:
+            try:
+                try:
+                    for data in sound.iter_data(self.chunk_size):
+                        if ev_cancel is not None and ev_cancel.is_set():
+                            break
+                        proc.stdin.write(data)
+                finally:
+                    proc.stdin.close()
+
+            except (IOError, OSError) as e:
+                # player exited early
+                self.logger.debug("player closed its input: %s" % str(e))
+
+            except AudioError:
+                proc.terminate()
+                proc.wait()
+                raise
+
+        if ev_cancel is not None:
+            while proc.poll() is None:
+                if ev_cancel.wait(0.02):
+                    proc.terminate()
+                    cancelled = True
+                    break
+        proc.wait()
+
+        return Bunch.Bunch(ttfs=ttfs, elapsed=time.time() - time_start,
+                           cancelled=cancelled)
+
+
+class _PulseStream(object):
+    """A resident `pacat` process accepting raw frames of one PCMSpec."""
+
+    def __init__(self, spec, cmd):
+        self.spec = spec
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                     stdout=subprocess.DEVNULL)
+        self.time_used = time.time()
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.proc.terminate()
+            self.proc.wait(timeout=1.0)
+        except Exception:
+            self.proc.kill()
+
+
+class PulseStreamBackend(AudioBackend):
+    """Play sounds through resident `pacat` playback streams.
+
+    One stream is kept open for each sample format in use (plus extra
+    ones when sounds of the same format play concurrently), and decoded
+    frames are written to it over a pipe.  Writing is paced to real time
+    so that only `lead_ms` of audio is ever queued ahead, which keeps
+    cancellation prompt.
+    """
+
+    name = 'pacat'
+
+    def __init__(self, logger, playcmd='pacat', latency_ms=50,
+                 chunk_ms=20, lead_ms=60, max_idle=4, device=None,
+                 **kwdargs):
+        super(PulseStreamBackend, self).__init__(logger, **kwdargs)
+        self.playcmd = playcmd
+        self.latency_ms = latency_ms
+        self.chunk_ms = chunk_ms
+        self.lead_ms = lead_ms
+        self.max_idle = max_idle
+        self.device = device
+        # idle streams, most recently used last
+        self.idle = []
+
+    def _get_cmd(self, spec):
+        cmd = self.playcmd.split() + [
+            '--playback', '--raw', '--client-name=g2soundsink',
+            '--format=%s' % spec.format, '--rate=%d' % spec.rate,
+            '--channels=%d' % spec.channels,
+            '--latency-msec=%d' % self.latency_ms]
+        if self.device is not None:
+            cmd.append('--device=%s' % self.device)
+        return cmd
+
+    def _acquire(self, spec):
+        with self.lock:
+            for stream in reversed(self.idle):
+                if stream.spec == spec:
+                    self.idle.remove(stream)
+                    if stream.is_alive():
+                        return stream
+                    stream.close()
+                    break
+        self.logger.debug("opening playback stream for %s" % str(spec))
+        try:
+            return _PulseStream(spec, self._get_cmd(spec))
+        except OSError as e:
+            raise AudioError("cannot run '%s': %s" % (self.playcmd, str(e)))
+
+    def _release(self, stream):
+        stream.time_used = time.time()
+        with self.lock:
+            self.idle.append(stream)
+            while len(self.idle) > self.max_idle:
+                self.idle.pop(0).close()
+
+    def can_play(self, sound):
+        return sound.is_pcm()
+
+    def play(self, sound, ev_cancel=None):
+        time_start = time.time()
+        spec, pieces = sound.get_pcm_stream()
+        frame_size = spec.width * spec.channels
+        bytes_per_sec = float(frame_size * spec.rate)
+        chunk_size = max(frame_size,
+                         int(spec.rate * self.chunk_ms / 1000.0) * frame_size)
+        lead = self.lead_ms / 1000.0
+
+        stream = self._acquire(spec)
+        ttfs = None
+        time_first = time_start
+        written = 0
+        cancelled = False
+        try:
+            for frames in pieces:
+                for offset in range(0, len(frames), chunk_size):
+                    if ev_cancel is not None and ev_cancel.is_set():
+                        cancelled = True
+                        break
+                    if ttfs is not None:
+                        # pace ourselves so we are never more than `lead`
+                        # seconds ahead of the audio actually being played
+                        time_due = time_first + written / bytes_per_sec - lead
+                        time_delta = time_due - time.time()
+                        if time_delta > 0:
+                            if ev_cancel is not None:
+                                if ev_cancel.wait(time_delta):
+                                    cancelled = True
+                                    break
+                            else:
+                                time.sleep(time_delta)
+
+                    data = frames[offset:offset + chunk_size]
+                    stream.write(data)
+                    written += len(data)
+                    if ttfs is None:
+                        time_first = time.time()
+                        ttfs = time_first - time_start
+                if cancelled:
+                    break
+
+            # a stream starts to play only once it has a latency's worth
+            # of audio queued, and is back to waiting for that after
+            # running dry between sounds; pad short sounds with silence
+            # so that they are not held up until the next one comes
+            prebuf = int(spec.rate * self.latency_ms / 1000.0) * frame_size
+            if not cancelled and written < prebuf:
+                stream.write(silence.get(spec.format, b'\x00') *
+                             (prebuf - written))
+                written = prebuf
+
+        except (IOError, OSError) as e:
+            stream.close()
+            raise AudioError("playback stream failed: %s" % str(e))
+
+        except AudioError:
+            # source of the sound failed; what was written is whole frames
+            self._release(stream)
+            raise
+
+        if not cancelled:
+            # wait for the stream to drain what we queued
+            time_end = (time_first + written / bytes_per_sec +
+                        self.latency_ms / 1000.0)
+            time_delta = time_end - time.time()
+            if time_delta > 0:
+                if ev_cancel is not None:
+                    cancelled = ev_cancel.wait(time_delta)
+                else:
+                    time.sleep(time_delta)
+
+        if cancelled:
+            # whatever is queued in the stream would still play, so
+            # don't reuse it
+            stream.close()
+        else:
+            self._release(stream)
+
+        return Bunch.Bunch(ttfs=ttfs if ttfs is not None else 0.0,
+                           elapsed=time.time() - time_start,
+                           cancelled=cancelled)
+
+    def stop(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for stream in idle:
+            stream.close()
+
+
+class NullBackend(AudioBackend):
+    """Discard sounds instead of playing them, for testing and
+    benchmarking without a sound device.
+
+    With `realtime`, "playing" a sound takes as long as it really would.
+    With `capture`, a record of each sound played is kept in `played`.
+    """
+
+    name = 'null'
+
+    def __init__(self, logger, realtime=False, capture=False, **kwdargs):
+        super(NullBackend, self).__init__(logger, **kwdargs)
+        self.realtime = realtime
+        self.capture = capture
+        self.played = []
+
+    def play(self, sound, ev_cancel=None):
+        time_start = time.time()
+        if sound.streaming:
+            # drain the stream, as a player would
+            for data in sound.iter_data():
+                pass
+        time_first = time.time()
+
+        cancelled = False
+        if self.realtime:
+            duration = None
+            if sound.is_pcm() and not sound.streaming:
+                duration = sound.get_duration()
+            if duration is not None:
+                if ev_cancel is None:
+                    ev_cancel = threading.Event()
+                cancelled = ev_cancel.wait(duration)
+
+        if self.capture:
+            with self.lock:
+                self.played.append(Bunch.Bunch(filename=sound.filename,
+                                               format=sound.format,
+                                               size=sound.size,
+                                               time_start=time_start,
+                                               time_end=time.time(),
+                                               cancelled=cancelled))
+        return Bunch.Bunch(ttfs=time_first - time_start,
+                           elapsed=time.time() - time_start,
+                           cancelled=cancelled)
+
+
+class CaptureBackend(NullBackend):
+    """A NullBackend that records the sounds it plays."""
+
+    name = 'capture'
+
+    def __init__(self, logger, **kwdargs):
+        kwdargs['capture'] = True
+        super(CaptureBackend, self).__init__(logger, **kwdargs)
+
+    def get_played(self):
+        with self.lock:
+            return list(self.played)
+
+
+backends = {
+    'paplay': PaplayBackend,
+    'pacat': PulseStreamBackend,
+    'null': NullBackend,
+    'capture': CaptureBackend,
+    }
+
+
+def get_backend_names():
+    return list(backends.keys())
+
+
+def make_backend(name, logger, **kwdargs):
+    """Create an audio backend by `name`."""
+    try:
+        klass = backends[name]
+    except KeyError:
+        raise AudioError("no audio backend named '%s'" % (name))
+    return klass(logger, **kwdargs)
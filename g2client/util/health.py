@@ -0,0 +1,222 @@
+#
+# Probing of the health of the links to a Gen2 system.
+#
+"""
+Probing of the health of the links to a Gen2 system.
+
+A `HealthProbe` times a call to each of a set of targets every so often
+(for g2disp, a remote objects echo to the name server on each of the
+Gen2 hosts, and to the system's monitor hub) and keeps a rolling window
+of the round trip times, from which it reports percentiles, the fraction
+of probes that failed or timed out, and a status of 'ok', 'warn' or
+'bad' by comparing the 90th percentile and that loss with thresholds.
+
+Each target is a function taking no arguments that makes the call; it
+is run in a thread pool, so that a host that does not answer only holds
+up its own probes, which are counted as lost after `timeout` seconds.
+"""
+import time
+import threading
+import concurrent.futures
+from collections import deque
+
+# Default thresholds of 90th percentile round trip time (sec)
+default_warn_rtt = 0.050
+default_bad_rtt = 0.200
+# and of the fraction of probes lost
+default_warn_loss = 0.05
+default_bad_loss = 0.25
+
+status_levels = ['ok', 'warn', 'bad']
+
+
+def percentile(values, pct):
+    """Return the `pct` percentile of `values` (nearest rank), or None
+    if there are none.
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class _Target(object):
+    """A target of our probes, and its history."""
+
+    def __init__(self, name, kind, host, probe_fn, window):
+        self.name = name
+        self.kind = kind
+        self.host = host
+        self.probe_fn = probe_fn
+        # list of (time, rtt in sec, or None if lost)
+        self.history = deque([], window)
+        self.future = None
+        self.time_probe = None
+        # True if the probe in flight has been counted as lost
+        self.lost = False
+        self.last_error = None
+
+
+class HealthProbe(object):
+
+    def __init__(self, logger, interval=5.0, timeout=2.0, window=120,
+                 warn_rtt=default_warn_rtt, bad_rtt=default_bad_rtt,
+                 warn_loss=default_warn_loss, bad_loss=default_bad_loss):
+        self.logger = logger
+        self.interval = interval
+        self.timeout = timeout
+        self.window = window
+        self.warn_rtt = warn_rtt
+        self.bad_rtt = bad_rtt
+        self.warn_loss = warn_loss
+        self.bad_loss = bad_loss
+
+        self.lock = threading.RLock()
+        # name -> _Target
+        self.targets = {}
+        self.pool = None
+        self.ev_quit = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=8, thread_name_prefix='g2disp-health')
+        self.ev_quit.clear()
+        self.thread = threading.Thread(target=self.probe_loop,
+                                       name='g2disp-health')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.ev_quit.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.pool is not None:
+            # don't wait on calls to hosts that are not answering
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def set_targets(self, targets):
+        """Probe `targets`, a list of (name, kind, host, probe_fn),
+        instead of those we had.  The history of targets of the same name
+        and host is kept.
+        """
+        with self.lock:
+            old = self.targets
+            self.targets = {}
+            for name, kind, host, probe_fn in targets:
+                target = _Target(name, kind, host, probe_fn, self.window)
+                if name in old and old[name].host == host:
+                    target.history = old[name].history
+                self.targets[name] = target
+
+    def _probe_one(self, target):
+        time_start = time.time()
+        target.probe_fn()
+        return time.time() - time_start
+
+    def _collect(self, target, now):
+        # Record the result of the last probe of `target`, if it is in
+        future = target.future
+        if future is None:
+            return
+        if not future.done():
+            if not target.lost and now - target.time_probe >= self.timeout:
+                target.last_error = "timed out"
+                target.history.append((target.time_probe, None))
+                target.lost = True
+            return
+        if not target.lost:
+            try:
+                rtt = future.result()
+                target.history.append((target.time_probe, rtt))
+                target.last_error = None
+
+            except Exception as e:
+                target.last_error = str(e)
+                target.history.append((target.time_probe, None))
+        target.future = None
+
+    def check(self):
+        """Collect the probes that have finished or timed out, and send
+        new ones for the targets that are due.
+        """
+        now = time.time()
+        with self.lock:
+            for target in self.targets.values():
+                self._collect(target, now)
+                if (target.time_probe is not None and
+                    now - target.time_probe < self.interval):
+                    continue
+                if target.future is not None:
+                    # NOTE: we don't pile up calls to a host that is not
+                    # answering; each probe we would have sent is lost
+                    target.last_error = "timed out"
+                    target.history.append((now, None))
+                    target.time_probe = now
+                    target.lost = True
+                    continue
+                target.time_probe = now
+                target.lost = False
+                try:
+                    target.future = self.pool.submit(self._probe_one, target)
+
+                except RuntimeError:
+                    # pool has been shut down
+                    return
+
+    def probe_loop(self):
+        # check often enough to notice timeouts promptly
+        period = min(self.interval, self.timeout) / 4.0
+        while not self.ev_quit.wait(period):
+            try:
+                self.check()
+
+            except Exception as e:
+                self.logger.error("error probing link health: %s" % (
+                    str(e)), exc_info=True)
+
+    def _get_status(self, rtt, loss):
+        if rtt is None or loss >= self.bad_loss or rtt >= self.bad_rtt:
+            return 'bad'
+        if loss >= self.warn_loss or rtt >= self.warn_rtt:
+            return 'warn'
+        return 'ok'
+
+    def get_health(self, history=60):
+        """Return a dict of the overall status, and the round trip time
+        percentiles, loss and status of each target, by name, along with
+        the last `history` round trip times (sec, None if lost).
+        """
+        with self.lock:
+            targets = [(target, list(target.history))
+                       for target in self.targets.values()]
+
+        res = dict(status=None, warn_rtt=self.warn_rtt,
+                   bad_rtt=self.bad_rtt, targets={})
+        level = -1
+        for target, samples in targets:
+            rtts = [rtt for t, rtt in samples if rtt is not None]
+            loss = ((len(samples) - len(rtts)) / float(len(samples))
+                    if len(samples) > 0 else 0.0)
+            p90 = percentile(rtts, 90)
+            info = dict(kind=target.kind, host=target.host,
+                        count=len(samples), loss=loss,
+                        last=(samples[-1][1] if len(samples) > 0 else None),
+                        p50=percentile(rtts, 50), p90=p90,
+                        p99=percentile(rtts, 99),
+                        last_error=target.last_error,
+                        history=[rtt for t, rtt in samples[-history:]])
+            if len(samples) == 0:
+                # no results yet
+                info['status'] = None
+            else:
+                info['status'] = self._get_status(p90, loss)
+                level = max(level, status_levels.index(info['status']))
+            res['targets'][target.name] = info
+
+        if level >= 0:
+            res['status'] = status_levels[level]
+        return res
@@ -0,0 +1,187 @@
+#
+# Latency metrics for the Gen2 sound system.
+#
+"""
+Latency metrics for the Gen2 sound system.
+
+Sources stamp each sound message with the time it was sent and a
+sequence number.  A sink records how long each stage of getting a sound
+to the speaker took, in `Histogram`s:
+
+  transit     from the source sending the message to the sink receiving
+              it (NOTE: uses the wall clocks of both hosts)
+  decode      decoding the transport encoding
+  decompress  decompression / codec decoding
+  wait        from arrival until the player started on it, including
+              waiting behind sounds of better priority
+  start       from starting the player to the first sample being
+              written (time to first sample)
+  play        how long the sound played for
+  total       from the source sending the message to the first sample
+
+It also follows the sequence numbers from each source to count messages
+that went missing or arrived out of order.
+"""
+import os
+import json
+import math
+import time
+import threading
+
+# stages, in pipeline order
+stages = ('transit', 'decode', 'decompress', 'wait', 'start', 'play',
+          'total')
+
+
+class Histogram(object):
+    """Histogram of durations, in buckets growing by powers of two from
+    `base` seconds.
+    """
+
+    def __init__(self, base=0.0001, nbuckets=24):
+        self.base = base
+        self.counts = [0] * nbuckets
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        value = max(value, 0.0)
+        if value < self.base:
+            idx = 0
+        else:
+            idx = min(int(math.log(value / self.base, 2)) + 1,
+                      len(self.counts) - 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def get_bound(self, idx):
+        """Return the upper bound of bucket `idx`."""
+        return self.base * (2 ** idx)
+
+    def percentile(self, pct):
+        """Return (an upper bound on) the `pct` percentile."""
+        if self.count == 0:
+            return None
+        target = self.count * pct / 100.0
+        running = 0
+        for idx, count in enumerate(self.counts[:-1]):
+            running += count
+            if running >= target:
+                return min(self.get_bound(idx), self.max)
+        # the last bucket takes everything larger
+        return self.max
+
+    def get_stats(self):
+        if self.count == 0:
+            return dict(count=0)
+        buckets = [(self.get_bound(idx), count)
+                   for idx, count in enumerate(self.counts) if count > 0]
+        return dict(count=self.count, mean=self.total / self.count,
+                    min=self.min, max=self.max,
+                    p50=self.percentile(50), p90=self.percentile(90),
+                    p99=self.percentile(99), buckets=buckets)
+
+
+class SequenceTracker(object):
+    """Follows the sequence numbers of a message stream."""
+
+    def __init__(self):
+        self.expected = None
+        self.received = 0
+        self.missing = 0
+        self.out_of_order = 0
+
+    def add(self, seqnum):
+        self.received += 1
+        if self.expected is None or seqnum == self.expected:
+            self.expected = seqnum + 1
+        elif seqnum > self.expected:
+            self.missing += seqnum - self.expected
+            self.expected = seqnum + 1
+        else:
+            # this one was counted as missing when we skipped over it
+            self.out_of_order += 1
+            self.missing = max(self.missing - 1, 0)
+
+    def get_stats(self):
+        return dict(received=self.received, missing=self.missing,
+                    out_of_order=self.out_of_order)
+
+
+class SoundMetrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.time_start = time.time()
+        self.histograms = dict([(stage, Histogram()) for stage in stages])
+        # (source, dst) -> SequenceTracker
+        self.sequences = {}
+
+    def record(self, stage, value):
+        """Record that `stage` took `value` seconds."""
+        with self.lock:
+            self.histograms[stage].add(value)
+
+    def record_seq(self, src, dst, seqnum):
+        """Record the receipt of message `seqnum` of the stream of
+        messages from `src` for destinations `dst`.
+        """
+        key = '%s/%s' % (src, dst)
+        with self.lock:
+            tracker = self.sequences.get(key, None)
+            if tracker is None:
+                tracker = SequenceTracker()
+                self.sequences[key] = tracker
+            tracker.add(seqnum)
+
+    def get_metrics(self):
+        with self.lock:
+            return dict(time=time.time(),
+                        uptime=time.time() - self.time_start,
+                        stages=dict([(stage, hist.get_stats())
+                                     for stage, hist in
+                                     self.histograms.items()]),
+                        sources=dict([(key, tracker.get_stats())
+                                      for key, tracker in
+                                      self.sequences.items()]))
+
+    def format_text(self):
+        """Return the metrics as a human readable table."""
+        metrics = self.get_metrics()
+        lines = ["%-10s %8s %9s %9s %9s %9s" % (
+            'stage', 'count', 'mean ms', 'p50 ms', 'p99 ms', 'max ms')]
+        for stage in stages:
+            stats = metrics['stages'][stage]
+            if stats['count'] == 0:
+                lines.append("%-10s %8d" % (stage, 0))
+                continue
+            lines.append("%-10s %8d %9.1f %9.1f %9.1f %9.1f" % (
+                stage, stats['count'], stats['mean'] * 1000.0,
+                stats['p50'] * 1000.0, stats['p99'] * 1000.0,
+                stats['max'] * 1000.0))
+        lines.append('')
+        lines.append("%-30s %8s %8s %8s" % ('source', 'received', 'missing',
+                                            'reorder'))
+        for key, stats in sorted(metrics['sources'].items()):
+            lines.append("%-30s %8d %8d %8d" % (
+                key, stats['received'], stats['missing'],
+                stats['out_of_order']))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filepath):
+        """Write the metrics to `filepath`, as JSON if it ends in .json
+        and as a text table otherwise.
+        """
+        if filepath.endswith('.json'):
+            text = json.dumps(self.get_metrics(), indent=2, sort_keys=True)
+        else:
+            text = self.format_text()
+        tmppath = filepath + '.tmp'
+        with open(tmppath, 'w') as out_f:
+            out_f.write(text)
+        os.replace(tmppath, filepath)
@@ -0,0 +1,233 @@
+#
+# PCM mixer for the Gen2 sound sink.
+#
+"""
+PCM mixer for the Gen2 sound sink.
+
+Rather than playing a burst of equal priority sounds one after another,
+the sink can mix them into a single sound.  The sounds are decoded from
+AU/WAV to float samples, converted to a common rate and channel count,
+summed block by block with a limiter to keep the sum from clipping, and
+written out as a 16-bit WAV sound that plays through the usual backend.
+
+Lower priority sounds can be mixed in as well, "ducked" to a lower
+gain for as long as any of the higher priority sounds is playing.
+
+Requires `numpy`.
+"""
+import struct
+
+from g2client.util import audio
+from g2client.util.optional import have_numpy, get_numpy
+
+
+class MixError(Exception):
+    pass
+
+
+def _ulaw_table():
+    np = get_numpy()
+    u = ~np.arange(256, dtype=np.int32) & 0xff
+    exponent = (u >> 4) & 0x07
+    mantissa = u & 0x0f
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(u & 0x80, -magnitude, magnitude) / 32768.0
+
+
+def _alaw_table():
+    np = get_numpy()
+    a = np.arange(256, dtype=np.int32) ^ 0x55
+    exponent = (a >> 4) & 0x07
+    mantissa = a & 0x0f
+    magnitude = np.where(exponent == 0, (mantissa << 4) + 8,
+                         ((mantissa << 4) + 0x108) << np.maximum(exponent - 1,
+                                                                 0))
+    return np.where(a & 0x80, magnitude, -magnitude) / 32768.0
+
+
+_tables = {}
+
+
+def _get_table(format):
+    np = get_numpy()
+    table = _tables.get(format, None)
+    if table is None:
+        if format == 'ulaw':
+            table = _ulaw_table()
+        else:
+            table = _alaw_table()
+        _tables[format] = table.astype(np.float32)
+        table = _tables[format]
+    return table
+
+
+# sample format -> (numpy dtype, full scale)
+_linear_formats = {
+    'u8': ('u1', 128.0),
+    's16le': ('<i2', 32768.0),
+    's16be': ('>i2', 32768.0),
+    's32le': ('<i4', 2147483648.0),
+    's32be': ('>i4', 2147483648.0),
+    'float32le': ('<f4', 1.0),
+    'float32be': ('>f4', 1.0),
+    }
+
+
+def to_float(spec, frames):
+    """Convert the raw sample data `frames`, described by the
+    `audio.PCMSpec` `spec`, to an array of float32 samples in the range
+    -1..1, with one row per frame.
+    """
+    np = get_numpy()
+    fmt = spec.format
+    if fmt in ('ulaw', 'alaw'):
+        samples = _get_table(fmt)[np.frombuffer(frames, dtype=np.uint8)]
+
+    elif fmt in ('s24le', 's24be'):
+        b = np.frombuffer(frames, dtype=np.uint8).reshape((-1, 3))
+        b = b.astype(np.int32)
+        if fmt == 's24be':
+            b = b[:, ::-1]
+        samples = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        # sign extend
+        samples = (samples << 8) >> 8
+        samples = samples.astype(np.float32) / 8388608.0
+
+    elif fmt in _linear_formats:
+        dtype, scale = _linear_formats[fmt]
+        samples = np.frombuffer(frames, dtype=dtype).astype(np.float32)
+        if fmt == 'u8':
+            samples -= 128.0
+        if scale != 1.0:
+            samples /= scale
+
+    else:
+        raise MixError("cannot mix sample format '%s'" % (fmt))
+
+    return samples.reshape((-1, spec.channels))
+
+
+def convert(samples, rate_in, rate_out, channels_out):
+    """Resample `samples` (one row per frame) from `rate_in` to
+    `rate_out` by linear interpolation and convert them to
+    `channels_out` channels.
+    """
+    np = get_numpy()
+    channels_in = samples.shape[1]
+    if channels_in != channels_out:
+        if channels_in == 1:
+            samples = np.repeat(samples, channels_out, axis=1)
+        elif channels_out == 1:
+            samples = samples.mean(axis=1, keepdims=True)
+        else:
+            # keep the channels we have in common, silence the rest
+            out = np.zeros((len(samples), channels_out), dtype=np.float32)
+            n = min(channels_in, channels_out)
+            out[:, :n] = samples[:, :n]
+            samples = out
+
+    if rate_in != rate_out and len(samples) > 0:
+        nframes = int(round(len(samples) * rate_out / float(rate_in)))
+        t_out = np.arange(nframes) * (rate_in / float(rate_out))
+        t_in = np.arange(len(samples))
+        samples = np.column_stack([np.interp(t_out, t_in, samples[:, ch])
+                                   for ch in range(samples.shape[1])])
+        samples = samples.astype(np.float32)
+    return samples
+
+
+def make_wav(spec, data):
+    """Return the contents of a WAV file holding the 16-bit PCM `data`."""
+    block_align = spec.channels * 2
+    header = struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + len(data),
+                         b'WAVE', b'fmt ', 16, 1, spec.channels, spec.rate,
+                         spec.rate * block_align, block_align, 16,
+                         b'data', len(data))
+    return header + data
+
+
+class Mixer(object):
+    """Mixes sounds together into a single 16-bit PCM sound.
+
+    Samples are summed in blocks of `block_ms` milliseconds.  If the sum
+    over a block would clip, the whole block is scaled down to fit.
+    Sounds mixed with ducked=True are scaled by `duck_gain` while any of
+    the other sounds are playing.
+    """
+
+    def __init__(self, logger, block_ms=20, duck_gain=0.3):
+        self.logger = logger
+        self.block_ms = block_ms
+        self.duck_gain = duck_gain
+        self.num_mixes = 0
+        self.num_mixed = 0
+        self.num_limited = 0
+
+    def can_mix(self, sound):
+        """Return True if `sound` is something we are able to mix."""
+        if not have_numpy or sound.streaming:
+            return False
+        pcm = sound.get_pcm()
+        if pcm is None:
+            return False
+        spec, frames = pcm
+        return (spec.format in _linear_formats or
+                spec.format in ('ulaw', 'alaw', 's24le', 's24be'))
+
+    def mix(self, sounds, ducked=None):
+        """Mix the list of audio.Sound `sounds` and return the result as
+        an audio.Sound.  `ducked` is an optional list of flags saying
+        which sounds should be ducked.  The output has the rate and
+        channels of the first sound.
+        """
+        np = get_numpy()
+        if ducked is None:
+            ducked = [False] * len(sounds)
+        spec0, frames0 = sounds[0].get_pcm()
+        rate, channels = spec0.rate, min(spec0.channels, 2)
+        out_spec = audio.PCMSpec('s16le', rate, channels, 2)
+
+        tracks = []
+        for sound in sounds:
+            spec, frames = sound.get_pcm()
+            tracks.append(convert(to_float(spec, frames), spec.rate, rate,
+                                  channels))
+
+        nframes = max([len(track) for track in tracks])
+        # ducking lasts as long as the longest unducked track
+        duck_until = max([len(track) for track, duck in zip(tracks, ducked)
+                          if not duck] + [0])
+
+        out = np.empty((nframes, channels), dtype=np.int16)
+        block = max(1, rate * self.block_ms // 1000)
+        acc = np.empty((block, channels), dtype=np.float32)
+        for start in range(0, nframes, block):
+            end = min(start + block, nframes)
+            buf = acc[:end - start]
+            buf.fill(0.0)
+            for track, duck in zip(tracks, ducked):
+                if start >= len(track):
+                    continue
+                piece = track[start:end]
+                if duck and start < duck_until:
+                    # NOTE: gain changes at block boundaries only
+                    piece = piece * self.duck_gain
+                buf[:len(piece)] += piece
+
+            peak = np.abs(buf).max() if len(buf) > 0 else 0.0
+            if peak > 1.0:
+                buf *= 1.0 / peak
+                self.num_limited += 1
+            np.clip(buf * 32767.0, -32768, 32767, out=buf)
+            out[start:end] = buf
+
+        self.num_mixes += 1
+        self.num_mixed += len(sounds)
+        data = make_wav(out_spec, out.astype('<i2').tobytes())
+        filenames = [str(sound.filename) for sound in sounds]
+        return audio.Sound(data, format='wav',
+                           filename='+'.join(filenames))
+
+    def get_stats(self):
+        return dict(mixes=self.num_mixes, mixed=self.num_mixed,
+                    limited=self.num_limited)
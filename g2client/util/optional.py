@@ -0,0 +1,21 @@
+#
+# Optional packages used by g2client.
+#
+"""
+Optional packages used by g2client.
+
+numpy is slow to import, so it is not imported when a module that can
+use it is loaded; `have_numpy` says whether it is installed, and
+get_numpy() imports it where it is first used.
+"""
+import importlib.util
+
+have_numpy = importlib.util.find_spec('numpy') is not None
+
+
+def get_numpy():
+    """Return the numpy module, importing it if need be.  Raises
+    ImportError if it is not installed.
+    """
+    import numpy
+    return numpy
@@ -0,0 +1,342 @@
+#
+# Codecs for sound payloads in the Gen2 sound system.
+#
+"""
+Codecs for sound payloads in the Gen2 sound system.
+
+A codec transforms the contents of a sound file into a (hopefully)
+smaller payload for transport and back again, losslessly.  Which codecs
+are available depends on the optional packages installed:
+
+  none      no transformation
+  zlib      general purpose compression (always available)
+  zstd      Zstandard compression (requires `zstandard`)
+  lz4       LZ4 frame compression (requires `lz4`)
+  pcmdelta  FLAC-style fixed prediction of 16-bit PCM samples, with the
+            residuals split into byte planes and deflated (requires
+            `numpy`; AU/WAV only)
+
+`CodecSelector` picks a codec for each payload from the compression
+ratio and encoding speed it has measured for payloads of that format.
+"""
+import zlib
+import time
+import struct
+import threading
+
+from g2client.util import audio
+from g2client.util.optional import have_numpy, get_numpy
+
+try:
+    import zstandard
+    have_zstd = True
+except ImportError:
+    have_zstd = False
+
+try:
+    import lz4.frame
+    have_lz4 = True
+except ImportError:
+    have_lz4 = False
+
+# Sound formats that are already compressed, so not worth compressing again
+compressed_formats = ('mp3', 'ogg', 'oga', 'opus', 'flac', 'm4a', 'aac')
+
+
+class CodecError(Exception):
+    pass
+
+
+class Codec(object):
+    """Base class for sound payload codecs."""
+
+    name = None
+
+    def encode(self, data, format=None):
+        raise NotImplementedError("subclass should override this method")
+
+    def decode(self, data):
+        raise NotImplementedError("subclass should override this method")
+
+
+class NullCodec(Codec):
+
+    name = 'none'
+
+    def encode(self, data, format=None):
+        return bytes(data)
+
+    def decode(self, data):
+        return data
+
+
+class ZlibCodec(Codec):
+
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def encode(self, data, format=None):
+        return zlib.compress(data, self.level)
+
+    def decode(self, data):
+        try:
+            return zlib.decompress(data)
+        except zlib.error as e:
+            raise CodecError("zlib: %s" % str(e))
+
+
+class ZstdCodec(Codec):
+
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        self.level = level
+        # (de)compressor objects are not thread safe
+        self.local = threading.local()
+
+    def _get(self, attr, klass, **kwdargs):
+        obj = getattr(self.local, attr, None)
+        if obj is None:
+            obj = klass(**kwdargs)
+            setattr(self.local, attr, obj)
+        return obj
+
+    def encode(self, data, format=None):
+        cctx = self._get('cctx', zstandard.ZstdCompressor, level=self.level)
+        return cctx.compress(data)
+
+    def decode(self, data):
+        dctx = self._get('dctx', zstandard.ZstdDecompressor)
+        try:
+            return dctx.decompress(data)
+        except zstandard.ZstdError as e:
+            raise CodecError("zstd: %s" % str(e))
+
+
+class LZ4Codec(Codec):
+
+    name = 'lz4'
+
+    def encode(self, data, format=None):
+        return lz4.frame.compress(data)
+
+    def decode(self, data):
+        try:
+            return lz4.frame.decompress(data)
+        except RuntimeError as e:
+            raise CodecError("lz4: %s" % str(e))
+
+
+class PCMDeltaCodec(Codec):
+    """Lossless compression of 16-bit PCM AU/WAV files.
+
+    Like FLAC's fixed order-1 predictor, each sample is replaced by its
+    difference from the previous sample in the same channel (wrapping
+    modulo 2**16, so the transform is exactly invertible).  The residuals
+    of a typical sound are small, so their high bytes are nearly all
+    0x00 or 0xff; storing low and high bytes as separate planes lets
+    deflate exploit that.  The file header and any trailing bytes are
+    kept verbatim.
+    """
+
+    name = 'pcmdelta'
+    magic = b'G2D1'
+    # magic, prefix length, data length, suffix length, channels, big endian
+    header = struct.Struct('<4sIIIHB')
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def encode(self, data, format=None):
+        np = get_numpy()
+        try:
+            spec, offset, length = audio.parse_pcm(data)
+        except audio.AudioError as e:
+            raise CodecError("pcmdelta: %s" % str(e))
+        if spec.width != 2 or spec.format not in ('s16le', 's16be'):
+            raise CodecError("pcmdelta: not 16-bit PCM (%s)" % spec.format)
+
+        mv = memoryview(data)
+        frame_size = spec.width * spec.channels
+        length -= length % frame_size
+        big_endian = spec.format == 's16be'
+        dtype = np.dtype('>i2' if big_endian else '<i2')
+
+        samples = np.frombuffer(mv[offset:offset + length], dtype=dtype)
+        samples = samples.astype(np.int16).reshape((-1, spec.channels))
+        resid = np.empty_like(samples)
+        if len(samples) > 0:
+            resid[0] = samples[0]
+            np.subtract(samples[1:], samples[:-1], out=resid[1:])
+        # fix the byte order of the planes, whatever this host's order is
+        resid = resid.reshape(-1).astype('<i2')
+        planes = resid.view(np.uint8).reshape((-1, 2)).T
+        body = zlib.compress(np.ascontiguousarray(planes).tobytes(),
+                             self.level)
+
+        prefix = mv[:offset]
+        suffix = mv[offset + length:]
+        return b''.join([self.header.pack(self.magic, len(prefix), length,
+                                          len(suffix), spec.channels,
+                                          int(big_endian)),
+                         prefix, suffix, body])
+
+    def decode(self, data):
+        np = get_numpy()
+        mv = memoryview(data)
+        try:
+            (magic, prefix_len, length, suffix_len, channels,
+             big_endian) = self.header.unpack(mv[:self.header.size])
+        except struct.error as e:
+            raise CodecError("pcmdelta: %s" % str(e))
+        if magic != self.magic:
+            raise CodecError("pcmdelta: bad magic")
+        pos = self.header.size
+        prefix = mv[pos:pos + prefix_len]
+        pos += prefix_len
+        suffix = mv[pos:pos + suffix_len]
+        pos += suffix_len
+        try:
+            body = zlib.decompress(mv[pos:])
+        except zlib.error as e:
+            raise CodecError("pcmdelta: %s" % str(e))
+        if len(body) != length:
+            raise CodecError("pcmdelta: length mismatch")
+
+        planes = np.frombuffer(body, dtype=np.uint8).reshape((2, -1))
+        resid = np.ascontiguousarray(planes.T).view('<i2')
+        resid = resid.reshape((-1, channels)).astype(np.int16)
+        samples = np.cumsum(resid, axis=0, dtype=np.int16)
+        dtype = np.dtype('>i2' if big_endian else '<i2')
+        return b''.join([prefix, samples.astype(dtype).tobytes(), suffix])
+
+
+codecs = {}
+
+
+def register_codec(codec):
+    codecs[codec.name] = codec
+
+
+register_codec(NullCodec())
+register_codec(ZlibCodec())
+if have_zstd:
+    register_codec(ZstdCodec())
+if have_lz4:
+    register_codec(LZ4Codec())
+if have_numpy:
+    register_codec(PCMDeltaCodec())
+
+
+def get_codec_names():
+    """Return the names of the codecs available here."""
+    return sorted(codecs.keys())
+
+
+def get_codec(name):
+    try:
+        return codecs[name]
+    except KeyError:
+        raise CodecError("codec '%s' is not available" % (name))
+
+
+def encode(name, data, format=None):
+    return get_codec(name).encode(data, format=format)
+
+
+def decode(name, data):
+    return get_codec(name).decode(data)
+
+
+class CodecSelector(object):
+    """Chooses a codec for each payload.
+
+    For every (format, codec) pair we keep running averages of the
+    compression ratio and encoding speed.  The codec chosen is the one
+    with the lowest estimated cost, the time to send the encoded payload
+    at `bandwidth` bytes/sec plus the time to encode it.  Codecs not yet
+    measured for a format are tried first, and every `explore_every`
+    payloads the least measured codec is tried again so that estimates
+    keep up with changing content.
+    """
+
+    def __init__(self, bandwidth=1.0e6, explore_every=50, alpha=0.2):
+        self.bandwidth = bandwidth
+        self.explore_every = explore_every
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        # (format, codec) -> dict(count, ratio, speed)
+        self.stats = {}
+        self.count = 0
+
+    def _estimate(self, format, name, size):
+        stats = self.stats.get((format, name), None)
+        if stats is None:
+            return None
+        return (stats['ratio'] * size / self.bandwidth +
+                size / stats['speed'])
+
+    def choose(self, format, size, allowed):
+        """Return the name of the codec to use for a payload of `size`
+        bytes in `format`, from the codec names in `allowed`.
+        """
+        candidates = [name for name in allowed if name in codecs]
+        if len(candidates) == 0:
+            raise CodecError("no usable codecs in %s" % str(allowed))
+        if format in compressed_formats and 'none' in candidates:
+            return 'none'
+
+        with self.lock:
+            self.count += 1
+            counts = [(self.stats.get((format, name), {}).get('count', 0),
+                       name) for name in candidates]
+            least_count, least_name = min(counts)
+            if least_count == 0 or self.count % self.explore_every == 0:
+                return least_name
+
+            costs = [(self._estimate(format, name, size), name)
+                     for name in candidates]
+            return min(costs)[1]
+
+    def record(self, format, name, size_in, size_out, elapsed):
+        with self.lock:
+            ratio = size_out / float(max(size_in, 1))
+            speed = size_in / max(elapsed, 1.0e-6)
+            stats = self.stats.get((format, name), None)
+            if stats is None:
+                self.stats[(format, name)] = dict(count=1, ratio=ratio,
+                                                  speed=speed)
+                return
+            a = self.alpha
+            stats['count'] += 1
+            stats['ratio'] = (1 - a) * stats['ratio'] + a * ratio
+            stats['speed'] = (1 - a) * stats['speed'] + a * speed
+
+    def encode(self, data, format, allowed):
+        """Encode `data` with the best codec from `allowed`.
+        Returns a tuple of (codec name, encoded data).
+        """
+        name = self.choose(format, len(data), allowed)
+        time_start = time.time()
+        try:
+            buf = encode(name, data, format=format)
+
+        except CodecError:
+            # codec does not apply to this payload; don't try it again
+            with self.lock:
+                self.stats[(format, name)] = dict(count=1, ratio=1.0e6,
+                                                  speed=1.0)
+            name = 'none'
+            time_start = time.time()
+            buf = encode(name, data, format=format)
+
+        self.record(format, name, len(data), len(buf),
+                    time.time() - time_start)
+        return name, buf
+
+    def get_stats(self):
+        with self.lock:
+            return dict([('%s/%s' % key, dict(stats))
+                         for key, stats in self.stats.items()])
@@ -0,0 +1,182 @@
+#
+# Content-addressed cache of decoded sounds for the Gen2 sound sink.
+#
+"""
+Content-addressed cache of decoded sounds for the Gen2 sound sink.
+
+Sounds are keyed by a hash of the payload they arrived in, so a repeated
+sound can skip transport decoding, decompression and format detection.
+The memory tier is an LRU capped in bytes.  The optional disk tier keeps
+decoded sound files in a directory, named by key, and memory-maps them
+on a hit; it is rebuilt from the directory contents at startup, so it
+survives restarts.
+"""
+import os
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict
+
+from g2client.util import audio
+
+
+def get_key(buf):
+    """Return the cache key for the transport payload `buf`."""
+    if isinstance(buf, str):
+        buf = buf.encode('latin1')
+    return hashlib.sha256(buf).hexdigest()
+
+
+class SoundCache(object):
+
+    def __init__(self, logger, max_bytes=64 * 1024 * 1024, cache_dir=None,
+                 max_disk_bytes=512 * 1024 * 1024):
+        self.logger = logger
+        self.lock = threading.RLock()
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        # key -> audio.Sound, least recently used first
+        self.mem = OrderedDict()
+        self.mem_bytes = 0
+        # key -> (path, format, size), least recently used first
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.cache_dir is not None:
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(fname)
+            path = os.path.join(self.cache_dir, fname)
+            if len(key) != 64 or not ext:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, key, path, ext[1:], st.st_size))
+
+        entries.sort()
+        for mtime, key, path, format, size in entries:
+            self.disk[key] = (path, format, size)
+            self.disk_bytes += size
+        self._trim_disk()
+        self.logger.info("sound cache: %d sounds (%d bytes) on disk in %s" % (
+            len(self.disk), self.disk_bytes, self.cache_dir))
+
+    def get(self, key):
+        """Return the cached audio.Sound for `key`, or None."""
+        with self.lock:
+            sound = self.mem.get(key, None)
+            if sound is not None:
+                self.mem.move_to_end(key)
+                self.hits += 1
+                return sound
+
+            sound = self._get_disk(key)
+            if sound is not None:
+                self.disk_hits += 1
+                self._put_mem(key, sound)
+                return sound
+
+            self.misses += 1
+            return None
+
+    def _get_disk(self, key):
+        if key not in self.disk:
+            return None
+        path, format, size = self.disk[key]
+        try:
+            with open(path, 'rb') as in_f:
+                data = mmap.mmap(in_f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path, None)
+
+        except (IOError, OSError, ValueError) as e:
+            self.logger.warning("sound cache: dropping %s: %s" % (
+                path, str(e)))
+            self._remove_disk(key)
+            return None
+
+        self.disk.move_to_end(key)
+        return audio.Sound(data, format=format)
+
+    def put(self, key, sound):
+        """Add audio.Sound `sound` to the cache under `key`."""
+        with self.lock:
+            if key in self.mem:
+                return
+            self._put_mem(key, sound)
+            if self.cache_dir is not None and key not in self.disk:
+                self._put_disk(key, sound)
+
+    def _put_mem(self, key, sound):
+        if sound.size > self.max_bytes:
+            return
+        self.mem[key] = sound
+        self.mem_bytes += sound.size
+        while self.mem_bytes > self.max_bytes:
+            _key, _sound = self.mem.popitem(last=False)
+            self.mem_bytes -= _sound.size
+            self.evictions += 1
+
+    def _put_disk(self, key, sound):
+        if sound.size > self.max_disk_bytes or sound.size == 0:
+            return
+        path = os.path.join(self.cache_dir, '%s.%s' % (key, sound.format))
+        tmppath = path + '.tmp'
+        try:
+            with open(tmppath, 'wb') as out_f:
+                out_f.write(sound.data)
+            os.replace(tmppath, path)
+
+        except (IOError, OSError) as e:
+            self.logger.warning("sound cache: cannot write %s: %s" % (
+                path, str(e)))
+            return
+
+        self.disk[key] = (path, sound.format, sound.size)
+        self.disk_bytes += sound.size
+        self._trim_disk()
+
+    def _remove_disk(self, key):
+        path, format, size = self.disk.pop(key)
+        self.disk_bytes -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _trim_disk(self):
+        while self.disk_bytes > self.max_disk_bytes:
+            key = next(iter(self.disk))
+            self._remove_disk(key)
+
+    def clear(self):
+        """Empty the memory tier of the cache."""
+        with self.lock:
+            self.mem.clear()
+            self.mem_bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return dict(hits=self.hits, disk_hits=self.disk_hits,
+                        misses=self.misses, evictions=self.evictions,
+                        hit_ratio=((self.hits + self.disk_hits) /
+                                   float(lookups) if lookups > 0 else 0.0),
+                        mem_sounds=len(self.mem),
+                        mem_bytes=self.mem_bytes,
+                        max_bytes=self.max_bytes,
+                        disk_sounds=len(self.disk),
+                        disk_bytes=self.disk_bytes)
@@ -0,0 +1,72 @@
+#
+# Timing of the phases of starting up.
+#
+"""
+Timing of the phases of starting up.
+
+The programs record how long each phase of starting up takes (imports,
+loading settings, building the GUI, initializing remote objects,
+starting monitors and so on) on the module's `timer`, which can report
+them with --startup-report.  Phases may run at the same time, in
+different threads; each is reported with when it started and ended,
+counting from when the program started.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StartupTimer(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # time the program started; may be set earlier with set_start()
+        self.time_start = time.time()
+        # list of (name, start, end)
+        self.phases = []
+
+    def set_start(self, time_start):
+        with self.lock:
+            self.time_start = min(self.time_start, time_start)
+
+    def add(self, name, time_start, time_end):
+        """Record that phase `name` ran from `time_start` to `time_end`."""
+        with self.lock:
+            self.phases.append((name, time_start, time_end))
+
+    @contextmanager
+    def phase(self, name):
+        """Record the time taken by the code in the with block as phase
+        `name`.
+        """
+        time_start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time_start, time.time())
+
+    def get_report(self):
+        """Return a list of dicts of the name, start, end and duration
+        (sec) of each phase, in the order they started.
+        """
+        with self.lock:
+            time_start = self.time_start
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        return [dict(name=name, start=start - time_start,
+                     end=end - time_start, duration=end - start)
+                for name, start, end in phases]
+
+    def format_report(self):
+        lines = ["%-28s %9s %9s %9s" % ('phase', 'start', 'end',
+                                         'duration')]
+        total = 0.0
+        for phase in self.get_report():
+            lines.append("%-28s %8.1fms %8.1fms %8.1fms" % (
+                phase['name'], phase['start'] * 1000.0,
+                phase['end'] * 1000.0, phase['duration'] * 1000.0))
+            total = max(total, phase['end'])
+        lines.append("%-28s %29.1fms" % ('total', total * 1000.0))
+        return '\n'.join(lines)
+
+
+timer = StartupTimer()
@@ -0,0 +1,373 @@
+#
+# Supervision of the VNC viewers started by g2disp.
+#
+"""
+Supervision of the VNC viewers started by g2disp.
+
+A `ViewerSupervisor` keeps the viewer processes it has started, by key,
+and checks each one periodically through /proc.  A viewer that has
+exited, or that has been stopped or stuck in an uninterruptible wait for
+too long, is (re)started after a delay that doubles with each restart,
+up to a limit; the delay is reset once a viewer has stayed up for a
+while.  The liveness, CPU use, memory and restart count of each viewer
+can be had with get_status(), and wait_connected() waits for a viewer
+to connect to its VNC server.
+"""
+import os
+import time
+import signal
+import threading
+
+from g2base import Bunch
+
+# clock ticks per second and bytes per page, for reading /proc
+clk_tck = os.sysconf('SC_CLK_TCK')
+page_size = os.sysconf('SC_PAGE_SIZE')
+
+
+def read_proc(pid):
+    """Return a Bunch of the state, start time (ticks since boot), CPU
+    time (sec) and resident memory (bytes) of process `pid` from /proc,
+    or None if there is no such process.
+    """
+    try:
+        with open('/proc/%d/stat' % (pid), 'r') as in_f:
+            stat = in_f.read()
+
+    except (IOError, OSError):
+        return None
+
+    # the command name is in parentheses and may contain anything
+    fields = stat[stat.rindex(')') + 2:].split()
+    return Bunch.Bunch(state=fields[0],
+                       cpu=(int(fields[11]) + int(fields[12])) / clk_tck,
+                       start=int(fields[19]),
+                       rss=int(fields[21]) * page_size)
+
+
+def get_sockets(pid):
+    """Return the inodes of the sockets open in process `pid` and its
+    children.
+    """
+    pids = [pid]
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid), 'r') as in_f:
+            pids.extend([int(child) for child in in_f.read().split()])
+    except (IOError, OSError):
+        pass
+
+    inodes = set([])
+    for _pid in pids:
+        fddir = '/proc/%d/fd' % (_pid)
+        try:
+            fds = os.listdir(fddir)
+        except (IOError, OSError):
+            continue
+        for fd in fds:
+            try:
+                link = os.readlink(os.path.join(fddir, fd))
+            except (IOError, OSError):
+                continue
+            if link.startswith('socket:['):
+                inodes.add(int(link[8:-1]))
+    return inodes
+
+
+def get_established():
+    """Return the inodes of the established TCP connections on this
+    host.
+    """
+    inodes = set([])
+    for path in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(path, 'r') as in_f:
+                lines = in_f.readlines()[1:]
+        except (IOError, OSError):
+            continue
+        for line in lines:
+            fields = line.split()
+            # connection state 01 is ESTABLISHED
+            if len(fields) > 9 and fields[3] == '01':
+                inodes.add(int(fields[9]))
+    return inodes
+
+
+class _Viewer(object):
+    """A supervised viewer process."""
+
+    def __init__(self, key, cmdstr, info):
+        self.key = key
+        self.cmdstr = cmdstr
+        self.info = info
+        self.proc = None
+        self.pid = None
+        self.start = None
+        self.time_start = None
+        self.state = 'starting'
+        self.time_state = time.time()
+        self.cpu = 0.0
+        self.cpu_pct = 0.0
+        self.rss = 0
+        self.time_connect = None
+        self.restarts = 0
+        self.backoff = 0.0
+        self.time_restart = 0.0
+        self.last_error = None
+
+
+class ViewerSupervisor(object):
+
+    def __init__(self, logger, spawn_fn, interval=2.0, backoff=1.0,
+                 max_backoff=60.0, stable_time=30.0, hang_time=30.0):
+        """`spawn_fn(cmdstr)` starts a process in its own process group,
+        returning an object with getpid() and killpg() methods (such as
+        a g2base myproc).
+        """
+        self.logger = logger
+        self.spawn_fn = spawn_fn
+        self.interval = interval
+        self.min_backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.hang_time = hang_time
+
+        self.lock = threading.RLock()
+        # key -> _Viewer
+        self.viewers = {}
+        self.ev_quit = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.ev_quit.clear()
+        self.thread = threading.Thread(target=self.check_loop,
+                                       name='g2disp-supervisor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.ev_quit.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _spawn(self, viewer):
+        # Start the process for `viewer`
+        now = time.time()
+        viewer.time_start = now
+        viewer.time_connect = None
+        try:
+            viewer.proc = self.spawn_fn(viewer.cmdstr)
+            viewer.pid = viewer.proc.getpid()
+            stat = read_proc(viewer.pid)
+            viewer.start = stat.start if stat is not None else None
+            viewer.cpu = stat.cpu if stat is not None else 0.0
+            self._set_state(viewer, 'running')
+
+        except Exception as e:
+            self.logger.error("error starting viewer %s: %s" % (
+                viewer.key, str(e)))
+            viewer.proc = None
+            viewer.pid = None
+            viewer.last_error = str(e)
+            self._set_state(viewer, 'dead')
+            self._schedule_restart(viewer, now)
+
+    def _kill(self, viewer, force=False):
+        if viewer.proc is None:
+            return
+        try:
+            if force:
+                # a stopped or stuck process won't act on SIGTERM
+                os.killpg(viewer.pid, signal.SIGKILL)
+            viewer.proc.killpg()
+        except Exception as e:
+            self.logger.debug("error killing viewer %s: %s" % (
+                viewer.key, str(e)))
+        self._reap(viewer)
+        viewer.proc = None
+
+    def _reap(self, viewer):
+        # collect the exit status of our child, so it is not left a zombie
+        try:
+            pid, status = os.waitpid(viewer.pid, os.WNOHANG)
+            if pid != 0:
+                # exit code, or minus the signal that killed it
+                if os.WIFEXITED(status):
+                    return os.WEXITSTATUS(status)
+                if os.WIFSIGNALED(status):
+                    return -os.WTERMSIG(status)
+        except (OSError, TypeError):
+            pass
+        return None
+
+    def _set_state(self, viewer, state):
+        if viewer.state != state:
+            viewer.state = state
+            viewer.time_state = time.time()
+
+    def _schedule_restart(self, viewer, now):
+        if now - viewer.time_start >= self.stable_time:
+            # it ran long enough to have been healthy
+            viewer.backoff = 0.0
+        viewer.backoff = min(self.max_backoff,
+                             max(self.min_backoff, viewer.backoff * 2))
+        viewer.time_restart = now + viewer.backoff
+        self.logger.warning("restarting viewer %s in %.1f sec" % (
+            viewer.key, viewer.backoff))
+
+    def add(self, key, cmdstr, info=None):
+        """Start a viewer with command `cmdstr` under `key`, replacing
+        any viewer we had under that key.  `info` is a dict of details
+        reported with its status.
+        """
+        viewer = _Viewer(key, cmdstr, info)
+        with self.lock:
+            old = self.viewers.pop(key, None)
+            self.viewers[key] = viewer
+        # NOTE: viewers are started and stopped outside of the lock, so
+        # that several can be at once; the checks leave them alone while
+        # they are 'starting'
+        if old is not None:
+            self._kill(old, force=(old.state == 'hung'))
+        self._spawn(viewer)
+        with self.lock:
+            removed = self.viewers.get(key, None) is not viewer
+        if removed:
+            # it was stopped or replaced while we started it
+            self._kill(viewer)
+
+    def remove(self, key):
+        """Stop the viewer under `key`.  Raises KeyError if there is
+        none.
+        """
+        with self.lock:
+            viewer = self.viewers.pop(key)
+        self._kill(viewer, force=(viewer.state == 'hung'))
+
+    def remove_all(self):
+        with self.lock:
+            keys = list(self.viewers.keys())
+        for key in keys:
+            try:
+                self.remove(key)
+            except KeyError:
+                pass
+
+    def is_connected(self, key):
+        """Return True if the viewer under `key` has an established
+        TCP connection.
+        """
+        with self.lock:
+            viewer = self.viewers.get(key, None)
+            if viewer is None or viewer.state != 'running':
+                return False
+            pid = viewer.pid
+        return len(get_sockets(pid) & get_established()) > 0
+
+    def wait_connected(self, key, timeout=10.0, interval=0.05):
+        """Wait up to `timeout` seconds for the viewer under `key` to
+        connect.  Returns the time (sec) it took from starting, or None
+        if it did not connect in time or died.
+        """
+        time_end = time.time() + timeout
+        while True:
+            with self.lock:
+                viewer = self.viewers.get(key, None)
+                if viewer is None or viewer.state == 'dead':
+                    return None
+            if self.is_connected(key):
+                now = time.time()
+                with self.lock:
+                    if viewer.time_connect is None:
+                        viewer.time_connect = now - viewer.time_start
+                    return viewer.time_connect
+            if time.time() >= time_end:
+                return None
+            time.sleep(interval)
+
+    def _check(self, viewer, now, time_delta):
+        # Check on one viewer, restarting it if need be
+        if viewer.state == 'starting':
+            return
+        if viewer.state == 'dead':
+            if now >= viewer.time_restart:
+                viewer.restarts += 1
+                self.logger.info("restarting viewer %s (restart %d)" % (
+                    viewer.key, viewer.restarts))
+                self._spawn(viewer)
+            return
+
+        stat = None
+        if viewer.pid is not None:
+            stat = read_proc(viewer.pid)
+        if (stat is None or stat.state in ('Z', 'X') or
+            (viewer.start is not None and stat.start != viewer.start)):
+            status = self._reap(viewer)
+            viewer.last_error = ("exited" if status is None else
+                                 "exited with status %d" % (status))
+            self.logger.error("viewer %s (pid %s) %s" % (
+                viewer.key, viewer.pid, viewer.last_error))
+            viewer.proc = None
+            self._set_state(viewer, 'dead')
+            self._schedule_restart(viewer, now)
+            return
+
+        if time_delta > 0:
+            viewer.cpu_pct = (max(0.0, stat.cpu - viewer.cpu) * 100.0 /
+                              time_delta)
+        viewer.cpu = stat.cpu
+        viewer.rss = stat.rss
+
+        if stat.state in ('T', 't', 'D'):
+            self._set_state(viewer, 'hung')
+            if now - viewer.time_state >= self.hang_time:
+                viewer.last_error = "hung (state %s)" % (stat.state)
+                self.logger.error("viewer %s (pid %d) %s" % (
+                    viewer.key, viewer.pid, viewer.last_error))
+                self._kill(viewer, force=True)
+                self._set_state(viewer, 'dead')
+                self._schedule_restart(viewer, now)
+        else:
+            self._set_state(viewer, 'running')
+
+    def check(self, time_delta=0.0):
+        """Check on all our viewers once."""
+        now = time.time()
+        with self.lock:
+            for viewer in list(self.viewers.values()):
+                try:
+                    self._check(viewer, now, time_delta)
+
+                except Exception as e:
+                    self.logger.error("error checking viewer %s: %s" % (
+                        viewer.key, str(e)), exc_info=True)
+
+    def check_loop(self):
+        time_last = time.time()
+        while not self.ev_quit.wait(self.interval):
+            now = time.time()
+            self.check(time_delta=now - time_last)
+            time_last = now
+
+    def get_status(self):
+        """Return a dict of key -> status of each of our viewers."""
+        now = time.time()
+        res = {}
+        with self.lock:
+            for key, viewer in self.viewers.items():
+                status = dict(state=viewer.state, pid=viewer.pid,
+                              alive=(viewer.state == 'running'),
+                              uptime=(now - viewer.time_start
+                                      if viewer.state in ('running', 'hung')
+                                      else 0.0),
+                              cpu_pct=viewer.cpu_pct, cpu_time=viewer.cpu,
+                              rss=viewer.rss, restarts=viewer.restarts,
+                              connect_time=viewer.time_connect,
+                              last_error=viewer.last_error)
+                if viewer.state == 'dead':
+                    status['restart_in'] = max(0.0,
+                                               viewer.time_restart - now)
+                if viewer.info is not None:
+                    status.update(viewer.info)
+                res[key] = status
+        return res
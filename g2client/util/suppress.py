@@ -0,0 +1,133 @@
+#
+# Sound storm suppression for the Gen2 sound sink.
+#
+"""
+Sound storm suppression for the Gen2 sound sink.
+
+When a subsystem flaps it can publish the same alarm many times a
+minute.  `SoundSuppressor` decides which of the sounds arriving at a
+sink are worth playing:
+
+  - identical payloads (by hash) arriving within `window` seconds of one
+    that was played are coalesced into that playback
+  - each (source, filename) pair has a token bucket allowing `rate`
+    sounds per second, in bursts of up to `burst`
+
+Suppressed sounds are counted, and a summary is logged when a sound
+that has been suppressed is next played.
+"""
+import time
+import threading
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.time_last = time.time()
+
+    def take(self, now):
+        """Take a token, returning False if there are none left."""
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.time_last) * self.rate)
+        self.time_last = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class SoundSuppressor(object):
+
+    def __init__(self, logger, window=0.0, rate=None, burst=5):
+        self.logger = logger
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+
+        # hash -> time the sound was last played
+        self.recent = {}
+        # (src, filename) -> TokenBucket
+        self.buckets = {}
+        # (src, filename) -> count suppressed since last played
+        self.pending = {}
+        self.time_cleaned = time.time()
+
+        self.num_passed = 0
+        self.num_coalesced = 0
+        self.num_limited = 0
+        # (src, filename) -> total count suppressed
+        self.suppressed = {}
+
+    def is_enabled(self):
+        return self.window > 0 or self.rate is not None
+
+    def check(self, key, src=None, filename=None):
+        """Decide whether to play the sound with hash `key` from source
+        `src`.  Returns None if it should be played, otherwise the reason
+        it was suppressed ('duplicate' or 'rate').
+        """
+        now = time.time()
+        ident = (str(src), str(filename))
+        with self.lock:
+            if now - self.time_cleaned > max(self.window, 60.0):
+                self._clean(now)
+
+            reason = None
+            time_last = self.recent.get(key, None)
+            if time_last is not None and now - time_last < self.window:
+                reason = 'duplicate'
+                self.num_coalesced += 1
+
+            elif self.rate is not None:
+                bucket = self.buckets.get(ident, None)
+                if bucket is None:
+                    bucket = TokenBucket(self.rate, self.burst)
+                    self.buckets[ident] = bucket
+                if not bucket.take(now):
+                    reason = 'rate'
+                    self.num_limited += 1
+
+            if reason is not None:
+                count = self.pending.get(ident, 0)
+                if count == 0:
+                    self.logger.info("suppressing sound '%s' from %s (%s)" % (
+                        ident[1], ident[0], reason))
+                self.pending[ident] = count + 1
+                self.suppressed[ident] = self.suppressed.get(ident, 0) + 1
+                return reason
+
+            self.num_passed += 1
+            if self.window > 0:
+                self.recent[key] = now
+            count = self.pending.pop(ident, 0)
+            if count > 0:
+                self.logger.info("suppressed %d copies of sound '%s' "
+                                 "from %s" % (count, ident[1], ident[0]))
+            return None
+
+    def _clean(self, now):
+        # forget about sounds and buckets we won't need again
+        self.recent = dict([(key, t) for key, t in self.recent.items()
+                            if now - t < self.window])
+        if self.rate is not None:
+            idle = self.burst / self.rate
+            self.buckets = dict([(ident, bucket)
+                                 for ident, bucket in self.buckets.items()
+                                 if now - bucket.time_last < idle])
+        self.time_cleaned = now
+
+    def get_stats(self):
+        with self.lock:
+            top = sorted(self.suppressed.items(), key=lambda item: -item[1])
+            return dict(passed=self.num_passed,
+                        coalesced=self.num_coalesced,
+                        rate_limited=self.num_limited,
+                        window=self.window, rate=self.rate,
+                        burst=self.burst,
+                        top=[dict(src=ident[0], filename=ident[1],
+                                  count=count)
+                             for ident, count in top[:10]])
@@ -0,0 +1,276 @@
+#
+# Managed cache of synthesized speech for the Gen2 sound source.
+#
+"""
+Managed cache of synthesized speech for the Gen2 sound source.
+
+Synthesized WAV files are kept in a cache directory together with an
+index (`index.json`) recording their size, creation and last use times
+and the parameters they were made from.  The index is loaded at startup,
+and the cache is held within byte and entry limits by evicting the least
+recently used files, as well as any older than a maximum age.
+
+Several processes may share a cache directory (the default one is per
+user).  The index is read and written under a lock on the directory,
+and what the other processes have added is merged in before it is
+written.  Files that are not in the index are only removed once they
+are old enough that they can't be still being written.
+"""
+import os
+import time
+import json
+import fcntl
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+default_cache_dir = os.path.join(tempfile.gettempdir(),
+                                 'g2tts-%d' % (os.getuid()))
+
+# Time (sec) after which a file in the cache directory that is not in
+# the index is taken to be left over, e.g. from an interrupted synthesis
+default_orphan_age = 3600.0
+
+
+def get_key(text, voice, volume, rate=None):
+    """Return the cache key for synthesizing `text` with `voice` at
+    `volume` dB (and resampling to `rate`, if given).
+    """
+    hashobj = hashlib.sha256()
+    combo = text + voice + str(volume)
+    if rate is not None:
+        combo += '@%d' % rate
+    hashobj.update(combo.encode())
+    return hashobj.hexdigest()
+
+
+class TTSCache(object):
+
+    def __init__(self, logger, cache_dir=None, max_bytes=100 * 1024 * 1024,
+                 max_entries=2000, max_age=30 * 86400,
+                 orphan_age=default_orphan_age):
+        self.logger = logger
+        self.lock = threading.RLock()
+        if cache_dir is None:
+            cache_dir = default_cache_dir
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.orphan_age = orphan_age
+
+        self.index_path = os.path.join(self.cache_dir, 'index.json')
+        self.lock_path = os.path.join(self.cache_dir, 'index.lock')
+        # key -> dict(size, created, used, text, voice, volume)
+        self.index = {}
+        # keys we have removed since we last wrote the index, which are
+        # not to be merged back in from it
+        self.removed = set([])
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._load_index()
+
+    @contextmanager
+    def _locked(self):
+        # Hold the lock on the cache directory, which we share with any
+        # other processes using it
+        with open(self.lock_path, 'a') as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r') as in_f:
+                return json.load(in_f)
+
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _merge_index(self, index):
+        # Add the entries of `index` that we don't have and whose files
+        # exist, and take later use times from it
+        for key, info in index.items():
+            if key in self.removed:
+                continue
+            ours = self.index.get(key, None)
+            if ours is not None:
+                ours['used'] = max(ours['used'], info['used'])
+            elif os.path.exists(self.get_path(key)):
+                self.index[key] = info
+                self.total_bytes += info['size']
+
+    def _load_index(self):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, mode=0o700)
+            with self._locked():
+                self._merge_index(self._read_index())
+
+                # remove files we don't know about that are too old to be
+                # still being written by another process
+                now = time.time()
+                for fname in os.listdir(self.cache_dir):
+                    key, ext = os.path.splitext(fname)
+                    if ext != '.wav' or key in self.index:
+                        continue
+                    try:
+                        mtime = os.path.getmtime(os.path.join(self.cache_dir,
+                                                              fname))
+                    except OSError:
+                        continue
+                    if now - mtime > self.orphan_age:
+                        self._remove_file(key)
+
+        except (IOError, OSError) as e:
+            self.logger.warning("TTS cache: cannot load index: %s" % (
+                str(e)))
+
+        self._evict()
+        self.logger.info("TTS cache: %d phrases (%d bytes) in %s" % (
+            len(self.index), self.total_bytes, self.cache_dir))
+
+    def _save_index(self, keep=None):
+        # Called with our lock held
+        tmppath = self.index_path + '.tmp'
+        try:
+            with self._locked():
+                # take in what other processes have added since
+                self._merge_index(self._read_index())
+                self._evict(keep=keep)
+                with open(tmppath, 'w') as out_f:
+                    json.dump(self.index, out_f)
+                os.replace(tmppath, self.index_path)
+            self.removed.clear()
+
+        except (IOError, OSError) as e:
+            self.logger.warning("TTS cache: cannot save index: %s" % (
+                str(e)))
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + '.wav')
+
+    def make_tmppath(self):
+        """Return a path in the cache directory to synthesize into."""
+        # NOTE: keep the .wav extension, so that one left behind by a
+        # crash is removed with the other orphaned files
+        fd, tmppath = tempfile.mkstemp(prefix='tmp', suffix='.wav',
+                                       dir=self.cache_dir)
+        os.close(fd)
+        return tmppath
+
+    def lookup(self, key):
+        """Return the path of the cached WAV file for `key`, or None."""
+        with self.lock:
+            info = self.index.get(key, None)
+            if info is None:
+                self.misses += 1
+                return None
+            path = self.get_path(key)
+            if not os.path.exists(path):
+                self.total_bytes -= info['size']
+                del self.index[key]
+                self.removed.add(key)
+                self.misses += 1
+                return None
+            info['used'] = time.time()
+            self.hits += 1
+            return path
+
+    def add(self, key, tmppath, text, voice, volume):
+        """Move the synthesized WAV file `tmppath` into the cache under
+        `key` and return its cached path.
+        """
+        path = self.get_path(key)
+        size = os.path.getsize(tmppath)
+        os.replace(tmppath, path)
+        now = time.time()
+        with self.lock:
+            old = self.index.get(key, None)
+            if old is not None:
+                self.total_bytes -= old['size']
+            self.index[key] = dict(size=size, created=now, used=now,
+                                   text=text, voice=voice, volume=volume)
+            self.total_bytes += size
+            self.removed.discard(key)
+            self._save_index(keep=key)
+        return path
+
+    def add_data(self, key, data, text, voice, volume):
+        """Add the contents of a synthesized WAV file `data` to the cache
+        under `key` and return its cached path.
+        """
+        tmppath = self.make_tmppath()
+        try:
+            with open(tmppath, 'wb') as out_f:
+                out_f.write(data)
+            return self.add(key, tmppath, text, voice, volume)
+
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self.get_path(key))
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        # drop entries that are too old, then least recently used ones
+        # until we are within our limits
+        now = time.time()
+        entries = sorted(self.index.items(), key=lambda item: item[1]['used'])
+        for key, info in entries:
+            if key == keep:
+                continue
+            expired = (self.max_age is not None and
+                       now - info['created'] > self.max_age)
+            too_big = (self.total_bytes > self.max_bytes or
+                       len(self.index) > self.max_entries)
+            if not (expired or too_big):
+                continue
+            self.logger.debug("TTS cache: evicting '%s'" % (info['text']))
+            del self.index[key]
+            self.total_bytes -= info['size']
+            self.removed.add(key)
+            self._remove_file(key)
+
+    def flush(self):
+        """Write out the index, to record last use times."""
+        with self.lock:
+            self._save_index()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        phrases=len(self.index), bytes=self.total_bytes,
+                        max_bytes=self.max_bytes,
+                        max_entries=self.max_entries)
+
+
+def load_phrases(filepath):
+    """Read a list of phrases to prewarm from `filepath`.
+
+    Each line holds a phrase, optionally followed by a voice and volume
+    (dB) separated by tabs.  Blank lines and lines starting with '#' are
+    ignored.  Returns a list of (text, voice, volume) tuples, with None
+    for any values not given.
+    """
+    phrases = []
+    with open(filepath, 'r') as in_f:
+        for line in in_f:
+            line = line.rstrip('\n')
+            if len(line.strip()) == 0 or line.lstrip().startswith('#'):
+                continue
+            fields = line.split('\t')
+            text = fields[0].strip()
+            voice = fields[1].strip() if len(fields) > 1 else None
+            volume = int(fields[2]) if len(fields) > 2 else None
+            phrases.append((text, voice, volume))
+    return phrases
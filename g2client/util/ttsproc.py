@@ -0,0 +1,98 @@
+#
+# Speech synthesis for the Gen2 sound source.
+#
+"""
+Speech synthesis for the Gen2 sound source.
+
+`flite` is run with its arguments passed directly (no shell) and writes
+the WAV file to a pipe, so the synthesized speech is read straight into
+memory.  Adjusting the volume, which flite has no control for, and any
+resampling are done in-process with numpy, so no intermediate files and
+no `sox` are needed.  Without numpy we fall back to `sox`, run on temp
+files.
+"""
+import os
+import tempfile
+import subprocess
+
+from g2client.util import audio, mixer
+from g2client.util.optional import have_numpy, get_numpy
+
+
+class TTSError(Exception):
+    pass
+
+
+def synthesize(text, voice='slt', flitecmd='flite', timeout=30.0):
+    """Synthesize `text` with `voice`, returning the contents of a WAV
+    file.
+    """
+    cmd = [flitecmd, '-t', text, '-voice', voice, '-o', '/dev/stdout']
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, timeout=timeout)
+
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise TTSError("error running %s: %s" % (flitecmd, str(e)))
+
+    if proc.returncode != 0:
+        raise TTSError("%s failed (res=%d): %s" % (
+            flitecmd, proc.returncode,
+            proc.stderr.decode('utf-8', 'replace').strip()))
+    return proc.stdout
+
+
+def process(data, volume=0, rate=None):
+    """Change the volume of WAV file contents `data` by `volume` dB and
+    resample it to `rate` (if not None), returning the contents of a
+    16-bit WAV file.
+    """
+    if volume == 0 and rate is None:
+        return data
+    if not have_numpy:
+        return _process_sox(data, volume, rate)
+    np = get_numpy()
+
+    try:
+        spec, offset, length = audio.parse_pcm(data)
+    except audio.AudioError as e:
+        raise TTSError("cannot process synthesized speech: %s" % str(e))
+    length -= length % (spec.width * spec.channels)
+    samples = mixer.to_float(spec, memoryview(data)[offset:offset + length])
+
+    if volume != 0:
+        samples = samples * (10.0 ** (volume / 20.0))
+    if rate is not None and rate != spec.rate:
+        samples = mixer.convert(samples, spec.rate, rate, spec.channels)
+    else:
+        rate = spec.rate
+
+    samples = np.clip(np.rint(samples * 32767.0), -32768, 32767).astype('<i2')
+    out_spec = audio.PCMSpec('s16le', rate, spec.channels, 2)
+    return mixer.make_wav(out_spec, samples.tobytes())
+
+
+def _process_sox(data, volume, rate):
+    fd, inpath = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    fd, outpath = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    try:
+        with open(inpath, 'wb') as out_f:
+            out_f.write(data)
+        cmd = ['sox', inpath, outpath, 'vol', '%ddb' % volume]
+        if rate is not None:
+            cmd.extend(['rate', str(rate)])
+        try:
+            res = subprocess.call(cmd)
+        except OSError as e:
+            raise TTSError("error running sox: %s" % str(e))
+        if res != 0:
+            raise TTSError("sox failed (res=%d)" % (res))
+        with open(outpath, 'rb') as in_f:
+            return in_f.read()
+
+    finally:
+        for path in (inpath, outpath):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,211 @@
+#
+# Probing of the link to a VNC server, to choose viewer settings.
+#
+"""
+Probing of the link to a VNC server, to choose viewer settings.
+
+A `LinkProber` times a few TCP connections to the RFB port of a VNC
+server, checking that it answers with an RFB version greeting, and takes
+the median connect time as the round trip time of the link and the
+median deviation from that as its jitter (so that a single slow
+connection does not count against it).  These choose the first of a
+list of named profiles whose limits the link is within, and the profile
+gives the encoding, quality and compression options to pass to the
+(TigerVNC) viewer.
+
+NOTE: a VNC server sends nothing in bulk before a client has
+authenticated, so the throughput of the link is not measured.
+
+Each profile is a dict with
+  name        the name of the profile
+  max_rtt     the longest round trip time (sec) it is good for (None for
+              any)
+  max_jitter  the most jitter (sec) it is good for (None for any)
+  options     a dict of viewer parameters and their values
+and the profiles are given best first.
+"""
+import time
+import socket
+import threading
+
+from g2base import Bunch
+
+default_profiles = [
+    dict(name='lan', max_rtt=0.005, max_jitter=0.002,
+         options=dict(AutoSelect=0, PreferredEncoding='Hextile',
+                      FullColor=1)),
+    dict(name='wan', max_rtt=0.080, max_jitter=0.020,
+         options=dict(AutoSelect=0, PreferredEncoding='Tight',
+                      QualityLevel=6, CompressLevel=2, FullColor=1)),
+    dict(name='constrained', max_rtt=None, max_jitter=None,
+         options=dict(AutoSelect=0, PreferredEncoding='Tight',
+                      QualityLevel=2, CompressLevel=9, FullColor=0,
+                      LowColorLevel=1)),
+]
+
+# Profile to use when the server cannot be probed
+default_profile = 'wan'
+
+
+def parse_display(remotedisp):
+    """Return the (host, port) of VNC server display `remotedisp`, given
+    as 'host:display' or 'host::port' (as for vncviewer).
+    """
+    if '::' in remotedisp:
+        host, port = remotedisp.split('::', 1)
+        return host, int(port)
+    host, _, display = remotedisp.rpartition(':')
+    display = int(display) if display else 0
+    # like vncviewer, take large display numbers as port numbers
+    if display >= 100:
+        return host, display
+    return host, 5900 + display
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def probe(host, port, count=3, timeout=2.0):
+    """Time `count` connections to the VNC server at `host`:`port`.
+    Returns a Bunch of the median round trip time (sec) as rtt, the
+    median deviation from it as jitter, and the number of connections
+    that failed, or None if none succeeded.
+    """
+    samples = []
+    num_failed = 0
+    for i in range(count):
+        try:
+            time_start = time.time()
+            sock = socket.create_connection((host, port), timeout=timeout)
+            time_connect = time.time() - time_start
+            try:
+                greeting = sock.recv(12)
+            finally:
+                sock.close()
+            if not greeting.startswith(b'RFB '):
+                num_failed += 1
+                continue
+            samples.append(time_connect)
+
+        except (socket.error, socket.timeout):
+            num_failed += 1
+
+    if len(samples) == 0:
+        return None
+    rtt = median(samples)
+    return Bunch.Bunch(rtt=rtt,
+                       jitter=median([abs(sample - rtt)
+                                      for sample in samples]),
+                       failed=num_failed, time=time.time())
+
+
+def get_options(profile):
+    """Return the viewer command line parameters for `profile`."""
+    return ' '.join(['%s=%s' % (key, profile['options'][key])
+                     for key in sorted(profile['options'].keys())])
+
+
+class LinkProber(object):
+
+    def __init__(self, logger, profiles=None, count=3, timeout=2.0,
+                 cache_time=10.0):
+        self.logger = logger
+        self.count = count
+        self.timeout = timeout
+        # probes of a server made within this time (sec) are reused
+        self.cache_time = cache_time
+        self.lock = threading.Lock()
+        # (host, port) -> result of the last probe
+        self.results = {}
+        self.set_profiles(profiles)
+
+    def set_profiles(self, profiles):
+        """Use the list of `profiles` (see above) to choose viewer
+        settings, or the default ones if None.
+        """
+        if profiles is None:
+            profiles = default_profiles
+        with self.lock:
+            self.profiles = [dict(profile) for profile in profiles]
+
+    def get_profile(self, name):
+        """Return the profile called `name`.  Raises KeyError if there
+        is none.
+        """
+        with self.lock:
+            for profile in self.profiles:
+                if profile['name'] == name:
+                    return profile
+        raise KeyError(name)
+
+    def get_profile_names(self):
+        with self.lock:
+            return [profile['name'] for profile in self.profiles]
+
+    def get_last_result(self, remotedisp):
+        """Return the result of the last probe of the link to VNC server
+        display `remotedisp`, however old, or None if it was never
+        probed.
+        """
+        host, port = parse_display(remotedisp)
+        with self.lock:
+            return self.results.get((host, port), None)
+
+    def get_result(self, remotedisp):
+        """Return the result of a recent probe of the link to VNC server
+        display `remotedisp`, or None if there is none.
+        """
+        res = self.get_last_result(remotedisp)
+        if res is not None and time.time() - res.time < self.cache_time:
+            return res
+        return None
+
+    def probe(self, remotedisp, use_cache=True):
+        """Probe the link to VNC server display `remotedisp`, returning
+        the result (see probe()) or None if it could not be reached.
+        """
+        if use_cache:
+            res = self.get_result(remotedisp)
+            if res is not None:
+                return res
+
+        host, port = parse_display(remotedisp)
+
+        res = probe(host, port, count=self.count, timeout=self.timeout)
+        if res is None:
+            self.logger.warning("could not probe VNC server %s" % (
+                remotedisp))
+            return None
+        self.logger.debug("link to %s: rtt %.1f ms, jitter %.1f ms" % (
+            remotedisp, res.rtt * 1000.0, res.jitter * 1000.0))
+        with self.lock:
+            self.results[(host, port)] = res
+        return res
+
+    def select(self, res):
+        """Return the best profile for link probe result `res`."""
+        if res is None:
+            try:
+                return self.get_profile(default_profile)
+            except KeyError:
+                pass
+        with self.lock:
+            profiles = list(self.profiles)
+        if res is not None:
+            for profile in profiles:
+                max_rtt = profile.get('max_rtt', None)
+                max_jitter = profile.get('max_jitter', None)
+                if ((max_rtt is None or res.rtt <= max_rtt) and
+                    (max_jitter is None or res.jitter <= max_jitter)):
+                    return profile
+        # the worst one we have
+        return profiles[-1]
+
+    def choose(self, remotedisp, use_cache=True):
+        """Probe the link to `remotedisp` and choose a profile for it.
+        Returns a tuple of the profile and the probe result.
+        """
+        res = self.probe(remotedisp, use_cache=use_cache)
+        return self.select(res), res